@@ -0,0 +1,310 @@
+"""
+Banco de pruebas reproducible: construye los indices de cada configuracion sobre los corpus
+y repite las consultas de los ficheros de results/, midiendo:
+
+    - construccion: tiempo de indexado y de guardado, pico de memoria (RSS) y tamaño en disco
+    - consultas: tiempo de carga del indice, primera pasada (con la carga perezosa de los
+      componentes) y percentiles p50/p95/p99 de la latencia por clase de consulta
+
+Cada construccion y cada repeticion de consultas se hace en un proceso nuevo, asi el pico de
+memoria es el de esa configuracion y la carga del indice es en frio (sin contar la cache de
+paginas del sistema). La cache de subconsultas se desactiva para medir cada consulta entera.
+
+Clases de consulta (una consulta puede estar en varias):
+    - term: sin comodines, posicionales, otros campos ni NOT
+    - wildcard: algun termino con * o ?
+    - phrase: alguna consulta posicional (varias palabras seguidas)
+    - multifield: algun termino de un campo distinto de 'article'
+    - not: algun NOT
+    - stem: todas las consultas del fichero repetidas con stemming
+
+Las consultas de una clase que la configuracion no permite (por ejemplo comodines sin permuterm)
+no se repiten, solo se cuentan en "skipped".
+
+El resultado es un JSON con las claves ordenadas, para poder comparar dos ejecuciones con diff.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import SAR_query
+from SAR_lib import SAR_Project, peak_memory
+
+
+# configuraciones --> opciones de SAR_Project.index_dir (las mismas que -S, -P, -M y -O de SAR_Indexer.py)
+CONFIGS = {'plain': {},
+           'S': {'stem': True},
+           'SP': {'stem': True, 'permuterm': True},
+           'SPM': {'stem': True, 'permuterm': True, 'multifield': True},
+           'SPMO': {'stem': True, 'permuterm': True, 'multifield': True, 'positional': True}}
+
+# ficheros de consultas que se repiten
+QUERY_FILES = ('results/queries_full.txt', 'results/queries_minimo.txt')
+
+CLASSES = ('term', 'wildcard', 'phrase', 'multifield', 'not', 'stem')
+
+
+def peak_rss():
+    """
+    Devuelve el pico de memoria residente del proceso en MB (None si no se puede medir).
+    """
+    rss = peak_memory()
+    return None if rss is None else round(rss / 2 ** 20, 1)
+
+
+def disk_size(path):
+    """
+    Devuelve el tamaño en bytes de un fichero o de todos los ficheros de un directorio.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dir, filename))
+               for dir, _, files in os.walk(path) for filename in files)
+
+
+def isolated(fnc, *args):
+    """
+    Ejecuta fnc(*args) en un proceso nuevo (spawn) y devuelve su resultado.
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(fnc, args)
+
+
+###############################
+###                         ###
+###      CONSTRUCCION       ###
+###                         ###
+###############################
+
+def build(corpus, config, path, binary=False):
+    """
+    Construye y guarda el indice de una configuracion.
+
+    param:  "corpus": directorio de noticias
+            "config": nombre de la configuracion (ver CONFIGS)
+            "path": fichero o directorio destino
+            "binary": si es True se guarda en el formato binario
+
+    return: diccionario con las medidas de la construccion
+    """
+    base_rss = peak_rss()
+    options = dict(stem=False, permuterm=False, multifield=False, positional=False)
+    options.update(CONFIGS[config])
+
+    t0 = time.perf_counter()
+    indexer = SAR_Project()
+    indexer.index_dir(corpus, **options)
+    t1 = time.perf_counter()
+    indexer.save(path, binary=binary)
+    t2 = time.perf_counter()
+
+    return {'build_s': round(t1 - t0, 3),
+            'save_s': round(t2 - t1, 3),
+            'base_rss_mb': base_rss,
+            'peak_rss_mb': peak_rss(),
+            'size_bytes': disk_size(path),
+            'news': len(indexer.news),
+            'tokens': {field: len(indexer.index[field]) for field in indexer.index}}
+
+
+###############################
+###                         ###
+###        CONSULTAS        ###
+###                         ###
+###############################
+
+def read_queries(filename):
+    """
+    Lee un fichero de consultas (una por linea, las lineas vacias y las que empiezan por '#'
+    no son consultas; si hay un tabulador, lo que hay detras es el resultado esperado).
+    """
+    with open(filename) as fh:
+        return [line.split('\t')[0] for line in fh.read().split('\n')
+                if len(line) > 0 and not line.startswith('#')]
+
+
+def query_classes(query):
+    """
+    Devuelve las clases de una consulta (sin 'stem', ver el docstring del modulo).
+    """
+    classes = set()
+    stack = [SAR_query.parse(query)]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        if isinstance(node, SAR_query.Not):
+            classes.add('not')
+        elif isinstance(node, SAR_query.Phrase):
+            classes.add('phrase')
+        elif isinstance(node, SAR_query.Term) and ('*' in node.term or '?' in node.term):
+            classes.add('wildcard')
+        if isinstance(node, (SAR_query.Term, SAR_query.Phrase)) and node.field != 'article':
+            classes.add('multifield')
+        stack.extend(SAR_query.children(node))
+    return classes or {'term'}
+
+
+def supported(config, classes):
+    """
+    Indica si una configuracion permite todas las clases de una consulta.
+    """
+    options = CONFIGS[config]
+    required = {'wildcard': 'permuterm', 'phrase': 'positional', 'multifield': 'multifield', 'stem': 'stem'}
+    return all(options.get(required[cls], False) for cls in classes if cls in required)
+
+
+def percentiles(samples):
+    """
+    Resume una lista de latencias en segundos: numero de muestras y p50/p95/p99 en milisegundos.
+    """
+    if not samples:
+        return {'n': 0}
+    if len(samples) == 1:
+        cuts = samples * 99
+    else:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'n': len(samples),
+            'p50_ms': round(cuts[49] * 1000, 4),
+            'p95_ms': round(cuts[94] * 1000, 4),
+            'p99_ms': round(cuts[98] * 1000, 4)}
+
+
+def replay(path, config, query_files, repeat):
+    """
+    Carga un indice y repite las consultas de "query_files" "repeat" veces.
+
+    param:  "path": indice guardado
+            "config": nombre de la configuracion con la que se ha construido
+            "query_files": ficheros de consultas
+            "repeat": numero de repeticiones de cada consulta
+
+    return: diccionario con las medidas, por fichero y clase de consulta
+    """
+    t0 = time.perf_counter()
+    searcher = SAR_Project.load(path)
+    load_s = time.perf_counter() - t0
+    searcher.set_query_cache(0)
+
+    res = {'load_s': round(load_s, 4), 'files': {}}
+    for filename in query_files:
+        queries = read_queries(filename)
+        runs = []
+        skipped = dict.fromkeys(CLASSES, 0)
+        for query in queries:
+            classes = query_classes(query)
+            if supported(config, classes):
+                runs.append((query, False, classes))
+            else:
+                for cls in classes:
+                    skipped[cls] += 1
+            if supported(config, classes | {'stem'}):
+                runs.append((query, True, {'stem'}))
+            else:
+                skipped['stem'] += 1
+
+        samples = {cls: [] for cls in CLASSES}
+        # cada consulta sin stemming una sola vez, aunque este en varias clases
+        samples['all'] = []
+        first_pass = 0.0
+        for i in range(repeat + 1):
+            for query, stem, classes in runs:
+                searcher.set_stemming(stem)
+                t0 = time.perf_counter()
+                searcher.solve_query(query)
+                elapsed = time.perf_counter() - t0
+                # La primera pasada incluye la carga de los componentes del indice, no se cuenta
+                if i == 0:
+                    first_pass += elapsed
+                    continue
+                for cls in classes:
+                    samples[cls].append(elapsed)
+                if not stem:
+                    samples['all'].append(elapsed)
+
+        res['files'][os.path.basename(filename)] = {
+            'first_pass_s': round(first_pass, 4),
+            'classes': {cls: dict(percentiles(samples[cls]), skipped=skipped[cls]) for cls in CLASSES},
+            'all': percentiles(samples['all'])}
+    res['peak_rss_mb'] = peak_rss()
+    return res
+
+
+def run(corpora, configs, query_files, repeat, binary, workdir):
+    """
+    Ejecuta el banco de pruebas completo.
+
+    return: diccionario con el resultado (ver el docstring del modulo)
+    """
+    results = {}
+    for corpus in corpora:
+        name = os.path.basename(os.path.normpath(corpus))
+        results[name] = {}
+        for config in configs:
+            path = os.path.join(workdir, '{}_{}.{}'.format(name, config, 'bin' if binary else 'pkl'))
+            print('{} {}: building...'.format(name, config), file=sys.stderr, flush=True)
+            measures = {'build': isolated(build, corpus, config, path, binary)}
+            print('{} {}: replaying queries...'.format(name, config), file=sys.stderr, flush=True)
+            measures['queries'] = isolated(replay, path, config, query_files, repeat)
+            results[name][config] = measures
+
+    # No se incluye la fecha para que dos ejecuciones se puedan comparar con diff
+    return {'meta': {'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpus': os.cpu_count(),
+                     'format': 'binary' if binary else 'pickle',
+                     'repeat': repeat,
+                     'query_files': [os.path.basename(f) for f in query_files]},
+            'results': results}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark index construction and query latency.')
+
+    parser.add_argument('-c', '--corpus', dest='corpora', metavar='dir', nargs='+',
+                        default=['corpora/2015', 'corpora/2016'],
+                        help='directories with the news to index.')
+
+    parser.add_argument('--configs', dest='configs', nargs='+', choices=list(CONFIGS), default=list(CONFIGS),
+                        help='index configurations to benchmark.')
+
+    parser.add_argument('-q', '--queries', dest='queries', metavar='file', nargs='+', default=list(QUERY_FILES),
+                        help='files with the queries to replay.')
+
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5,
+                        help='number of timed passes over the queries (after one warm-up pass).')
+
+    parser.add_argument('-F', '--format', dest='format', choices=['pickle', 'binary'], default='pickle',
+                        help='format of the saved indexes.')
+
+    parser.add_argument('-w', '--workdir', dest='workdir', type=str, default=None,
+                        help='directory for the indexes (kept). By default a temporary directory is used and removed.')
+
+    parser.add_argument('-o', '--output', dest='output', type=str, default=None,
+                        help='JSON file for the results. By default they are written to the standard output.')
+
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sar_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = run(args.corpora, args.configs, args.queries, args.repeat, args.format == 'binary', workdir)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as fh:
+            fh.write(text + '\n')
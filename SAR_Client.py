@@ -0,0 +1,118 @@
+"""
+Cliente de SAR_Server.py: envia consultas al servidor y muestra cada respuesta como una linea JSON.
+"""
+
+import argparse
+import asyncio
+import json
+
+
+# longitud maxima de una respuesta (una linea), las de "all" sobre muchas noticias pasan del limite de asyncio (64 KB)
+LINE_LIMIT = 1 << 30
+
+
+async def connect(host='127.0.0.1', port=8765, unix=None):
+    """
+    Abre una conexion con el servidor.
+
+    param:  "host", "port": direccion TCP del servidor
+            "unix": ruta del socket Unix, si se da se usa en lugar de TCP
+
+    return: tupla (reader, writer) de asyncio
+    """
+    if unix is not None:
+        return await asyncio.open_unix_connection(unix, limit=LINE_LIMIT)
+    return await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+
+
+async def send_requests(requests, host='127.0.0.1', port=8765, unix=None):
+    """
+    Envia una lista de peticiones por una sola conexion y devuelve sus respuestas.
+
+    Las peticiones se envian todas seguidas (el servidor contesta en orden), asi no se
+    espera a cada respuesta para mandar la siguiente.
+
+    param:  "requests": lista de peticiones (diccionarios, ver SAR_Server)
+            "host", "port", "unix": direccion del servidor (ver "connect")
+
+    return: lista de respuestas, en el orden de las peticiones
+    """
+    reader, writer = await connect(host, port, unix)
+    try:
+        for request in requests:
+            writer.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        await writer.drain()
+        responses = []
+        for _ in requests:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError('the server closed the connection')
+            responses.append(json.loads(line))
+        return responses
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Send queries to SAR_Server.py.')
+
+    parser.add_argument('--host', dest='host', type=str, default='127.0.0.1',
+                        help='address of the server.')
+
+    parser.add_argument('--port', dest='port', type=int, default=8765,
+                        help='TCP port of the server.')
+
+    parser.add_argument('--unix', dest='unix', metavar='path', type=str, default=None,
+                        help='connect to a Unix socket instead of TCP.')
+
+    parser.add_argument('-S', '--stem', dest='stem', action='store_true', default=False,
+                    help='use stem index by default.')
+
+    group0 = parser.add_mutually_exclusive_group()
+
+    group0.add_argument('-N', '--snippet', dest='snippet', action='store_true', default=False,
+                    help='include a snippet of the retrieved documents.')
+
+    group0.add_argument('-C', '--count', dest='count', action='store_true', default=False,
+                    help='ask only for the number of documents retrieved.')
+
+    parser.add_argument('-A', '--all', dest='all', action='store_true', default=False,
+                    help='ask for all the results. If not used, only the first 10 results are returned.')
+
+    parser.add_argument('-R', '--rank', dest='rank', nargs='?', choices=['jaccard', 'bm25'], const='jaccard', default=None,
+                    help='rank results, with jaccard (default) or bm25. Does not apply with -C option.')
+
+    group1 = parser.add_mutually_exclusive_group()
+    group1.add_argument('-Q', '--query', dest='query', metavar='query', type=str, action='store',
+                    help='query.')
+    group1.add_argument('-L', '--list', dest='qlist', metavar='qlist', type=str, action='store',
+                    help='file with queries.')
+
+    args = parser.parse_args()
+
+    if args.count:
+        base = {'op': 'count'}
+    elif args.rank is not None:
+        base = {'op': 'rank', 'mode': args.rank}
+    else:
+        base = {'op': 'show'}
+    base.update(stem=args.stem, all=args.all, snippet=args.snippet)
+
+    def run(queries):
+        requests = [dict(base, query=query) for query in queries]
+        for response in asyncio.run(send_requests(requests, args.host, args.port, args.unix)):
+            print(json.dumps(response, ensure_ascii=False))
+
+    if args.query is not None:
+        run([args.query])
+    elif args.qlist is not None:
+        with open(args.qlist) as fh:
+            run([query for query in fh.read().split('\n') if len(query) > 0 and not query.startswith('#')])
+    else:
+        # modo interactivo
+        query = input("query:")
+        while query != "":
+            run([query])
+            query = input("query:")
@@ -1,8 +1,9 @@
 import argparse
-import pickle
+import os
 import sys
 import time
 
+import SAR_storage
 from SAR_lib import SAR_Project
 
 
@@ -21,25 +22,78 @@ if __name__ == "__main__":
     parser.add_argument('-P', '--permuterm', dest='permuterm', action='store_true', default=False,
                     help='compute permuterm index.')
 
+    parser.add_argument('-K', '--kgram', dest='kgram', action='store_true', default=False,
+                    help='compute k-gram index for wildcard queries (allows several wildcards per term).')
+
+    parser.add_argument('--rank-data', dest='rank_data', action='store_true', default=False,
+                    help='compute the structures used only for ranking (BM25 top-k bounds and jaccard forward index). '
+                         'Faster ranking, more memory and disk.')
+
+    parser.add_argument('--minhash', dest='minhash', action='store_true', default=False,
+                    help='compute MinHash sketches of the news to estimate jaccard ranking of large result sets '
+                         '(needs --rank-data).')
+
+    parser.add_argument('--lazy', dest='lazy', action='store_true', default=False,
+                    help='pickle each field of each structure separately and load it on first use '
+                         '(faster searcher startup, larger file).')
+
     parser.add_argument('-M', '--multifield', dest='multifield', action='store_true', default=False, 
                     help='compute index for all the fields.')
 
     parser.add_argument('-O', '--positional', dest='positional', action='store_true', default=False, 
                     help='compute positional index.')
 
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                    help='number of processes used to index the news.')
+
+    parser.add_argument('-u', '--update', dest='update', action='store_true', default=False,
+                    help='update an existing index with the new or modified files of newsdir.')
+
+    parser.add_argument('-Z', '--compress', dest='compress', action='store_true', default=False,
+                    help='compress the posting lists (delta + variable-byte encoding).')
+
+    parser.add_argument('-C', '--compact', dest='compact', action='store_true', default=False,
+                    help='store the posting lists and the news and docs tables in typed arrays.')
+
+    parser.add_argument('--memory', dest='memory', action='store_true', default=False,
+                    help='show the memory used by each index structure and the peak memory while indexing.')
+
+    parser.add_argument('-F', '--format', dest='format', choices=['pickle', 'binary'], default=None,
+                    help='format of the saved index: pickled object (default) or memory-mapped binary directory. '
+                         'With -u the format of the existing index is kept.')
+
     args = parser.parse_args()
 
     newsdir = args.newsdir
     indexfile = args.index
 
-    indexer = SAR_Project()
+    if args.minhash and not args.rank_data:
+        parser.error('--minhash needs the jaccard forward index, use it with --rank-data')
+
+    update = args.update and os.path.exists(indexfile)
+    if update:
+        # Al actualizar se guarda en el mismo formato que el indice existente
+        existing = 'binary' if os.path.isdir(indexfile) else 'pickle'
+        if args.format is not None and args.format != existing:
+            parser.error('%s is a %s index, it cannot be updated with -F %s' % (indexfile, existing, args.format))
+        args.format = existing
+    elif args.format is None:
+        args.format = 'pickle'
+
     t0 = time.time()
-    indexer.index_dir(newsdir, **vars(args))
+    if update:
+        # se carga el indice y solo se indexan los ficheros nuevos o modificados
+        indexer = SAR_Project.load(indexfile)
+        SAR_storage.materialize(indexer)
+        added, changed = indexer.update_dir(newsdir, args.jobs)
+        print("Updated files: %d new, %d modified." % (added, changed))
+    else:
+        indexer = SAR_Project()
+        indexer.index_dir(newsdir, **vars(args))
     t1 = time.time()
-    with open(indexfile, 'wb') as fh:
-            pickle.dump(indexer, fh)
+    indexer.save(indexfile, binary=args.format == 'binary')
     t2 = time.time()
-    indexer.show_stats()
+    indexer.show_stats(memory=args.memory)
     print("Time indexing: %2.2fs." % (t1 - t0))
     print("Time saving: %2.2fs." % (t2 - t1))
     print()
\ No newline at end of file
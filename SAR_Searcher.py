@@ -1,5 +1,5 @@
 import argparse
-import pickle
+import json
 import sys
 
 from SAR_lib import SAR_Project
@@ -37,8 +37,24 @@ if __name__ == "__main__":
     parser.add_argument('-A', '--all', dest='all', action='store_true', default=False, 
                     help='show all the results. If not used, only the first 10 results are showed. Does not apply with -C and -T options.')
 
-    parser.add_argument('-R', '--rank', dest='rank', action='store_true', default=False, 
-                    help='rank results. Does not apply with -C and -T options.')
+    parser.add_argument('-R', '--rank', dest='rank', nargs='?', choices=['jaccard', 'bm25'], const='jaccard', default=None,
+                    help='rank results, with jaccard (default) or bm25. Does not apply with -C and -T options.')
+
+
+    parser.add_argument('-E', '--explain', dest='explain', action='store_true', default=False,
+                    help='show the optimized plan of each query before its results.')
+
+    parser.add_argument('--cache', dest='cache', metavar='size', type=int, default=None,
+                    help='maximum number of subquery results kept between queries (0 disables the cache).')
+
+    parser.add_argument('--cache-stats', dest='cache_stats', action='store_true', default=False,
+                    help='show the hits and misses of the subquery cache at the end.')
+
+    parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                    help='show a JSON line with the time of each stage and the postings and news read after each query.')
+
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                    help='number of processes to solve the queries of the -L and -T options.')
 
 
     group1 = parser.add_mutually_exclusive_group()
@@ -51,13 +67,16 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    with open(args.index, 'rb') as fh:
-        searcher = pickle.load(fh)
+    searcher = SAR_Project.load(args.index)
 
     searcher.set_stemming(args.stem)
-    searcher.set_ranking(args.rank)
+    searcher.set_ranking(args.rank is not None)
+    if args.rank is not None:
+        searcher.set_rank_mode(args.rank)
     searcher.set_showall(args.all)
     searcher.set_snippet(args.snippet)
+    if args.cache is not None:
+        searcher.set_query_cache(args.cache)
 
 
     # se debe contar o mostrar resultados?
@@ -65,17 +84,45 @@ if __name__ == "__main__":
         fnc = searcher.solve_and_count
     else:
         fnc = searcher.solve_and_show
+    count = searcher.solve_and_count
+
+    if args.profile:
+        # despues de cada consulta se muestra lo que ha costado cada etapa
+        searcher.set_profile(True)
+        def profiled(solve):
+            def fnc(query):
+                searcher.reset_profile()
+                result = solve(query)
+                print(json.dumps(searcher.profile_report(query), ensure_ascii=False))
+                return result
+            return fnc
+        fnc = profiled(fnc)
+        count = profiled(count)
+
+    if args.explain:
+        # se muestra el plan de cada consulta antes de resolverla, tambien con -T
+        def explained(solve):
+            def fnc(query):
+                print(searcher.explain(query))
+                return solve(query)
+            return fnc
+        fnc = explained(fnc)
+        count = explained(count)
 
     if args.test is not None:
         # opt: -T, testing
 
         with open(args.test) as fh:
             lines = fh.read().split('\n')
+            # las consultas se resuelven en orden (en paralelo con -j) y se muestran linea a linea
+            tests = [line.split('\t') for line in lines if len(line) > 0 and not line.startswith('#')]
+            results = searcher.solve_parallel(count, [query for query, _ in tests], args.jobs)
             for line in lines:
                 if len(line) > 0 and not line.startswith('#'):
                     query, reference = line.split('\t')
                     reference = int(reference)
-                    result = searcher.solve_and_count(query)
+                    output, result = next(results)
+                    sys.stdout.write(output)
                     if result != reference:
                         print("==> ERROR: '%s'\t%d\t%d" % (query, result, reference))
                         sys.exit(-1)
@@ -92,9 +139,11 @@ if __name__ == "__main__":
         with open(args.qlist) as fh:
             queries = fh.read().split('\n')
             queries.pop()
+            results = searcher.solve_parallel(fnc, [query for query in queries if len(query) > 0 and not query.startswith('#')], args.jobs)
             for query in queries:
                 if len(query) > 0 and not query.startswith('#'):
-                    fnc(query)
+                    output, _ = next(results)
+                    sys.stdout.write(output)
                 else:
                     print(query)
     else:
@@ -102,4 +151,7 @@ if __name__ == "__main__":
         query = input("query:")
         while query != "":
             fnc(query)
-            query = input("query:")
\ No newline at end of file
+            query = input("query:")
+
+    if args.cache_stats:
+        print(searcher.cache_stats())
@@ -0,0 +1,173 @@
+"""
+Servidor de consultas: carga el indice una sola vez y responde consultas hasta que se para.
+
+Protocolo: cada peticion y cada respuesta es un objeto JSON en una linea (terminada en '\\n'),
+por TCP o por un socket Unix. Una conexion puede enviar varias peticiones, las respuestas
+llegan en el mismo orden. Las conexiones se atienden a la vez y sus consultas se resuelven
+en paralelo en -j procesos (por defecto uno por CPU y como minimo dos), que comparten el
+indice cargado con fork. Con -j 1, o si el sistema no tiene fork, se resuelven de una en una.
+
+Peticion:
+    {"op": "count" | "show" | "rank", "query": "...",
+     "stem": false, "all": false, "snippet": false, "mode": "jaccard" | "bm25", "id": ...}
+
+    Solo "op" y "query" son obligatorios. "mode" es la funcion de ranking de "rank" y "id",
+    si se envia, se devuelve tal cual en la respuesta.
+
+Respuesta:
+    {"op": ..., "query": ..., "count": numero de noticias, "results": [...], "time": ms, "id": ...}
+
+    "results" (no se envia con "count") son las noticias que mostraria SAR_Searcher.py, con las
+    claves de SAR_Project.solve_and_list. Si la peticion no es valida: {"error": "...", "id": ...}
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import time
+
+from SAR_lib import SAR_Project
+
+
+# operaciones del protocolo
+OPERATIONS = ('count', 'show', 'rank')
+
+# indice cargado, los procesos de -j lo heredan con el fork
+searcher = None
+
+
+def answer(request):
+    """
+    Resuelve una peticion con el indice cargado. Se ejecuta en el pool de "serve", de uno en uno
+    en cada hilo o proceso, por lo que puede cambiar la configuracion de "searcher".
+
+    param:  "request": peticion ya decodificada
+
+    return: diccionario con la respuesta
+    """
+    if not isinstance(request, dict):
+        return {'error': 'the request must be a JSON object'}
+    response = {'id': request['id']} if 'id' in request else {}
+    op = request.get('op')
+    query = request.get('query')
+    mode = request.get('mode', 'jaccard')
+    if op not in OPERATIONS:
+        response['error'] = 'unknown op {!r}, expected one of {}'.format(op, ', '.join(OPERATIONS))
+    elif not isinstance(query, str):
+        response['error'] = 'the request needs a "query" string'
+    elif mode not in ('jaccard', 'bm25'):
+        response['error'] = 'unknown mode {!r}, expected jaccard or bm25'.format(mode)
+    if 'error' in response:
+        return response
+
+    searcher.set_stemming(bool(request.get('stem', False)))
+    searcher.set_showall(bool(request.get('all', False)))
+    searcher.set_snippet(bool(request.get('snippet', False)))
+    searcher.set_ranking(op == 'rank')
+    searcher.set_rank_mode(mode)
+
+    t0 = time.perf_counter()
+    response.update(op=op, query=query)
+    if op == 'count':
+        response['count'] = len(searcher.solve_query(query))
+    else:
+        response['count'], response['results'] = searcher.solve_and_list(query)
+    response['time'] = round((time.perf_counter() - t0) * 1000, 3)
+    return response
+
+
+async def serve(pool, host='127.0.0.1', port=8765, unix=None):
+    """
+    Atiende peticiones hasta que se interrumpe el proceso.
+
+    param:  "pool": pool (de hilos o de procesos) que ejecuta "answer"
+            "host", "port": direccion TCP en la que se escucha
+            "unix": ruta del socket Unix, si se da se usa en lugar de TCP
+
+    """
+    loop = asyncio.get_running_loop()
+
+    def submit(request):
+        # El pool avisa desde su hilo de resultados, se pasa al bucle de asyncio
+        future = loop.create_future()
+        pool.apply_async(answer, (request,),
+                         callback=lambda res: loop.call_soon_threadsafe(future.set_result, res),
+                         error_callback=lambda exc: loop.call_soon_threadsafe(future.set_exception, exc))
+        return future
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as exc:
+                    response = {'error': 'invalid JSON: {}'.format(exc)}
+                else:
+                    try:
+                        response = await submit(request)
+                    except Exception as exc:
+                        response = {'error': '{}: {}'.format(type(exc).__name__, exc)}
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if unix is not None:
+        server = await asyncio.start_unix_server(handle, unix)
+    else:
+        server = await asyncio.start_server(handle, host, port)
+    addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+    print('Listening on {}'.format(addresses), flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Serve queries over a loaded index (JSON lines over TCP or a Unix socket).')
+
+    parser.add_argument('index', metavar='index', type=str,
+                        help='name of the file with the index object.')
+
+    parser.add_argument('--host', dest='host', type=str, default='127.0.0.1',
+                        help='address to listen on.')
+
+    parser.add_argument('--port', dest='port', type=int, default=8765,
+                        help='TCP port to listen on (0 chooses a free one).')
+
+    parser.add_argument('--unix', dest='unix', metavar='path', type=str, default=None,
+                        help='listen on a Unix socket instead of TCP.')
+
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=max(2, os.cpu_count() or 1),
+                        help='number of processes that solve the queries concurrently (default: one per CPU, at least 2). '
+                             'With 1, queries are solved one after another.')
+
+    args = parser.parse_args()
+
+    searcher = SAR_Project.load(args.index)
+
+    # Los procesos se crean antes de arrancar el bucle de asyncio y comparten el indice cargado.
+    # "answer" cambia la configuracion de "searcher", por eso sin procesos se usa un unico hilo
+    # y las peticiones se resuelven de una en una
+    if args.jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Un indice guardado con --lazy se carga entero antes del fork para que los procesos lo compartan
+        searcher.load_components()
+        pool = multiprocessing.get_context('fork').Pool(args.jobs)
+    else:
+        pool = multiprocessing.pool.ThreadPool(1)
+
+    with pool:
+        try:
+            asyncio.run(serve(pool, args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
@@ -1,8 +1,32 @@
+import contextlib
+import functools
+import io
 import json
+from array import array
+from collections import OrderedDict
 from nltk.stem.snowball import SnowballStemmer
 import os
 import re
 import math
+import bisect
+import heapq
+import multiprocessing
+import itertools
+import pickle
+import random
+import sys
+import time
+import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import SAR_query
+import SAR_storage
+from SAR_postings import ArrayIndex, ArrayPosting, BitmapPosting, CompressedCursor, CompressedIndex, CompressedPosting, \
+    IterCursor, NewsTable, NotPosting, PostingCursor
 
 
 class SAR_Project:
@@ -25,6 +49,75 @@ class SAR_Project:
     # numero maximo de documento a mostrar cuando self.show_all es False
     SHOW_MAX = 10
 
+    # numero maximo de noticias decodificadas que se guardan en self.new_cache
+    NEW_CACHE_SIZE = 1000
+
+    # numero maximo de stems que se guardan en self.stem_cache (ver self.stem())
+    STEM_CACHE_SIZE = 200000
+
+    # numero maximo de subconsultas resueltas que se guardan en self.query_cache (ver self.evaluate())
+    QUERY_CACHE_SIZE = 1000
+
+    # separadores entre las noticias de un fichero JSON
+    JSON_SEP = re.compile(r'[\s,]*')
+
+    # tokens del texto original, para guardar donde empieza cada uno (ver self.tokenize_offsets())
+    WORD = re.compile(r'\w+')
+
+    # tokens que se muestran antes y despues de cada coincidencia en los snippets
+    SNIPPET_BEFORE = 4
+    SNIPPET_AFTER = 5
+
+    # operador de proximidad de las consultas posicionales: "a NEAR/k b"
+    NEAR = SAR_query.NEAR
+
+    # parametros de BM25
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+
+    # a partir de esta proporcion entre longitudes el AND usa busqueda exponencial
+    GALLOP_RATIO = 8
+
+    # un termino es denso (sus operaciones booleanas se hacen con un bitmap) si aparece en al menos 1 de cada BITMAP_RATIO noticias
+    BITMAP_RATIO = 32
+
+    # longitud de los k-gramas del indice de comodines (opcion -K)
+    KGRAM_K = 3
+
+    # numero maximo de posting lists para usar WAND, con mas se puntuan todos los resultados
+    WAND_MAX_TERMS = 32
+
+    # MinHash (opcion --minhash): funciones hash por noticia, semilla de sus coeficientes y primo de las funciones
+    MINHASH_SIZE = 64
+    MINHASH_SEED = 2020
+    MINHASH_PRIME = (1 << 31) - 1
+
+    # con mas resultados y MinHash en el indice, Jaccard se estima con MinHash en lugar de calcularse
+    MINHASH_MIN_RESULTS = 5000
+
+    # metodos que se miden con la opcion --profile (ver self.set_profile()) --> etapa de la consulta
+    PROFILE_STAGES = {'parse_query': 'parse',
+                      'optimize_query': 'optimize',
+                      'get_posting': 'fetch',
+                      'get_permuterm': 'fetch',
+                      'get_permuterm_terms': 'fetch',
+                      'get_stemming': 'fetch',
+                      'get_positionals': 'fetch',
+                      'and_posting': 'merge',
+                      'and_postings': 'merge',
+                      'or_posting': 'merge',
+                      'minus_posting': 'merge',
+                      'merge_positions': 'merge',
+                      'reverse_posting': 'reverse',
+                      'rank_result': 'rank',
+                      'jaccard': 'rank',
+                      'get_new': 'news',
+                      'snippet': 'snippet'}
+
+    # estructuras por campo que se guardan con pickle campo a campo y se cargan al usarlas (ver self.load_components())
+    COMPONENTS = ('index', 'sindex', 'spindex', 'ptindex', 'ptkeys', 'kindex', 'kterms',
+                  'lengths', 'term_bounds', 'offsets', 'term_ids', 'forward', 'sketches')
+
     def __init__(self):
         """
         Constructor de la classe SAR_Indexer.
@@ -46,25 +139,143 @@ class SAR_Project:
                        'article': {},
                        'summary': {}
                        }  # hash para el indice invertido de stems --> clave: stem, valor: lista con los terminos que tienen ese stem.
+        self.spindex = {'title': {},
+                        'date': {},
+                        'keywords': {},
+                        'article': {},
+                        'summary': {}
+                        }  # hash para las posting lists de los stems --> clave: stem, valor: posting list (newid --> frecuencia).
         self.ptindex = {'title': {},
                         'date': {},
                         'keywords': {},
                         'article': {},
                         'summary': {}
                         }  # hash para el indice permuterm.
+        self.ptkeys = {'title': [],
+                       'date': [],
+                       'keywords': [],
+                       'article': [],
+                       'summary': []
+                       }  # lista ordenada de las claves de self.ptindex, para buscar prefijos con bisect.
+        self.kindex = {'title': {},
+                       'date': {},
+                       'keywords': {},
+                       'article': {},
+                       'summary': {}
+                       }  # hash para el indice de k-gramas --> clave: k-grama, valor: array con los ids de termino.
+        self.kterms = {'title': [],
+                       'date': [],
+                       'keywords': [],
+                       'article': [],
+                       'summary': []
+                       }  # terminos del indice de k-gramas, la posicion es el id de termino.
+        self.offsets = {'title': {},
+                        'date': {},
+                        'keywords': {},
+                        'article': {},
+                        'summary': {}
+                        }  # inicio de cada token en el texto, solo en el indice posicional --> clave: newid, valor: array de caracteres.
         # diccionario de terminos --> clave: entero(docid),  valor: ruta del fichero.
         self.docs = {}
+        # diccionario de ficheros --> clave: entero(docid), valor: (fecha de modificacion, tamaño) al indexarlo
+        self.docs_stat = {}
         # hash de noticias --> clave entero (newid), valor: la info necesaria para diferencia la noticia dentro de su fichero
+        # [docid, posicion en el fichero, offset en bytes, longitud en bytes]
         self.news = {}
+        # cache LRU de noticias ya leidas --> clave: newid, valor: la noticia decodificada (ver self.get_new())
+        self.new_cache = OrderedDict()
         # expresion regular para hacer la tokenizacion
         self.tokenizer = re.compile(r'\W+')
         self.stemmer = SnowballStemmer('spanish')  # stemmer en castellano
+        # cache de stems ya calculados --> clave: termino, valor: stem (ver self.stem())
+        self.stem_cache = {}
+        # cache LRU de subconsultas resueltas --> clave: (stemming, clave del nodo), valor: resultado sin materializar
+        self.query_cache = OrderedDict()
+        self.query_cache_size = self.QUERY_CACHE_SIZE  # valor por defecto, se cambia con self.set_query_cache()
+        # aciertos y fallos de self.query_cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # tiempos y contadores de la consulta actual, None si no se miden (ver self.set_profile())
+        self.profile = None
         self.show_all = False  # valor por defecto, se cambia con self.set_showall()
         self.show_snippet = False  # valor por defecto, se cambia con self.set_snippet()
         self.use_stemming = False  # valor por defecto, se cambia con self.set_stemming()
         self.use_ranking = False  # valor por defecto, se cambia con self.set_ranking()
+        self.rank_mode = 'jaccard'  # valor por defecto, se cambia con self.set_rank_mode()
+        # puntuaciones del ultimo ranking --> clave: newid, valor: puntuacion
+        self.scores = {}
+        # longitud (numero de tokens) de cada campo de cada noticia --> clave: newid, valor: longitud
+        self.lengths = {'title': {},
+                        'date': {},
+                        'keywords': {},
+                        'article': {},
+                        'summary': {}
+                        }
+        # cotas de cada termino para el ranking top-k --> clave: termino, valor: (frecuencia maxima, longitud minima)
+        self.term_bounds = {'title': {},
+                            'date': {},
+                            'keywords': {},
+                            'article': {},
+                            'summary': {}
+                            }
+        # bitmaps de los terminos densos ya consultados (no se guardan con el indice, ver self.get_bitmap())
+        # --> clave: termino, valor: entero con un bit por newid o None si el termino no es denso
+        self.bitmaps = {'title': {},
+                        'date': {},
+                        'keywords': {},
+                        'article': {},
+                        'summary': {}
+                        }
+        # id de cada termino del indice directo --> clave: termino, valor: id (en orden de llegada)
+        self.term_ids = {'title': {},
+                         'date': {},
+                         'keywords': {},
+                         'article': {},
+                         'summary': {}
+                         }
+        # indice directo para Jaccard --> clave: newid, valor: array ordenado de ids de sus terminos
+        self.forward = {'title': {},
+                        'date': {},
+                        'keywords': {},
+                        'article': {},
+                        'summary': {}
+                        }
+        # MinHash de los terminos de cada noticia (opcion --minhash) --> clave: newid, valor: array de MINHASH_SIZE hashes
+        self.sketches = {'title': {},
+                         'date': {},
+                         'keywords': {},
+                         'article': {},
+                         'summary': {}
+                         }
+        # bitmap de todas las noticias indexadas, para los NOT (ver self.get_news_bitmap())
+        self.news_bitmap = None
+        # suma de las longitudes de cada campo, para la longitud media de BM25
+        self.total_length = {'title': 0,
+                             'date': 0,
+                             'keywords': 0,
+                             'article': 0,
+                             'summary': 0
+                             }
         self.doc_cont = 0
         self.new_cont = 0
+        # si es True hay indice de k-gramas para los comodines (ver self.make_kgrams())
+        self.kgram = False
+        # si es True hay MinHash de cada noticia para estimar Jaccard (ver self.make_sketches())
+        self.minhash = False
+        # si es True, con pickle cada campo de cada estructura se guarda aparte y se carga al usarlo (opcion --lazy)
+        self.lazy_fields = False
+        # si es True estan las estructuras que solo sirven para ordenar: cotas de BM25 (ver self.make_term_bounds())
+        # e indice directo para Jaccard (ver self.make_forward()), solo se calculan con la opcion --rank-data
+        self.rank_data = False
+        # si es True las posting lists de self.index estan comprimidas (ver self.compress_index())
+        self.compressed = False
+        # si es True el indice, self.news y self.docs se guardan en arrays (ver self.compact_index())
+        self.compact = False
+        # bytes por posting antes y despues de comprimir o compactar el indice
+        self.bytes_per_posting = None
+        # pico de memoria del proceso (bytes) antes de indexar, pico al terminar index_dir o update_dir
+        # y pico del mayor proceso de -j (None sin -j), None si no se puede medir (ver peak_memory())
+        self.index_memory = None
 
     ###############################
     ###                         ###
@@ -128,6 +339,57 @@ class SAR_Project:
         """
         self.use_ranking = v
 
+    def set_rank_mode(self, v):
+        """
+
+        Cambia la funcion de ranking.
+
+        input: "v" cadena, 'jaccard' o 'bm25'.
+
+        UTIL PARA LA VERSION CON RANKING DE NOTICIAS
+
+        con 'jaccard' se compara la consulta con los terminos de cada noticia (ver self.jaccard_ids()),
+        con 'bm25' se puntua solo con las posting lists y las estadisticas del indice (ver self.rank_bm25())
+
+        """
+        self.rank_mode = v
+
+    def set_query_cache(self, v):
+        """
+
+        Cambia el numero maximo de subconsultas resueltas que se guardan.
+
+        input: "v" entero, 0 desactiva la cache.
+
+        los resultados se guardan en self.query_cache (ver self.evaluate())
+
+        """
+        self.query_cache_size = v
+        while len(self.query_cache) > v:
+            self.query_cache.popitem(last=False)
+
+    def set_profile(self, v):
+        """
+
+        Activa o desactiva la medicion de las etapas de las consultas.
+
+        input: "v" booleano.
+
+        con True los metodos de self.PROFILE_STAGES se sustituyen en este objeto por versiones
+        que miden su tiempo y cuentan sus llamadas (ver self.reset_profile() y self.profile_report()),
+        con False se quitan, asi sin activarla no hay ningun coste
+
+        """
+        for name, stage in self.PROFILE_STAGES.items():
+            if v:
+                setattr(self, name, self.profiled(types.MethodType(getattr(type(self), name), self), name, stage))
+            else:
+                self.__dict__.pop(name, None)
+        if v:
+            self.reset_profile()
+        else:
+            self.profile = None
+
     ###############################
     ###                         ###
     ###   PARTE 1: INDEXACION   ###
@@ -147,22 +409,338 @@ class SAR_Project:
         self.positional = args['positional']
         self.stemming = args['stem']
         self.permuterm = args['permuterm']
-
-        # Variable secuencial que representa el id de un fichero
+        self.kgram = args.get('kgram', False)
+        self.minhash = args.get('minhash', False)
+        self.lazy_fields = args.get('lazy', False)
+        self.rank_data = args.get('rank_data', False)
+        self.compressed = args.get('compress', False)
+        self.compact = args.get('compact', False)
+        # Numero de procesos para indexar (opcion -j), por defecto uno
+        jobs = args.get('jobs') or 1
+        memory_before = peak_memory()
+
+        # Se recogen los ficheros en el orden del recorrido para que el id de
+        # cada fichero y de cada noticia no dependa del numero de procesos
+        filenames = []
         for dir, _, files in os.walk(root):
             for filename in files:
                 if filename.endswith('.json'):
-                    fullname = os.path.join(dir, filename)
-                    self.index_file(fullname)
+                    filenames.append(os.path.join(dir, filename))
+
+        if jobs > 1:
+            self.index_parallel(filenames, jobs)
+        else:
+            for fullname in filenames:
+                self.index_file(fullname)
 
         # Si se activa la función de stemming
         if self.stemming:
             self.make_stemming()
+            self.make_stem_postings()
         # Si se activa la función de permuterm
         if self.permuterm:
             self.make_permuterm()
+        # Si se activa el indice de k-gramas
+        if self.kgram:
+            self.make_kgrams()
+        if self.rank_data:
+            self.make_term_bounds()
+            self.make_forward()
+            if self.minhash:
+                self.make_sketches()
+        self.clear_bitmaps()
+        # Si se activa la compresion de las posting lists o la representacion con arrays
+        if self.compressed or self.compact:
+            before = self.posting_bytes()
+            if self.compressed:
+                self.compress_index()
+            if self.compact:
+                self.compact_index()
+            self.bytes_per_posting = (before, self.posting_bytes())
+        if memory_before is not None:
+            # Los procesos de -j ya han terminado, su pico se guarda aparte
+            self.index_memory = (memory_before, peak_memory(), peak_memory(children=True) if jobs > 1 else None)
+
+    def update_dir(self, root, jobs=1):
+        """
+        Actualiza un indice ya construido con el contenido actual del directorio "root".
+
+        Solo se indexan los ficheros que no estan en self.docs y los que han cambiado
+        (fecha de modificacion o tamaño distintos de los guardados en self.docs_stat).
+        Las noticias de un fichero modificado se eliminan del indice y se vuelven a indexar
+        con newids nuevos, asi las posting lists siguen ordenadas.
+        Los indices de stems y permuterms solo se amplian con los terminos nuevos.
+
+        param:  "root": directorio con las noticias
+                "jobs": numero de procesos para indexar los ficheros nuevos
+
+        return: tupla (numero de ficheros nuevos, numero de ficheros modificados)
+
+        """
+        # Los resultados guardados dejan de ser validos
+        self.query_cache.clear()
+        memory_before = peak_memory()
+        self.load_components()
+
+        # Las posting lists comprimidas o en arrays no se pueden ampliar
+        if self.compact:
+            self.expand_index()
+        if self.compressed:
+            self.decompress_index()
+
+        known = {filename: docid for docid, filename in self.docs.items()}
+        new_files = []
+        changed = []
+        for dir, _, files in os.walk(root):
+            for filename in files:
+                if filename.endswith('.json'):
+                    fullname = os.path.join(dir, filename)
+                    if fullname not in known:
+                        new_files.append(fullname)
+                    elif self.docs_stat.get(known[fullname]) != self.file_stat(fullname):
+                        changed.append(known[fullname])
+
+        if changed:
+            self.remove_docs(changed)
+
+        # Numero de terminos de cada campo antes de indexar, los nuevos se insertan al final del diccionario
+        old_sizes = {field: len(self.index[field]) for field in self.index}
+        first_new = self.new_cont
+
+        for docid in changed:
+            self.index_file(self.docs[docid], docid)
+        if jobs > 1:
+            self.index_parallel(new_files, jobs)
+        else:
+            for fullname in new_files:
+                self.index_file(fullname)
+
+        new_tokens = {field: list(itertools.islice(self.index[field], old_sizes[field], None))
+                      for field in self.index}
+        if self.stemming:
+            self.make_stemming(new_tokens)
+            self.make_stem_postings(first_new)
+        if self.permuterm:
+            self.make_permuterm(new_tokens)
+        if self.kgram:
+            self.make_kgrams(new_tokens)
+        if self.rank_data:
+            self.make_term_bounds(first_new)
+            self.make_forward(first_new)
+            if self.minhash:
+                self.make_sketches(first_new)
+        self.clear_bitmaps()
+        if self.compressed:
+            self.compress_index()
+        if self.compact:
+            self.compact_index()
+        if memory_before is not None:
+            self.index_memory = (memory_before, peak_memory(), peak_memory(children=True) if jobs > 1 else None)
+
+        return len(new_files), len(changed)
+
+    def remove_docs(self, docids):
+        """
+        Elimina del indice todas las noticias de los ficheros "docids".
+
+        Como no se guarda que terminos tiene cada noticia hay que recorrer el vocabulario,
+        solo se llama cuando algun fichero indexado ha cambiado.
+        Los terminos que se quedan sin noticias se eliminan tambien de self.sindex y self.ptindex.
+        Las noticias eliminadas tambien se quitan de las posting lists de los stems (self.spindex).
+
+        param:  "docids": lista de ids de fichero
+
+        """
+        self.load_components()
+        docids = set(docids)
+        removed = {new for new, entry in self.news.items() if entry[0] in docids}
+        for new in removed:
+            del self.news[new]
+            for field in self.lengths:
+                if new in self.lengths[field]:
+                    self.total_length[field] -= self.lengths[field].pop(new)
+                self.offsets[field].pop(new, None)
+                self.forward[field].pop(new, None)
+                self.sketches[field].pop(new, None)
+        self.new_cache.clear()
+        self.query_cache.clear()
+
+        for field in self.index:
+            empty = []
+            for token, posting in self.index[field].items():
+                for new in removed.intersection(posting):
+                    del posting[new]
+                if not posting:
+                    empty.append(token)
+
+            for token in empty:
+                del self.index[field][token]
+                self.term_bounds[field].pop(token, None)
+                stem = self.stem(token)
+                if token in self.sindex[field].get(stem, []):
+                    self.sindex[field][stem].remove(token)
+                    if not self.sindex[field][stem]:
+                        del self.sindex[field][stem]
+                for permut in self.rotations(token):
+                    if token in self.ptindex[field].get(permut, []):
+                        self.ptindex[field][permut].remove(token)
+                        if not self.ptindex[field][permut]:
+                            del self.ptindex[field][permut]
+
+            empty = []
+            for stem, posting in self.spindex[field].items():
+                for new in removed.intersection(posting):
+                    del posting[new]
+                if not posting:
+                    empty.append(stem)
+            for stem in empty:
+                del self.spindex[field][stem]
+
+    def compress_index(self):
+        """
+        Comprime las posting lists de todos los campos (newids y posiciones como diferencias
+        codificadas en variable-byte, ver SAR_postings.encode_posting).
+
+        """
+        self.load_components()
+        for field in self.index:
+            if not isinstance(self.index[field], CompressedIndex):
+                self.index[field] = CompressedIndex(self.index[field])
+            if not isinstance(self.spindex[field], CompressedIndex):
+                self.spindex[field] = CompressedIndex(self.spindex[field])
+
+    def decompress_index(self):
+        """
+        Deshace "compress_index", las posting lists vuelven a ser diccionarios.
+
+        """
+        self.load_components()
+        for field in self.index:
+            if isinstance(self.index[field], CompressedIndex):
+                self.index[field] = self.index[field].decompress()
+            if isinstance(self.spindex[field], CompressedIndex):
+                self.spindex[field] = self.spindex[field].decompress()
+
+    def compact_index(self):
+        """
+        Guarda self.news y self.docs y, si no estan comprimidas, las posting lists en arrays
+        de enteros (ver SAR_postings.ArrayIndex y SAR_postings.NewsTable).
+        Ocupan mucha menos memoria que los diccionarios y se serializan mas rapido; con pickle
+        los arrays del indice se guardan con el tipo mas pequeño en el que caben (ver SAR_postings.narrow).
 
-    def index_file(self, filename):
+        """
+        self.load_components()
+        if not isinstance(self.news, NewsTable):
+            self.news = NewsTable.from_dict(self.news, self.new_cont)
+        if isinstance(self.docs, dict):
+            self.docs = [self.docs[docid] for docid in range(self.doc_cont)]
+        for field in self.index:
+            if isinstance(self.index[field], dict):
+                self.index[field] = ArrayIndex(self.index[field], self.positional)
+            if isinstance(self.spindex[field], dict):
+                self.spindex[field] = ArrayIndex(self.spindex[field], False)
+            if isinstance(self.lengths[field], dict) and self.lengths[field]:
+                lengths = array('I', bytes(4 * self.new_cont))
+                for new, length in self.lengths[field].items():
+                    lengths[new] = length
+                self.lengths[field] = lengths
+
+    def expand_index(self):
+        """
+        Deshace "compact_index", vuelven a ser diccionarios.
+
+        """
+        self.load_components()
+        if isinstance(self.news, NewsTable):
+            self.news = {new: self.news[new] for new in self.news}
+        if isinstance(self.docs, list):
+            self.docs = dict(enumerate(self.docs))
+        for field in self.index:
+            if isinstance(self.index[field], ArrayIndex):
+                self.index[field] = self.index[field].to_dict()
+            if isinstance(self.spindex[field], ArrayIndex):
+                self.spindex[field] = self.spindex[field].to_dict()
+            if not isinstance(self.lengths[field], dict):
+                self.lengths[field] = {new: self.lengths[field][new] for new in self.news}
+
+    def posting_bytes(self):
+        """
+        Calcula los bytes que ocupan en memoria las posting lists por cada posting.
+
+        return: bytes por posting
+        """
+        size = 0
+        postings = 0
+        for field in self.index:
+            size += deep_getsizeof(self.index[field])
+            postings += sum(len(self.index[field][term]) for term in self.index[field])
+        return size / max(postings, 1)
+
+    def rank_data_bytes(self):
+        """
+        Mide los bytes en memoria de las estructuras que solo sirven para ordenar los resultados
+        (self.term_bounds, self.term_ids, self.forward y self.sketches), sin contar los terminos,
+        que ya estan en el indice.
+
+        return: numero de bytes
+        """
+        seen = {id(term) for field in self.index for term in self.index[field]}
+        return sum(deep_getsizeof(getattr(self, name)[field], seen)
+                   for name in ('term_bounds', 'term_ids', 'forward', 'sketches') for field in self.index)
+
+    def memory_report(self):
+        """
+        Mide los bytes que ocupa en memoria cada estructura del indice (ver deep_getsizeof).
+
+        Los objetos compartidos entre estructuras (por ejemplo los terminos, que estan en el indice
+        y en sindex o ptindex) se cuentan solo en la primera en la que aparecen, en el orden del
+        resultado, asi la suma es la memoria real del indice.
+        En las posting lists en diccionarios o en arrays se separan las posiciones del resto;
+        comprimidas, las posiciones estan dentro de los bytes de cada posting list.
+
+        return: diccionario estructura --> campo --> bytes; para 'index', campo --> diccionario
+                con 'postings' y 'positions' (bytes y numero de cada uno); 'news' y 'docs' son bytes
+
+        """
+        seen = set()
+        res = {'index': {}}
+        for field in self.index:
+            index = self.index[field]
+            postings = sum(len(index[term]) for term in index)
+            positions = 0
+            positions_size = 0
+            if isinstance(index, ArrayIndex):
+                for name in ('positions', 'pos_starts'):
+                    positions_size += deep_getsizeof(getattr(index, name), seen)
+                positions = len(index.positions)
+            elif isinstance(index, dict):
+                for posting in index.values():
+                    for value in posting.values():
+                        if isinstance(value, list):
+                            positions += len(value)
+                            positions_size += deep_getsizeof(value, seen)
+            res['index'][field] = {'postings': deep_getsizeof(index, seen), 'n_postings': postings,
+                                   'positions': positions_size, 'n_positions': positions}
+        for name in ('sindex', 'spindex', 'ptindex', 'ptkeys', 'kindex', 'kterms',
+                     'lengths', 'term_bounds', 'bitmaps', 'offsets', 'term_ids', 'forward', 'sketches'):
+            res[name] = {field: deep_getsizeof(getattr(self, name)[field], seen) for field in self.index}
+        res['news'] = deep_getsizeof(self.news, seen)
+        res['docs'] = deep_getsizeof(self.docs, seen) + deep_getsizeof(self.docs_stat, seen)
+        return res
+
+    def file_stat(self, filename):
+        """
+        Devuelve la fecha de modificacion y el tamaño de un fichero, para detectar si ha cambiado.
+
+        param:  "filename": ruta del fichero
+
+        return: tupla (fecha de modificacion, tamaño)
+
+        """
+        st = os.stat(filename)
+        return st.st_mtime, st.st_size
+
+    def index_file(self, filename, docid=None):
         """
         NECESARIO PARA TODAS LAS VERSIONES
 
@@ -174,20 +752,27 @@ class SAR_Project:
         En estos casos, se recomienda crear nuevos metodos para hacer mas sencilla la implementacion
 
         input: "filename" es el nombre de un fichero en formato JSON Arrays (https://www.w3schools.com/js/js_json_arrays.asp).
-                Una vez parseado con json.load tendremos una lista de diccionarios, cada diccionario se corresponde a una noticia
+                Una vez parseado con self.read_news tendremos una lista de diccionarios, cada diccionario se corresponde a una noticia
+               "docid" id del fichero, solo se indica al reindexar un fichero modificado (ver "update_dir")
 
 
         """
         # Un fichero esta compuesto por noticias, cada noticia por cinco campos y cada campo por unos tokens
-        with open(filename) as fh:
-            jlist = json.load(fh)
-            self.docs[self.doc_cont] = filename
+        if docid is None:
+            docid = self.doc_cont
+            self.doc_cont += 1
+
+        with open(filename, 'rb') as fh:
+            jlist = self.read_news(fh.read())
+            self.docs[docid] = filename
+            self.docs_stat[docid] = self.file_stat(filename)
 
             # Contador de la posición de una noticia en un fichero
             contador_noticia = 0
-            for noticia in jlist:
-                # Se añade al diccionario de noticias la noticia con clave -> self.new_cont, valor -> (filename, contador_noticia)
-                self.news[self.new_cont] = [self.doc_cont, contador_noticia]
+            for noticia, offset, length in jlist:
+                # Se añade al diccionario de noticias la noticia con clave -> self.new_cont,
+                # valor -> (filename, contador_noticia, offset, length)
+                self.news[self.new_cont] = [docid, contador_noticia, offset, length]
 
                 # Si se activa la función de multifield
                 if self.multifield:
@@ -198,10 +783,16 @@ class SAR_Project:
                     multifield = ['article', 'date']
                 # Se tokeniza el cotenido de cada campo (menos el de date)
                 for field in multifield:
-                    if field != 'date':
-                        contenido = self.tokenize(noticia[field])
-                    else:
+                    if field == 'date':
                         contenido = [noticia[field]]
+                    elif self.positional:
+                        # Con el indice posicional se guarda tambien donde empieza cada token, para los snippets
+                        contenido, self.offsets[field][self.new_cont] = self.tokenize_offsets(noticia[field])
+                    else:
+                        contenido = self.tokenize(noticia[field])
+                    # Longitud del campo para el ranking BM25
+                    self.lengths[field][self.new_cont] = len(contenido)
+                    self.total_length[field] += len(contenido)
                     # Contador de la posición de un token en una noticia
                     posicion_token = 0
                     for token in contenido:
@@ -235,7 +826,125 @@ class SAR_Project:
 
                 contador_noticia += 1
 
-            self.doc_cont += 1
+    def read_news(self, data):
+        """
+        Parsea el contenido de un fichero de noticias (JSON Array) guardando donde empieza
+        y acaba cada noticia, para despues poder leerla sola (ver self.get_new()).
+
+        param:  "data": bytes del fichero
+
+        return: lista de tuplas (noticia, offset en bytes, longitud en bytes)
+
+        """
+        text = data.decode('utf-8')
+        # Si el fichero es ASCII las posiciones en el texto coinciden con las de los bytes
+        ascii = len(text) == len(data)
+        decoder = json.JSONDecoder()
+
+        res = []
+        pos = self.JSON_SEP.match(text, text.index('[') + 1).end()
+        last = 0
+        byte_pos = 0
+        while text[pos] != ']':
+            noticia, end = decoder.raw_decode(text, pos)
+            if ascii:
+                res.append((noticia, pos, end - pos))
+            else:
+                byte_pos += len(text[last:pos].encode('utf-8'))
+                length = len(text[pos:end].encode('utf-8'))
+                res.append((noticia, byte_pos, length))
+                byte_pos += length
+                last = end
+            pos = self.JSON_SEP.match(text, end).end()
+        return res
+
+    def get_new(self, new):
+        """
+        Devuelve una noticia leyendo solo sus bytes del fichero (offset y longitud guardados en self.news).
+        Las ultimas self.NEW_CACHE_SIZE noticias leidas se guardan en self.new_cache.
+
+        param:  "new": newid de la noticia
+
+        return: la noticia, con todos sus campos
+
+        """
+        if new in self.new_cache:
+            self.new_cache.move_to_end(new)
+            return self.new_cache[new]
+
+        docid, contador_noticia, offset, length = self.news[new]
+        with open(self.docs[docid], 'rb') as fh:
+            fh.seek(offset)
+            noticia = json.loads(fh.read(length))
+
+        self.new_cache[new] = noticia
+        if len(self.new_cache) > self.NEW_CACHE_SIZE:
+            self.new_cache.popitem(last=False)
+        return noticia
+
+    def index_parallel(self, filenames, jobs):
+        """
+        Indexa una lista de ficheros repartiendola entre "jobs" procesos.
+
+        Cada proceso indexa un bloque de ficheros consecutivos en un indice parcial
+        (numerado desde 0) y los indices parciales se fusionan en orden con "merge_partial",
+        por lo que la numeracion de ficheros y noticias es la misma que la de la indexacion secuencial.
+
+        param:  "filenames": lista de ficheros a indexar, en el orden en que se deben numerar
+                "jobs": numero de procesos
+
+        """
+        # Se hacen mas bloques que procesos para repartir mejor la carga
+        nchunks = min(len(filenames), jobs * 4)
+        if nchunks == 0:
+            return
+        size = math.ceil(len(filenames) / nchunks)
+        chunks = [(filenames[i:i + size], self.multifield, self.positional)
+                  for i in range(0, len(filenames), size)]
+
+        with multiprocessing.Pool(jobs) as pool:
+            # imap devuelve los indices parciales en el orden de los bloques
+            for partial in pool.imap(_index_chunk, chunks):
+                self.merge_partial(*partial)
+
+    def merge_partial(self, docs, docs_stat, news, index, lengths, offsets):
+        """
+        Añade al indice un indice parcial construido con ids locales (desde 0).
+
+        Los ids de fichero y de noticia se desplazan con los contadores actuales,
+        de modo que las posting lists siguen ordenadas por newid.
+
+        param:  "docs", "docs_stat", "news", "index", "lengths", "offsets": los diccionarios del indice parcial
+
+        """
+        doc_offset = self.doc_cont
+        new_offset = self.new_cont
+
+        for docid, filename in docs.items():
+            self.docs[docid + doc_offset] = filename
+            self.docs_stat[docid + doc_offset] = docs_stat[docid]
+        for newid, entry in news.items():
+            self.news[newid + new_offset] = [entry[0] + doc_offset] + entry[1:]
+
+        for field in index:
+            for token, posting in index[field].items():
+                shifted = {newid + new_offset: value for newid, value in posting.items()}
+                if token not in self.index[field]:
+                    self.index[field][token] = shifted
+                else:
+                    self.index[field][token].update(shifted)
+
+        for field in lengths:
+            for newid, length in lengths[field].items():
+                self.lengths[field][newid + new_offset] = length
+                self.total_length[field] += length
+
+        for field in offsets:
+            for newid, starts in offsets[field].items():
+                self.offsets[field][newid + new_offset] = starts
+
+        self.doc_cont += len(docs)
+        self.new_cont += len(news)
 
     def tokenize(self, text):
         """
@@ -251,13 +960,37 @@ class SAR_Project:
         """
         return self.tokenizer.sub(' ', text.lower()).split()
 
-    def make_stemming(self):
+    def tokenize_offsets(self, text):
+        """
+        Tokeniza un texto igual que "tokenize" y devuelve tambien el caracter de "text"
+        en el que empieza cada token.
+
+        params: 'text': texto a tokenizar
+
+        return: tupla (lista de tokens, array con el inicio de cada token)
+
+        """
+        lower = text.lower()
+        if len(lower) == len(text):
+            # Cada caracter se ha convertido en uno, las posiciones del texto en minusculas valen para el original
+            matches = [(match.group(), match.start()) for match in self.WORD.finditer(lower)]
+        else:
+            # Alguna mayuscula se convierte en varios caracteres (muy raro): se tokeniza cada palabra
+            # del original y los tokens en los que se parta empiezan donde empieza ella
+            matches = [(token, match.start()) for match in self.WORD.finditer(text)
+                       for token in self.tokenize(match.group())]
+        return [token for token, _ in matches], array('I', [start for _, start in matches])
+
+    def make_stemming(self, new_tokens=None):
         """
         NECESARIO PARA LA AMPLIACION DE STEMMING.
 
         Crea el indice de stemming (self.sindex) para los terminos de todos los indices.
 
-        self.stemmer.stem(token) devuelve el stem del token
+        self.stem(token) devuelve el stem del token
+
+        param:  "new_tokens": diccionario campo --> terminos a añadir, si se actualiza el indice (ver "update_dir").
+                Por defecto se usan todos los terminos.
 
         """
         # Si se activa la función multifield
@@ -269,20 +1002,66 @@ class SAR_Project:
         for field in multifield:
             # Se aplica stemming a cada token del self.index[field] y se añade al indice de stems
             # En este caso solo se guarda la noticia, no la posición
-            for token in self.index[field].keys():
-                token_s = self.stemmer.stem(token)
+            tokens = self.index[field].keys() if new_tokens is None else new_tokens[field]
+            for token in tokens:
+                token_s = self.stem(token)
                 if token_s not in self.sindex[field]:
                     self.sindex[field][token_s] = [token]
                 else:
                     if token not in self.sindex[field][token_s]:
                         self.sindex[field][token_s] += [token]
 
-    def make_permuterm(self):
+    def make_stem_postings(self, first_new=0):
+        """
+        NECESARIO PARA LA AMPLIACION DE STEMMING.
+
+        Crea la posting list de cada stem (self.spindex) uniendo las de sus terminos y sumando
+        sus frecuencias, asi "get_stemming" no tiene que hacer el OR de todos los terminos.
+
+        param:  "first_new": solo se recalculan los stems con algun termino con noticias desde
+                este newid (al actualizar el indice, ver "update_dir")
+
+        """
+        for field in self.sindex:
+            for stem, tokens in self.sindex[field].items():
+                postings = [self.index[field][token] for token in tokens if token in self.index[field]]
+                # Los newids se añaden en orden, el ultimo de cada posting list es el mayor
+                if first_new > 0 and all(next(reversed(posting)) < first_new for posting in postings):
+                    continue
+                merged = {}
+                for posting in postings:
+                    for new, value in posting.items():
+                        merged[new] = merged.get(new, 0) + (value if isinstance(value, int) else len(value))
+                if len(postings) > 1:
+                    merged = dict(sorted(merged.items()))
+                self.spindex[field][stem] = merged
+
+    def stem(self, token):
+        """
+        Devuelve el stem de un termino, guardando los ya calculados en self.stem_cache.
+
+        param:  "token": termino
+
+        return: stem del termino
+
+        """
+        stem = self.stem_cache.get(token)
+        if stem is None:
+            if len(self.stem_cache) >= self.STEM_CACHE_SIZE:
+                self.stem_cache.clear()
+            stem = self.stemmer.stem(token)
+            self.stem_cache[token] = stem
+        return stem
+
+    def make_permuterm(self, new_tokens=None):
         """
         NECESARIO PARA LA AMPLIACION DE PERMUTERM
 
         Crea el indice permuterm (self.ptindex) para los terminos de todos los indices.
 
+        param:  "new_tokens": diccionario campo --> terminos a añadir, si se actualiza el indice (ver "update_dir").
+                Por defecto se usan todos los terminos.
+
         """
         # Si se activa la función multifield
         if self.multifield:
@@ -292,25 +1071,264 @@ class SAR_Project:
         for field in multifield:
             # Se crea la lista de permuterms de un token
             # En este caso solo se guarda la noticia, no la posición
-            for token in self.index[field]:
-                token_p = token + '$'
-                permuterm = []
-                for _ in range(len(token_p)):
-                    token_p = token_p[1:] + token_p[0]
-                    permuterm += [token_p]
-
-                for permut in permuterm:
+            tokens = self.index[field] if new_tokens is None else new_tokens[field]
+            for token in tokens:
+                for permut in self.rotations(token):
                     if permut not in self.ptindex[field]:
                         self.ptindex[field][permut] = [token]
                     else:
                         if token not in self.ptindex[field][permut]:
                             self.ptindex[field][permut] += [token]
+            # Al actualizar la lista ya esta casi ordenada y ordenarla de nuevo es rapido
+            self.ptkeys[field] = sorted(self.ptindex[field])
+
+    def make_kgrams(self, new_tokens=None):
+        """
+        Crea el indice de k-gramas (self.kindex) para los terminos de todos los indices,
+        alternativa con menos memoria al indice permuterm que admite varios comodines.
+
+        Los terminos que se eliminan del indice al actualizarlo se quedan en self.kindex,
+        "get_kgram_terms" los descarta al comprobar que siguen en self.index.
+
+        param:  "new_tokens": diccionario campo --> terminos a añadir, si se actualiza el indice (ver "update_dir").
+                Por defecto se usan todos los terminos.
+
+        """
+        if self.multifield:
+            multifield = ['title', 'date', 'keywords', 'article', 'summary']
+        else:
+            multifield = ['article']
+        for field in multifield:
+            tokens = self.index[field] if new_tokens is None else new_tokens[field]
+            kindex = self.kindex[field]
+            for token in tokens:
+                # Los ids se asignan en orden, asi cada array queda ordenado
+                term_id = len(self.kterms[field])
+                self.kterms[field].append(token)
+                for gram in self.kgrams(token):
+                    if gram not in kindex:
+                        kindex[gram] = array('I')
+                    kindex[gram].append(term_id)
+
+    def kgrams(self, token):
+        """
+        Devuelve los k-gramas de un termino delimitado por '$', ademas del prefijo y el sufijo
+        de longitud k-1 para poder resolver comodines como "a*" o "*a".
 
-    def show_stats(self):
+        param:  "token": termino
+
+        return: conjunto de k-gramas
+
+        """
+        token_k = '$' + token + '$'
+        k = self.KGRAM_K
+        grams = {token_k[i:i + k] for i in range(len(token_k) - k + 1)}
+        grams.add(token_k[:k - 1])
+        grams.add(token_k[1 - k:])
+        return grams
+
+    def make_term_bounds(self, first_new=0):
+        """
+        Calcula las cotas de cada termino para el ranking top-k (ver self.rank_topk()):
+        la frecuencia maxima del termino en una noticia y la longitud minima de las noticias
+        que lo contienen. Con ellas se acota su puntuacion BM25 sea cual sea la longitud media.
+
+        param:  "first_new": solo se recalculan los terminos con alguna noticia desde este newid
+                (al actualizar el indice, ver "update_dir")
+
+        """
+        for field in self.index:
+            lengths = self.lengths[field]
+            for token, posting in self.index[field].items():
+                # Los newids se añaden en orden, el ultimo es el mayor
+                if first_new > 0 and next(reversed(posting)) < first_new:
+                    continue
+                max_tf = 0
+                min_length = None
+                for new, value in posting.items():
+                    tf = value if isinstance(value, int) else len(value)
+                    max_tf = max(max_tf, tf)
+                    if min_length is None or lengths[new] < min_length:
+                        min_length = lengths[new]
+                self.term_bounds[field][token] = (max_tf, min_length)
+
+    def make_forward(self, first_new=0):
+        """
+        Crea el indice directo para Jaccard (ver self.jaccard_ids()): por cada noticia y campo,
+        el array ordenado de los ids de sus terminos. Los ids se asignan en orden de llegada
+        y no cambian al actualizar el indice.
+
+        param:  "first_new": solo se añaden las noticias desde este newid (al actualizar el indice, ver "update_dir")
+
+        """
+        for field in self.index:
+            term_ids = self.term_ids[field]
+            forward = {}
+            for token, posting in self.index[field].items():
+                # Los newids se añaden en orden, el ultimo es el mayor
+                if first_new > 0 and next(reversed(posting)) < first_new:
+                    continue
+                if token not in term_ids:
+                    term_ids[token] = len(term_ids)
+                term_id = term_ids[token]
+                for new in posting:
+                    if new >= first_new:
+                        forward.setdefault(new, []).append(term_id)
+            for new, ids in forward.items():
+                self.forward[field][new] = array('I', sorted(ids))
+
+    def make_sketches(self, first_new=0):
+        """
+        Calcula el MinHash de los terminos de cada noticia y campo a partir del indice directo.
+
+        param:  "first_new": solo se calculan las noticias desde este newid (al actualizar el indice, ver "update_dir")
+
+        """
+        for field in self.index:
+            for new, ids in self.forward[field].items():
+                if new >= first_new:
+                    self.sketches[field][new] = self.sketch(ids)
+
+    def sketch(self, ids):
+        """
+        Calcula el MinHash de un conjunto de ids de termino: el minimo de cada una de las
+        MINHASH_SIZE funciones hash (a * id + b) % MINHASH_PRIME.
+
+        param:  "ids": ids de termino (no vacio)
+
+        return: array con MINHASH_SIZE hashes
+        """
+        prime = self.MINHASH_PRIME
+        return array('I', [min((a * x + b) % prime for x in ids)
+                           for a, b in minhash_coefficients(self.MINHASH_SIZE, self.MINHASH_SEED, prime)])
+
+    def clear_bitmaps(self):
+        """
+        Vacia los bitmaps calculados por self.get_bitmap(), hay que llamarlo cada vez que cambia el indice.
+
+        """
+        for field in self.bitmaps:
+            self.bitmaps[field] = {}
+        self.news_bitmap = None
+
+    def get_bitmap(self, term, field='article'):
+        """
+        Devuelve como bitmap la posting list de un termino denso (ver BITMAP_RATIO).
+        El bitmap se calcula la primera vez que se pide y se guarda en self.bitmaps, no se
+        guarda con el indice: seria una segunda copia de las posting lists mas largas.
+
+        param:  "term": termino
+                "field": campo del termino
+
+        return: BitmapPosting o None si el termino no esta en el indice o no es denso
+
+        """
+        bitmaps = self.bitmaps[field]
+        if term not in bitmaps:
+            posting = self.index[field].get(term)
+            if posting is not None and len(posting) * self.BITMAP_RATIO >= len(self.news):
+                bitmaps[term] = BitmapPosting.from_ids(self.posting_ids(posting)).bits
+            else:
+                bitmaps[term] = None
+        bits = bitmaps[term]
+        return None if bits is None else BitmapPosting(bits)
+
+    def get_news_bitmap(self):
+        """
+        Devuelve el bitmap de todas las noticias indexadas.
+        """
+        if self.news_bitmap is None:
+            self.news_bitmap = BitmapPosting.from_ids(list(self.news.keys()))
+        return self.news_bitmap
+
+    def rotations(self, token):
+        """
+        Devuelve las rotaciones (permuterms) de un termino, terminado en '$'.
+
+        param:  "token": termino
+
+        return: lista de permuterms
+
+        """
+        token_p = token + '$'
+        permuterm = []
+        for _ in range(len(token_p)):
+            token_p = token_p[1:] + token_p[0]
+            permuterm += [token_p]
+        return permuterm
+
+    def save(self, filename, binary=False):
+        """
+        Guarda el indice.
+
+        param:  "filename": fichero (pickle) o directorio (formato binario) destino
+                "binary": si es True se usa el formato binario de SAR_storage, que se carga con mmap
+
+        """
+        if binary:
+            self.load_components()
+            SAR_storage.save_index(self, filename)
+        else:
+            with open(filename, 'wb') as fh:
+                pickle.dump(self, fh)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Carga un indice guardado con "save", en cualquiera de los dos formatos.
+
+        param:  "filename": fichero o directorio del indice
+
+        return: el SAR_Project cargado
+
+        """
+        if os.path.isdir(filename):
+            return SAR_storage.load_index(cls(), filename)
+        with open(filename, 'rb') as fh:
+            return pickle.load(fh)
+
+    def load_components(self):
+        """
+        Carga los componentes de un indice guardado con pickle que aun no se han usado y los
+        convierte en diccionarios (con las posiciones si el indice es posicional).
+        Es necesario antes de modificar el indice o guardarlo en el formato binario.
+
+        """
+        for name in self.COMPONENTS:
+            value = getattr(self, name)
+            if isinstance(value, SAR_storage.LazyFields):
+                setattr(self, name, value.to_dict())
+
+    def __getstate__(self):
+        # La cache de noticias no se guarda con el indice
+        state = self.__dict__.copy()
+        # Ni los metodos medidos de self.set_profile()
+        for name in self.PROFILE_STAGES:
+            state.pop(name, None)
+        state['profile'] = None
+        # Con --lazy cada campo de cada estructura se guarda aparte para cargarlo solo al usarlo,
+        # si no se guardan los diccionarios tal cual (el fichero es mas pequeño)
+        for name in self.COMPONENTS:
+            if self.lazy_fields and not isinstance(state[name], SAR_storage.LazyFields):
+                state[name] = SAR_storage.LazyFields(state[name], name == 'index' and self.positional)
+            elif not self.lazy_fields and isinstance(state[name], SAR_storage.LazyFields):
+                state[name] = state[name].to_dict()
+        state['new_cache'] = OrderedDict()
+        state['stem_cache'] = {}
+        state['query_cache'] = OrderedDict()
+        state['cache_hits'] = 0
+        state['cache_misses'] = 0
+        state['bitmaps'] = {field: {} for field in self.bitmaps}
+        state['news_bitmap'] = None
+        return state
+
+    def show_stats(self, memory=False):
         """
         NECESARIO PARA TODAS LAS VERSIONES
         
         Muestra estadisticas de los indices
+
+        param:  "memory": si es True se muestra tambien la memoria de cada estructura (ver self.memory_report())
         
         """
         # Si se activa la función multifield
@@ -336,20 +1354,74 @@ class SAR_Project:
                     print('     # of permuterms in \'{}\': {}'.format(
                         field, len(self.ptindex[field])))
             print('----------------------------------------')
+        if self.kgram:
+            for field in multifield:
+                if field:
+                    print('     # of k-grams in \'{}\': {}'.format(
+                        field, len(self.kindex[field])))
+            print('----------------------------------------')
+        if self.rank_data:
+            print('Ranking data (BM25 bounds, Jaccard forward index{}): {:.2f} MB'.format(
+                ' and MinHash' if self.minhash else '', self.rank_data_bytes() / 2 ** 20))
+            print('----------------------------------------')
         if self.stemming:
             for field in multifield:
                 if field:
                     print('     # of stems in \'{}\': {}'.format(
                         field, len(self.sindex[field])))
             print('----------------------------------------')
+        if self.bytes_per_posting is not None:
+            print('Bytes per posting: {:.1f} -> {:.1f}'.format(*self.bytes_per_posting))
+            print('----------------------------------------')
+        if memory:
+            self.show_memory(multifield)
+            print('----------------------------------------')
         if self.positional:
             print('Positional queries are allowed.')
         else:
             print('Positional queries are NOT allowed.')
         print('========================================')
 
-    ###################################
-    ###                             ###
+    def show_memory(self, fields):
+        """
+        Muestra la memoria de cada estructura del indice y el pico de memoria al indexar.
+
+        param:  "fields": campos que se muestran
+
+        """
+        report = self.memory_report()
+
+        def mb(size):
+            return '{:.2f} MB'.format(size / 2 ** 20)
+
+        print('MEMORY:')
+        for field in fields:
+            index = report['index'][field]
+            print('     postings in \'{}\': {} ({:.1f} bytes per posting)'.format(
+                field, mb(index['postings']), index['postings'] / max(index['n_postings'], 1)))
+            if index['n_positions']:
+                print('     positions in \'{}\': {} ({:.1f} bytes per position)'.format(
+                    field, mb(index['positions']), index['positions'] / index['n_positions']))
+        for name in ('sindex', 'spindex', 'ptindex', 'ptkeys', 'kindex', 'kterms', 'lengths', 'term_bounds', 'bitmaps',
+                     'offsets', 'term_ids', 'forward', 'sketches'):
+            for field in fields:
+                if len(getattr(self, name)[field]):
+                    print('     {} in \'{}\': {}'.format(name, field, mb(report[name][field])))
+        print('     news: {}'.format(mb(report['news'])))
+        print('     docs: {}'.format(mb(report['docs'])))
+        total = report['news'] + report['docs'] + \
+            sum(index['postings'] + index['positions'] for index in report['index'].values()) + \
+            sum(sum(report[name].values()) for name in report if name not in ('index', 'news', 'docs'))
+        print('     total: {}'.format(mb(total)))
+        if self.index_memory is not None:
+            before, peak, workers = self.index_memory
+            # ru_maxrss es el pico desde que empezo el proceso (con -u incluye cargar el indice), no solo el de la indexacion
+            print('     process peak RSS: {} ({} before indexing)'.format(mb(peak), mb(before)))
+            if workers is not None:
+                print('     peak memory of the largest worker process (-j, not included above): {}'.format(mb(workers)))
+
+    ###################################
+    ###                             ###
     ###   PARTE 2.1: RECUPERACION   ###
     ###                             ###
     ###################################
@@ -480,110 +1552,324 @@ class SAR_Project:
         return query[0]
         '''
 
-        # La implementación final más concisa y eficiente
-        if query is None or len(query) == 0:
+        # La implementación final: la consulta se convierte en un arbol (ver SAR_query),
+        # se optimiza y se evalua
+        node = self.parse_query(query)
+        if node is None:
             return []
+        return self.materialize(self.evaluate(self.optimize_query(node)))
 
-        res = []
+    def parse_query(self, query):
+        """
+        Construye el arbol de una consulta (ver SAR_query.parse).
 
-        # Preprocesamiento de la consulta
-        query = query.replace('"', '')
-        query = query.replace('(', ' ( ')
-        query = query.replace(')', ' ) ')
-        q = query.split()
+        param:  "query": cadena con la query
 
-        # Bucle que realiza, primeramente, las funcionalidades extra
-        i = 0
-        while i < len(q):
-            term = q[i]
-            # 1º Subconcultas y subconsultas anidadas (de forma iterativa)
-            if term == '(':
-                i += 1
-                q2 = ''
-                aux = 0
-                while aux >= 0:
-                    if q[i] == '(':
-                        aux += 1
-                    if q[i] == ')':
-                        aux -= 1
-                    q2 += q[i] + ' '
-                    i += 1
-                q2 = q2.strip()
-                q2 = q2[0:len(q2) - 1]
-                res.append(self.solve_query(q2))
-            else:
-                # 2º Consultas multifield
-                if ':' in term:
-                    field = term[0:term.find(':')]
-                    term = term[term.find(':') + 1:]
-                else:
-                    field = 'article'
-                # Se codifica los conectores básicos para un posterior tratado
-                if term == 'AND':
-                    res += [1]
-                    i += 1
-                elif term == 'OR':
-                    res += [0]
-                    i += 1
-                elif term == 'NOT':
-                    res += [-1]
-                    i += 1
-                else:
-                    # 3º Consultas permuterm (wildcard query)
-                    term = term.lower()
-                    if '*' in term:
-                        res.append(self.get_permuterm(term, field))
-                        i += 1
-                    elif '?' in term:
-                        res.append(self.get_permuterm(term, field))
-                        i += 1
-                    else:
-                        # 4º Consultas posicionales
-                        aux = 0
-                        terms = []
-                        while (i + aux) < len(q) and q[i + aux] != 'AND' and q[i + aux] != 'OR' and q[i + aux] != 'NOT':
-                            terms.append(q[i + aux])
-                            aux += 1
-                        if len(terms) == 1:
-                            if self.use_stemming:
-                                res.append(self.get_stemming(term, field))
-                            else:
-                                res.append(self.get_posting(term, field))
-                            i += 1
-                        else:
-                            res.append(self.get_positionals(terms, field))
-                            i += aux
+        return: nodo raiz, None si la consulta esta vacia
 
-        # Bucle que realiza, en segundo lugar, las funcionalidades básicas
-        ret = []
-        i = 0
-        while i < len(res):
-            # Según la codificación anterior realiza NOT o AND o OR, respectivamente
-            r = res[i]
-            if r == 1:
-                if res[i + 1] == -1:
-                    seg = self.reverse_posting(res[i + 2])
-                    i += 3
-                else:
-                    seg = res[i + 1]
-                    i += 2
-                ret = self.and_posting(ret, seg)
-            elif r == 0:
-                if res[i + 1] == -1:
-                    seg = self.reverse_posting(res[i + 2])
-                    i += 3
+        """
+        return SAR_query.parse(query or '')
+
+    def optimize_query(self, node, shared=None):
+        """
+        Optimiza el arbol de una consulta sin cambiar su resultado:
+            - los AND y OR anidados se juntan en un solo nodo y se quitan los hijos repetidos
+            - los NOT de un AND pasan a ser un AND NOT (diferencia) y los dobles NOT se eliminan
+            - los hijos de los AND y OR se ordenan por numero estimado de resultados
+            - las subconsultas repetidas pasan a ser el mismo nodo y solo se evaluan una vez
+
+        param:  "node": nodo devuelto por SAR_query.parse
+                "shared": nodos ya optimizados por clave (ver SAR_query), para compartirlos
+
+        return: nodo optimizado
+
+        """
+        if shared is None:
+            shared = {}
+        if node.key in shared:
+            return shared[node.key]
+
+        if isinstance(node, SAR_query.Not):
+            child = self.optimize_query(node.child, shared)
+            res = child.child if isinstance(child, SAR_query.Not) else SAR_query.Not(child)
+        elif isinstance(node, (SAR_query.And, SAR_query.Or)):
+            kind = type(node)
+            flat = {}
+            for child in node.children:
+                child = self.optimize_query(child, shared)
+                if type(child) is kind:
+                    grandchildren = child.children
+                elif kind is SAR_query.And and isinstance(child, SAR_query.AndNot):
+                    # Se deshace el AND NOT para juntarlo con el resto de hijos del AND
+                    grandchildren = child.child.children if isinstance(child.child, SAR_query.And) else [child.child]
+                    grandchildren = grandchildren + [SAR_query.Not(excluded) for excluded in child.excluded]
                 else:
-                    seg = res[i + 1]
-                    i += 2
-                ret = self.or_posting(ret, seg)
-            elif r == -1:
-                ret = self.reverse_posting(res[i + 1])
-                i += 2
+                    grandchildren = [child]
+                for grandchild in grandchildren:
+                    flat.setdefault(grandchild.key, shared.get(grandchild.key, grandchild))
+            # De menor a mayor: el AND empieza por la lista mas corta y el OR une primero las pequeñas
+            children = sorted(flat.values(), key=self.estimate)
+            positives = [child for child in children if not isinstance(child, SAR_query.Not)]
+            if len(children) == 1:
+                res = children[0]
+            elif kind is SAR_query.Or:
+                res = SAR_query.Or(children)
+            elif 0 < len(positives) < len(children):
+                child = positives[0] if len(positives) == 1 else SAR_query.And(positives)
+                res = SAR_query.AndNot(child, [child.child for child in children if isinstance(child, SAR_query.Not)])
             else:
-                ret = r
-                i += 1
+                res = SAR_query.And(children)
+        else:
+            res = node
+
+        shared[node.key] = res
+        return shared.setdefault(res.key, res)
+
+    def estimate(self, node):
+        """
+        Estima el numero de resultados de un nodo del arbol de una consulta con el tamaño
+        de las posting lists, sin evaluarlo. Se guarda en el nodo para no repetirlo.
+
+        param:  "node": nodo de SAR_query
+
+        return: numero estimado de noticias
+
+        """
+        if node.size is not None:
+            return node.size
+        # Si el resultado ya esta en la cache de self.evaluate() se usa su tamaño, asi no se
+        # expanden otra vez los comodines
+        cached = self.query_cache.get((self.use_stemming, node.key)) if self.query_cache_size > 0 else None
+        if cached is not None and not isinstance(cached, NotPosting):
+            node.size = len(cached)
+            return node.size
+        n = len(self.news)
+        if isinstance(node, SAR_query.Term):
+            index = self.index[node.field]
+            if '*' in node.term or '?' in node.term:
+                # Los terminos del comodin se guardan en el nodo para no buscarlos otra vez al evaluarlo
+                node.tokens = self.get_permuterm_terms(node.term, node.field)
+                size = min(n, sum(len(index[token]) for token in node.tokens if token in index))
+            elif self.use_stemming and not node.exact:
+                size = len(self.spindex[node.field].get(self.stem(node.term), ()))
+            else:
+                size = len(index.get(node.term, ()))
+        elif isinstance(node, SAR_query.Phrase):
+            index = self.index[node.field]
+            size = min(len(index.get(term, ())) for term in node.terms if not self.NEAR.fullmatch(term))
+        elif isinstance(node, SAR_query.Not):
+            size = n - self.estimate(node.child)
+        elif isinstance(node, SAR_query.And):
+            size = min(self.estimate(child) for child in node.children)
+        elif isinstance(node, SAR_query.AndNot):
+            size = self.estimate(node.child)
+        else:
+            size = min(n, sum(self.estimate(child) for child in node.children))
+        node.size = size
+        return size
+
+    def evaluate(self, node, memo=None):
+        """
+        Evalua el arbol (optimizado) de una consulta. Los resultados intermedios pueden quedar
+        sin materializar: complementos perezosos, bitmaps o posting lists comprimidas.
+
+        Los resultados de las subconsultas que cuesta calcular (comodines, consultas posicionales,
+        AND y OR) se guardan en la cache LRU self.query_cache para las siguientes consultas.
+        La clave incluye si se usa stemming, el campo ya forma parte de la clave del nodo.
+
+        param:  "node": nodo de SAR_query
+                "memo": resultados ya calculados por clave de nodo
 
-        return ret
+        return: resultado del nodo (ver self.materialize())
+
+        """
+        if memo is None:
+            memo = {}
+        if node.key in memo:
+            return memo[node.key]
+
+        # Los terminos sin comodines y los NOT no se guardan, obtenerlos es inmediato
+        cached = self.query_cache_size > 0 and not isinstance(node, SAR_query.Not) and \
+            not (isinstance(node, SAR_query.Term) and '*' not in node.term and '?' not in node.term)
+        if cached:
+            key = (self.use_stemming, node.key)
+            if key in self.query_cache:
+                self.cache_hits += 1
+                self.query_cache.move_to_end(key)
+                res = memo[node.key] = self.query_cache[key]
+                return res
+            self.cache_misses += 1
+
+        if isinstance(node, SAR_query.Term):
+            if '*' in node.term or '?' in node.term:
+                res = self.get_permuterm(node.term, node.field, node.tokens)
+            elif self.use_stemming and not node.exact:
+                res = self.get_stemming(node.term, node.field)
+            else:
+                res = self.get_posting(node.term, node.field)
+        elif isinstance(node, SAR_query.Phrase):
+            res = self.get_positionals(node.terms, node.field)
+        elif isinstance(node, SAR_query.Not):
+            # El NOT no se materializa hasta que hace falta
+            res = NotPosting.negate(self.evaluate(node.child, memo))
+        elif isinstance(node, SAR_query.And):
+            postings = []
+            for child in node.children:
+                posting = self.evaluate(child, memo)
+                # Si un hijo no tiene resultados no hace falta evaluar el resto
+                if not isinstance(posting, NotPosting) and len(posting) == 0:
+                    postings = [[]]
+                    break
+                postings.append(posting)
+            res = self.and_postings(postings)
+        elif isinstance(node, SAR_query.AndNot):
+            res = self.evaluate(node.child, memo)
+            for child in node.excluded:
+                if not isinstance(res, NotPosting) and len(res) == 0:
+                    break
+                res = self.minus_posting(res, self.evaluate(child, memo))
+        else:
+            res = []
+            for child in node.children:
+                res = self.or_posting(res, self.evaluate(child, memo))
+
+        if cached:
+            self.query_cache[key] = res
+            if len(self.query_cache) > self.query_cache_size:
+                self.query_cache.popitem(last=False)
+        memo[node.key] = res
+        return res
+
+    def cache_stats(self):
+        """
+        Devuelve las estadisticas de la cache de subconsultas (ver self.evaluate()).
+
+        return: cadena con los aciertos, los fallos y el numero de subconsultas guardadas
+
+        """
+        total = self.cache_hits + self.cache_misses
+        return 'Query cache: {} hits, {} misses ({:.1f}% hit rate), {} entries'.format(
+            self.cache_hits, self.cache_misses, 100 * self.cache_hits / total if total else 0, len(self.query_cache))
+
+    def explain(self, query):
+        """
+        Devuelve el plan de una consulta: el arbol optimizado con el numero estimado de
+        resultados de cada nodo. Las subconsultas compartidas solo se desarrollan la primera vez.
+
+        param:  "query": cadena con la query
+
+        return: cadena con el plan, una linea por nodo
+
+        """
+        node = self.parse_query(query)
+        if node is None:
+            return 'EMPTY'
+        node = self.optimize_query(node)
+
+        lines = []
+        seen = set()
+
+        def show(node, depth):
+            line = '{}{}  [~{}]'.format('  ' * depth, node.label(), self.estimate(node))
+            if node.key in seen and SAR_query.children(node):
+                lines.append(line + ' (shared)')
+                return
+            seen.add(node.key)
+            lines.append(line)
+            for i, child in enumerate(SAR_query.children(node)):
+                # En un AND NOT los hijos a partir del primero son los que se restan
+                if isinstance(node, SAR_query.AndNot) and i > 0:
+                    lines.append('{}EXCEPT'.format('  ' * (depth + 1)))
+                show(child, depth + 1)
+
+        show(node, 0)
+        return '\n'.join(lines)
+
+    def reset_profile(self):
+        """
+        Empieza a medir una consulta nueva (ver self.set_profile()).
+
+        """
+        self.profile = {'start': time.perf_counter(),
+                        'stack': [],
+                        'time': {},
+                        'calls': {},
+                        'postings': 0,
+                        'posting_length': 0,
+                        'wildcard_terms': 0,
+                        'news_read': 0,
+                        'news_loaded': 0}
+
+    def profiled(self, method, name, stage):
+        """
+        Devuelve una version de "method" que suma su tiempo a la etapa "stage" de self.profile.
+
+        Los tiempos son exclusivos: mientras se ejecuta una llamada a otro metodo medido (por
+        ejemplo el OR de las posting lists de un comodin) el tiempo se cuenta en la etapa de esa
+        llamada, asi la suma de las etapas no pasa del tiempo total de la consulta.
+        Ademas se cuentan las posting lists obtenidas y su longitud, los terminos de los
+        comodines y las noticias leidas (de la cache o del fichero).
+
+        param:  "method": metodo original ya ligado a este objeto
+                "name": nombre del metodo
+                "stage": etapa de la consulta
+
+        return: funcion que sustituye al metodo
+        """
+        def wrapper(*args, **kwargs):
+            profile = self.profile
+            stack = profile['stack']
+            start = time.perf_counter()
+            # Se para el reloj de la etapa que llama
+            if stack:
+                outer = stack[-1]
+                profile['time'][outer[0]] = profile['time'].get(outer[0], 0.0) + start - outer[1]
+            stack.append([stage, start])
+            cached = name == 'get_new' and args[0] in self.new_cache
+            try:
+                res = method(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                # Desde la ultima vez que se ha reanudado el reloj de esta llamada
+                resumed = stack.pop()[1]
+                profile['time'][stage] = profile['time'].get(stage, 0.0) + end - resumed
+                profile['calls'][name] = profile['calls'].get(name, 0) + 1
+                if stack:
+                    stack[-1][1] = end
+            if name in ('get_posting', 'get_stemming'):
+                profile['postings'] += 1
+                profile['posting_length'] += len(res)
+            elif name == 'get_permuterm_terms':
+                profile['wildcard_terms'] += len(res)
+            elif name == 'get_new':
+                profile['news_read'] += 1
+                profile['news_loaded'] += not cached
+            return res
+
+        return wrapper
+
+    def profile_report(self, query):
+        """
+        Devuelve las medidas de la consulta actual y empieza a medir la siguiente.
+
+        param:  "query": query medida
+
+        return: diccionario con el tiempo total y el de cada etapa en milisegundos ('other' es
+                el tiempo fuera de los metodos medidos), las llamadas a cada metodo y los contadores
+
+        """
+        profile = self.profile
+        total = time.perf_counter() - profile['start']
+        stages = {stage: round(t * 1000, 4) for stage, t in profile['time'].items()}
+        stages['other'] = round((total - sum(profile['time'].values())) * 1000, 4)
+        report = {'query': query,
+                  'total_ms': round(total * 1000, 4),
+                  'stages_ms': stages,
+                  'calls': profile['calls']}
+        for counter in ('postings', 'posting_length', 'wildcard_terms', 'news_read', 'news_loaded'):
+            report[counter] = profile[counter]
+        self.reset_profile()
+        return report
 
     def get_posting(self, term, field='article', wildcard='False'):
         """
@@ -609,18 +1895,62 @@ class SAR_Project:
         # Posting list de un stem
         elif self.use_stemming and not wildcard:
             res = self.get_stemming(term, field)
-        # Posting list de un termino
+        # Posting list de un termino, los terminos densos como bitmap
         else:
-            if term in self.index[field]:
-                res = list(self.index[field][term].keys())
+            res = self.get_bitmap(term, field)
+            if res is None and term in self.index[field]:
+                res = self.index[field][term]
+                # Las posting lists comprimidas se devuelven sin decodificar, el AND solo
+                # decodificara los bloques necesarios
+                if not isinstance(res, CompressedPosting):
+                    res = self.posting_ids(res)
+            elif res is None:
+                res = []
 
         return res
 
+    def posting_ids(self, posting):
+        """
+        Devuelve la lista ordenada de newids de una posting list del indice, sea cual sea su representacion.
+
+        param:  "posting": posting list (diccionario, ArrayPosting, CompressedPosting o MappedPosting)
+
+        return: lista de newids
+        """
+        if isinstance(posting, (ArrayPosting, CompressedPosting)):
+            return posting.ids()
+        return list(posting.keys())
+
+    def posting_cursor(self, posting):
+        """
+        Devuelve un cursor para recorrer en orden los newids de una posting list del indice, sea cual
+        sea su representacion, sin copiarlos en una lista (ver SAR_postings.PostingCursor).
+
+        param:  "posting": posting list (diccionario, ArrayPosting, CompressedPosting, MappedPosting o lista)
+
+        return: cursor con el newid actual en "new" y los metodos "advance" y "seek"
+        """
+        if isinstance(posting, CompressedPosting):
+            return CompressedCursor(posting)
+        if isinstance(posting, ArrayPosting):
+            return PostingCursor(posting.index.ids, posting.lo, posting.hi)
+        if isinstance(posting, SAR_storage.MappedPosting):
+            return PostingCursor(posting.ids)
+        if isinstance(posting, dict):
+            return IterCursor(posting)
+        return PostingCursor(posting)
+
     def get_positionals(self, terms, field='article'):
         """
         NECESARIO PARA LA AMPLIACION DE POSICIONALES
 
         Devuelve la posting list asociada a una secuencia de terminos consecutivos.
+        Entre dos terminos puede haber un operador NEAR/k: el segundo debe aparecer a una
+        distancia de como mucho k posiciones del primero, antes o despues.
+
+        Primero se intersectan las noticias de todos los terminos y despues, en cada noticia,
+        se mezclan las listas ordenadas de posiciones de cada par de terminos seguidos.
+        Sin indice posicional solo se hace la interseccion de noticias.
 
         param:  "terms": lista con los terminos consecutivos para recuperar la posting list.
                 "field": campo sobre el que se debe recuperar la posting list, solo necesario se se hace la ampliacion de multiples indices
@@ -628,35 +1958,110 @@ class SAR_Project:
         return: posting list
 
         """
+        words, gaps = self.split_near(terms)
+        if not words or any(word not in self.index[field] for word in words):
+            return []
+        postings = [self.index[field][word] for word in words]
+        news = self.materialize(self.and_postings(
+            [p if isinstance(p, CompressedPosting) else self.posting_ids(p) for p in postings]))
+        if not self.positional:
+            return news
+        if isinstance(self.index, SAR_storage.LazyFields):
+            # Las posiciones de un indice cargado con pickle se leen al usarlas por primera vez
+            postings = [self.index.positions(field, word) for word in words]
+
         res = []
+        for new in news:
+            positions = postings[0][new]
+            for posting, gap in zip(postings[1:], gaps):
+                positions = self.merge_positions(positions, posting[new], gap)
+                if not positions:
+                    break
+            if positions:
+                res.append(new)
 
-        # NO FUNCIONA BIEN
-        # Se comprueba que se ha indexado el primer termino
-        if terms[0] in self.index[field]:
-            # Se recorre la posting list del primer termino (quitando el número de documentos)
-            for post in self.index[field][terms[0]].items():
-                seguido = True
-                # Obtenemos la noticia y la posición
-                new, list_pos = post
-                # Se comprueba que, para los siguientes terminos, eixste una entrada con ese noticia y una posición más
-                for position in list_pos:
-                    for term in (term for term in terms[1:] if seguido):
-                        if term in self.index[field]:
-                            if new in self.index[field][term]:
-                                if position + 1 in self.index[field][term][new]:
-                                    position += 1
-                                else:
-                                    seguido = False
-                            else:
-                                seguido = False
-                        else:
-                            seguido = False
+        return res
+
+    def merge_positions(self, p1, p2, gap=None):
+        """
+        Mezcla dos listas ordenadas de posiciones de una misma noticia.
 
-                if seguido:
-                    res += [new]
+        param:  "p1": posiciones validas del termino anterior
+                "p2": posiciones del termino siguiente
+                "gap": None si el termino debe ir justo despues, k si debe estar a como mucho k posiciones
+
+
+        return: posiciones de p2 que cumplen la condicion con alguna posicion de p1
+
+        """
+        res = []
+        i = 0
+        j = 0
+        if gap is None:
+            while i < len(p1) and j < len(p2):
+                if p1[i] + 1 == p2[j]:
+                    res.append(p2[j])
+                    i += 1
+                    j += 1
+                elif p1[i] + 1 < p2[j]:
+                    i += 1
+                else:
+                    j += 1
+            return res
+
+        for pos in p2:
+            # Primera posicion de p1 dentro de la ventana [pos - gap, pos + gap], sin contar la propia pos
+            while i < len(p1) and p1[i] < pos - gap:
+                i += 1
+            j = i
+            if j < len(p1) and p1[j] == pos:
+                j += 1
+            if j < len(p1) and p1[j] <= pos + gap:
+                res.append(pos)
 
         return res
 
+    def split_near(self, terms):
+        """
+        Separa los terminos de una consulta posicional de los operadores NEAR/k.
+
+        param:  "terms": terminos de la consulta posicional
+
+        return: tupla (terminos, distancia de cada termino a su anterior: None si debe ir
+                justo despues, k con NEAR/k), la segunda lista tiene un elemento menos
+
+        """
+        words = []
+        gaps = []
+        near = None
+        for term in terms:
+            match = self.NEAR.fullmatch(term)
+            if match:
+                near = int(match.group(1))
+            else:
+                if words:
+                    gaps.append(near)
+                words.append(term)
+                near = None
+        return words, gaps
+
+    def term_positions(self, term, field, new):
+        """
+        Devuelve las posiciones de un termino del indice posicional en una noticia.
+
+        param:  "term": termino del indice
+                "field": campo del termino
+                "new": newid de la noticia
+
+        return: lista ordenada de posiciones, vacia si el termino no esta en la noticia
+
+        """
+        if isinstance(self.index, SAR_storage.LazyFields):
+            posting = self.index.positions(field, term)
+        else:
+            posting = self.index[field].get(term, {})
+        return posting[new] if new in posting else []
+
     def get_stemming(self, term, field='article'):
         """
         NECESARIO PARA LA AMPLIACION DE STEMMING
@@ -671,20 +2076,18 @@ class SAR_Project:
         """
 
         # Se obtiene el stem de un término
-        stem = self.stemmer.stem(term)
+        stem = self.stem(term)
         res = []
 
-        # Se hace la unión de las posting list de cada termino que contenga la entrada en el indice de stems
-        if stem in self.sindex[field]:
-
-            for token in self.sindex[field][stem]:
-                # Se utiliza el OR propio por eficiencia
-                res = self.or_posting(
-                    res, list(self.index[field][token].keys()))
+        # La posting list del stem ya tiene la union de las de sus terminos (ver make_stem_postings)
+        if stem in self.spindex[field]:
+            res = self.spindex[field][stem]
+            if not isinstance(res, CompressedPosting):
+                res = self.posting_ids(res)
 
         return res
 
-    def get_permuterm(self, term, field='article'):
+    def get_permuterm(self, term, field='article', tokens=None):
         """
         NECESARIO PARA LA AMPLIACION DE PERMUTERM
 
@@ -692,11 +2095,36 @@ class SAR_Project:
 
         param:  "term": termino para recuperar la posting list, "term" incluye un comodin (* o ?).
                 "field": campo sobre el que se debe recuperar la posting list, solo necesario se se hace la ampliacion de multiples indices
+                "tokens": terminos del indice que encajan con "term", si ya se han buscado (ver self.estimate())
 
         return: posting list
 
         """
         res = []
+        if tokens is None:
+            tokens = self.get_permuterm_terms(term, field)
+
+        # Se hace la unión de las diferentes posting list de cada termino al que apunta un indice permuterm
+        for token in tokens:
+            # Se utiliza el OR propio por eficiencia
+            # Se activa el campor wildcard=True para evitar que haga el stem de cada término
+            res = self.or_posting(res, self.get_posting(
+                token, field, wildcard=True))
+
+        return res
+
+    def get_permuterm_terms(self, term, field='article'):
+        """
+        Devuelve los terminos del indice que encajan con un termino con comodin, usando el indice permuterm.
+
+        param:  "term": termino con comodin (* o ?)
+                "field": campo sobre el que se buscan los terminos
+
+        return: lista de terminos sin repetir
+
+        """
+        if self.kgram:
+            return self.get_kgram_terms(term, field)
 
         # Se construye la wildcard query del termino comodín
         term += '$'
@@ -706,17 +2134,80 @@ class SAR_Project:
         simbolo = term[-1]
         term = term[:-1]
 
-        # Se hace la unión de las diferentes posting list de cada termino al que apunta un indice permuterm
         # Si el comodin es '*', se busca todos los permuterms que comiencen por la wildcard query
         # Si el comidin es '?', lo mismo pero que ademas la longitud sea igual a la del término original
-        for permuterm in (x for x in list(self.ptindex[field].keys()) if x.startswith(term) and (simbolo == '*' or len(x) == len(term) + 1)):
-            for token in self.ptindex[field][permuterm]:
-                # Se utiliza el OR propio por eficiencia
-                # Se activa el campor wildcard=True para evitar que haga el stem de cada término
-                res = self.or_posting(res, self.get_posting(
-                    token, field, wildcard=True))
+        res = {}
+        for permuterm, tokens in self.permuterm_prefix(term, field):
+            if simbolo == '*' or len(permuterm) == len(term) + 1:
+                for token in tokens:
+                    res[token] = True
 
-        return res
+        return list(res)
+
+    def get_kgram_terms(self, term, field='article'):
+        """
+        NECESARIO PARA LA AMPLIACION DE K-GRAMAS
+
+        Devuelve los terminos del indice que encajan con un termino con cualquier numero de
+        comodines, usando el indice de k-gramas: se intersectan los terminos de los k-gramas
+        del patron y los candidatos se filtran con una expresion regular.
+
+        param:  "term": termino con comodines (* o ?)
+                "field": campo sobre el que se buscan los terminos
+
+        return: lista de terminos sin repetir
+
+        """
+        k = self.KGRAM_K
+        grams = set()
+        # Los k-gramas de cada trozo sin comodines, los extremos con '$' sirven desde k-1
+        for piece in re.split(r'[*?]', '$' + term + '$'):
+            grams.update(piece[i:i + k] for i in range(len(piece) - k + 1))
+            if len(piece) == k - 1 and (piece[0] == '$' or piece[-1] == '$'):
+                grams.add(piece)
+
+        kindex = self.kindex[field]
+        if any(gram not in kindex for gram in grams):
+            return []
+        if grams:
+            candidates = self.and_postings([kindex[gram] for gram in grams])
+        else:
+            # Sin ningun k-grama (por ejemplo "?" o "*") todos los terminos son candidatos
+            candidates = range(len(self.kterms[field]))
+
+        pattern = re.compile(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in term))
+        res = {}
+        for term_id in candidates:
+            token = self.kterms[field][term_id]
+            if pattern.fullmatch(token) and token in self.index[field]:
+                res[token] = True
+
+        return list(res)
+
+    def permuterm_prefix(self, prefix, field='article'):
+        """
+        Recorre los permuterms que empiezan por "prefix" con dos busquedas binarias sobre las
+        claves ordenadas, el coste depende de los permuterms encontrados y no del vocabulario.
+
+        param:  "prefix": prefijo de los permuterms
+                "field": campo sobre el que se buscan
+
+        return: generador de tuplas (permuterm, lista de terminos)
+
+        """
+        ptindex = self.ptindex[field]
+        # En el formato binario el diccionario ya esta ordenado
+        if isinstance(ptindex, SAR_storage.MappedTable):
+            lo, hi = ptindex.prefix_range(prefix)
+            for i in range(lo, hi):
+                yield ptindex.key(i).decode('utf-8'), ptindex.value(i)
+        else:
+            keys = self.ptkeys[field]
+            lo = bisect.bisect_left(keys, prefix)
+            # Las claves que empiezan por el prefijo son menores que el prefijo seguido del mayor caracter
+            hi = bisect.bisect_left(keys, prefix + chr(sys.maxunicode), lo)
+            for permuterm in keys[lo:hi]:
+                yield permuterm, ptindex[permuterm]
 
     def reverse_posting(self, p):
         """
@@ -732,12 +2223,83 @@ class SAR_Project:
         return: posting list con todos los newid exceptos los contenidos en p
 
         """
-        # Obtenemos lista de todas las noticias
-        res = list(self.news.keys())
-        # Recorremos la posting list
-        for post in p:
-            # Eliminamos la noticia de la lista de todas las noticias
-            res.remove(post)
+        if isinstance(p, NotPosting):
+            return self.materialize(p.posting)
+        if isinstance(p, BitmapPosting):
+            return BitmapPosting(self.get_news_bitmap().bits & ~p.bits).ids()
+        p = self.materialize(p)
+        res = []
+        j = 0
+        # Recorremos todas las noticias a la vez que la posting list, en una sola pasada
+        for new in self.news.keys():
+            if j < len(p) and p[j] == new:
+                j += 1
+            else:
+                res.append(new)
+
+        return res
+
+    def materialize(self, p):
+        """
+        Devuelve la lista ordenada de newids de un resultado intermedio de solve_query.
+
+        param:  "p": posting list, posting list comprimida, bitmap o complemento perezoso
+
+        return: lista de newids
+        """
+        if isinstance(p, NotPosting):
+            return self.reverse_posting(p.posting)
+        if isinstance(p, (BitmapPosting, CompressedPosting)):
+            return p.ids()
+        return p
+
+    def to_bitmap(self, p):
+        """
+        Convierte un resultado intermedio de solve_query en bitmap.
+
+        param:  "p": posting list, posting list comprimida, bitmap o complemento perezoso
+
+        return: BitmapPosting con los mismos newids
+        """
+        if isinstance(p, BitmapPosting):
+            return p
+        if isinstance(p, NotPosting):
+            return BitmapPosting(self.get_news_bitmap().bits & ~self.to_bitmap(p.posting).bits)
+        return BitmapPosting.from_ids(self.materialize(p))
+
+    def minus_posting(self, p1, p2):
+        """
+        Calcula el AND NOT de dos posting list en una sola pasada, sin construir el complemento de p2.
+
+        param:  "p1", "p2": posting lists sobre las que calcular
+
+
+        return: posting list con los newid incluidos en p1 y no en p2
+
+        """
+        # Con bitmaps la diferencia es una operacion de bits o un filtrado de la lista
+        if isinstance(p1, BitmapPosting):
+            return BitmapPosting(p1.bits & ~self.to_bitmap(p2).bits)
+        if isinstance(p2, BitmapPosting):
+            return p2.select(self.materialize(p1), present=False)
+        p1 = self.materialize(p1)
+        p2 = self.materialize(p2)
+        res = []
+        j = 0
+        n = len(p2)
+        if len(p1) * self.GALLOP_RATIO > n:
+            for new in p1:
+                while j < n and p2[j] < new:
+                    j += 1
+                if j == n or p2[j] != new:
+                    res.append(new)
+            return res
+
+        # p2 es mucho mas larga: se busca cada newid de p1 con busqueda binaria
+        for new in p1:
+            j = bisect.bisect_left(p2, new, j)
+            if j == n or p2[j] != new:
+                res.append(new)
 
         return res
 
@@ -753,22 +2315,99 @@ class SAR_Project:
         return: posting list con los newid incluidos en p1 y p2
 
         """
+        if isinstance(p1, NotPosting) or isinstance(p2, NotPosting):
+            return self.and_postings([p1, p2])
+        # Entre bitmaps el AND se hace palabra a palabra, con una lista se filtra la lista
+        if isinstance(p1, BitmapPosting) and isinstance(p2, BitmapPosting):
+            return BitmapPosting(p1.bits & p2.bits)
+        if isinstance(p1, BitmapPosting):
+            return p1.select(self.materialize(p2))
+        if isinstance(p2, BitmapPosting):
+            return p2.select(self.materialize(p1))
+        # Si alguna posting list esta comprimida se intersecta bloque a bloque
+        if isinstance(p1, CompressedPosting) and isinstance(p2, CompressedPosting):
+            if len(p1) > len(p2):
+                p1, p2 = p2, p1
+            return p2.intersect(p1.ids())
+        if isinstance(p1, CompressedPosting):
+            return p1.intersect(p2)
+        if isinstance(p2, CompressedPosting):
+            return p2.intersect(p1)
+
+        if len(p1) > len(p2):
+            p1, p2 = p2, p1
         res = []
-        i = 0
+        # Con listas de tamaño parecido el merge lineal es lo mas rapido
+        if len(p1) * self.GALLOP_RATIO > len(p2):
+            i = 0
+            j = 0
+            # El pseudocodigo de teoria pasado a Python
+            while i < len(p1) and j < len(p2):
+                if p1[i] == p2[j]:
+                    res.append(p1[i])
+                    i += 1
+                    j += 1
+                elif p1[i] <= p2[j]:
+                    i += 1
+                elif p1[i] >= p2[j]:
+                    j += 1
+            return res
+
+        # Si no, se recorre la lista corta y se busca cada newid en la larga con
+        # busqueda exponencial (galloping) desde la ultima posicion encontrada
         j = 0
-        # El pseudocodigo de teoria pasado a Python
-        while i < len(p1) and j < len(p2):
-            if p1[i] == p2[j]:
-                res.append(p1[i])
-                i += 1
-                j += 1
-            elif p1[i] <= p2[j]:
-                i += 1
-            elif p1[i] >= p2[j]:
+        n = len(p2)
+        for newid in p1:
+            # Saltos de tamaño creciente hasta pasar el newid buscado
+            step = 1
+            hi = j
+            while hi < n and p2[hi] < newid:
+                j = hi + 1
+                hi += step
+                step <<= 1
+            # Busqueda binaria en el ultimo salto
+            j = bisect.bisect_left(p2, newid, j, min(hi, n))
+            if j == n:
+                break
+            if p2[j] == newid:
+                res.append(newid)
                 j += 1
 
         return res
 
+    def and_postings(self, postings):
+        """
+        Calcula el AND de varias posting lists empezando por las mas cortas, de forma que
+        el coste depende del tamaño de la lista mas rara y no del de las mas frecuentes.
+
+        param:  "postings": lista de posting lists sobre las que calcular
+
+
+        return: posting list con los newid incluidos en todas las posting lists
+
+        """
+        # Los NOT se restan al final en lugar de construir su complemento
+        negatives = [p.posting for p in postings if isinstance(p, NotPosting)]
+        postings = sorted((p for p in postings if not isinstance(p, NotPosting)), key=len)
+        if not postings:
+            # NOT a AND NOT b = NOT (a OR b)
+            res = negatives[0]
+            for p in negatives[1:]:
+                res = self.or_posting(res, p)
+            return NotPosting(res)
+
+        res = postings[0]
+        for p in postings[1:]:
+            if not res:
+                break
+            res = self.and_posting(res, p)
+        for p in negatives:
+            if not res:
+                break
+            res = self.minus_posting(res, p)
+
+        return res
+
     def or_posting(self, p1, p2):
         """
         NECESARIO PARA TODAS LAS VERSIONES
@@ -781,6 +2420,22 @@ class SAR_Project:
         return: posting list con los newid incluidos de p1 o p2
 
         """
+        # Con algun NOT el resultado sigue siendo un complemento:
+        # NOT a OR b = NOT (a AND NOT b), NOT a OR NOT b = NOT (a AND b)
+        if isinstance(p1, NotPosting) and isinstance(p2, NotPosting):
+            return NotPosting(self.and_posting(p1.posting, p2.posting))
+        if isinstance(p1, NotPosting):
+            return NotPosting(self.minus_posting(p1.posting, p2))
+        if isinstance(p2, NotPosting):
+            return NotPosting(self.minus_posting(p2.posting, p1))
+        if isinstance(p1, BitmapPosting) or isinstance(p2, BitmapPosting):
+            return BitmapPosting(self.to_bitmap(p1).bits | self.to_bitmap(p2).bits)
+
+        if isinstance(p1, CompressedPosting):
+            p1 = p1.ids()
+        if isinstance(p2, CompressedPosting):
+            p2 = p2.ids()
+
         res = []
         i = 0
         j = 0
@@ -842,46 +2497,109 @@ class SAR_Project:
         return: el numero de noticias recuperadas, para la opcion -T
         
         """
-        result = self.solve_query(query)
-        if self.use_ranking:
-            result = self.rank_result(result, query)
+        total, result = self.solve_and_list(query)
 
         print('========================================')
 
         print('Query: \'{}\''.format(query))
-        print('Number of results: {}'.format(len(result)))
+        print('Number of results: {}'.format(total))
 
         i = 1
-        for new in result:
-            aux = self.news[new]
-
-            with open(self.docs[self.news[new][0]]) as fh:
-                jlist = json.load(fh)
-                aux = jlist[self.news[new][1]]
-
-            if self.use_ranking:
-                puntuacion = self.jaccard(query, aux)
-            else:
-                puntuacion = 0
-
+        for noticia in result:
             # Si esta activada la función de snippets
             if not self.show_snippet:
                 print('#{:<4} ({}) ({}) ({}) {} ({})'.format(
-                    i, puntuacion, new, aux['date'], aux['title'], aux['keywords']))
+                    i, noticia['score'], noticia['newid'], noticia['date'], noticia['title'], noticia['keywords']))
             else:
                 print('#{}'.format(i))
-                print('Score: {}'.format(puntuacion))
-                print(new)
-                print('Date: {}'.format(aux['date']))
-                print('Title: {}'.format(aux['title']))
-                print('Keywords: {}'.format(aux['keywords']))
-                print('{}\n'.format(self.snippet(aux, query)))
+                print('Score: {}'.format(noticia['score']))
+                print(noticia['newid'])
+                print('Date: {}'.format(noticia['date']))
+                print('Title: {}'.format(noticia['title']))
+                print('Keywords: {}'.format(noticia['keywords']))
+                print('{}\n'.format(noticia['snippet']))
 
             i += 1
 
-            if not self.show_all and i > self.SHOW_MAX:
+        return total
+
+    def solve_and_list(self, query):
+        """
+        Resuelve una consulta y devuelve la informacion de las noticias recuperadas que muestra
+        solve_and_show (ordenadas si self.use_ranking, todas o las self.SHOW_MAX primeras
+        segun self.show_all y con snippet si self.show_snippet).
+
+        param:  "query": query que se debe resolver.
+
+        return: tupla (numero de noticias recuperadas, lista de diccionarios con las claves
+                'newid', 'score', 'date', 'title', 'keywords' y 'snippet' si se pide)
+
+        """
+        result = self.solve_query(query)
+        total = len(result)
+        if self.use_ranking:
+            result = self.rank_result(result, query)
+
+        # Los terminos de los snippets se preparan una sola vez para todas las noticias
+        terms = self.snippet_terms(query) if self.show_snippet and self.positional else None
+        res = []
+        for new in result:
+            aux = self.get_new(new)
+
+            if self.use_ranking:
+                # Puntuacion calculada al ordenar (ver self.rank_result())
+                puntuacion = round(self.scores[new], 6)
+            else:
+                puntuacion = 0
+
+            noticia = {'newid': new, 'score': puntuacion, 'date': aux['date'],
+                       'title': aux['title'], 'keywords': aux['keywords']}
+            if self.show_snippet:
+                noticia['snippet'] = self.snippet(aux, query, new, terms)
+            res.append(noticia)
+
+            if not self.show_all and len(res) >= self.SHOW_MAX:
                 break
 
+        return total, res
+
+    def solve_parallel(self, fnc, queries, jobs):
+        """
+        Resuelve una lista de consultas repartiendola entre "jobs" procesos.
+
+        Los procesos se crean con fork despues de cargar el indice, asi lo comparten sin copiarlo
+        (con el formato binario las posting lists son paginas del mismo fichero mapeado).
+        Los componentes de un indice guardado con --lazy se cargan antes, para no deserializarlos
+        en cada proceso.
+        Cada proceso captura lo que "fnc" escribe por la salida estandar y los resultados se
+        devuelven en el orden de "queries", por lo que la salida es la misma que en secuencial.
+        Si el sistema no tiene fork las consultas se resuelven en este proceso.
+
+        param:  "fnc": funcion que resuelve una consulta (self.solve_and_count, self.solve_and_show...)
+                "queries": lista de consultas
+                "jobs": numero de procesos
+
+        return: iterador de tuplas (salida de "fnc", valor devuelto por "fnc"), una por consulta
+
+        """
+        global _solver
+        _solver = (self, fnc)
+        if jobs <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            for query in queries:
+                yield _solve_captured(query)[:2]
+            return
+
+        # Se hacen bastantes bloques por proceso para repartir bien la carga, pero no de una consulta
+        # para no pagar la comunicacion entre procesos en cada una
+        chunksize = max(1, len(queries) // (jobs * 16))
+        self.load_components()
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            for output, result, hits, misses in pool.imap(_solve_captured, queries, chunksize):
+                # Las caches de subconsultas son de cada proceso, se suman sus estadisticas
+                self.cache_hits += hits
+                self.cache_misses += misses
+                yield output, result
+
     def rank_result(self, result, query):
         """
         NECESARIO PARA LA AMPLIACION DE RANKING
@@ -892,31 +2610,221 @@ class SAR_Project:
                 "query": query, puede ser la query original, la query procesada o una lista de terminos
 
 
-        return: la lista de resultados ordenada
+        return: la lista de resultados ordenada (con BM25 y sin self.show_all, solo los self.SHOW_MAX primeros)
+
+        Las puntuaciones quedan en self.scores.
 
         """
-        # Preprocesamos la consulta de términos que no queremos puntuar
-        query = query.replace('AND', '')
-        query = query.replace('OR', '')
-        query = query.replace('NOT ', 'NOT')
-        query = query.replace(':', ' ')
+        if self.rank_mode == 'bm25' and not self.show_all:
+            return self.rank_topk(result, query, self.SHOW_MAX)
+        if self.rank_mode == 'bm25':
+            return self.rank_bm25(result, query)
+
+        if not self.rank_data:
+            # Sin indice directo se compara la consulta con el texto de cada noticia
+            self.scores = {new: self.jaccard(query, self.get_new(new)) for new in result}
+        else:
+            # Jaccard con el indice directo, sin leer las noticias. Con muchos resultados, si el
+            # indice tiene MinHash, se estima en tiempo constante por noticia
+            approximate = self.minhash and len(result) > self.MINHASH_MIN_RESULTS
+            terms = self.jaccard_terms(query, sketch=approximate)
+            score = self.jaccard_minhash if approximate else self.jaccard_ids
+            self.scores = {new: score(terms, new) for new in result}
 
-        res = []
+        # Se ordena la lista de noticias según la puntuación
+        return sorted(result, key=lambda new: self.scores[new], reverse=True)
 
-        # Para cada noticia se obtiene su puntuación de Jaccard
-        # Se realiza, por cada noticia, una insercción tupla (noticia, puntuación)
+    def rank_bm25(self, result, query, terms=None):
+        '''
+        Ordena los resultados de una query con BM25.
+        Solo usa las posting lists de los terminos de la consulta y las longitudes guardadas
+        al indexar (self.lengths, self.total_length), no lee ninguna noticia.
+        Las puntuaciones quedan en self.scores.
+
+        param:  "result": lista de resultados sin ordenar
+                "query": query sin procesar
+                "terms": terminos ya preparados con self.bm25_terms(), si no se indican se obtienen de la query
+
+
+        return: la lista de resultados ordenada
+        '''
+        self.scores = dict.fromkeys(result, 0.0)
+        if terms is None:
+            terms = self.bm25_terms(query)
+
+        for posting, idf, lengths, avg_length, _ in terms:
+            # Se recorre la lista mas corta, la posting list o los resultados
+            if len(posting) <= len(result):
+                pairs = ((new, value) for new, value in posting.items() if new in self.scores)
+            else:
+                pairs = ((new, posting[new]) for new in result if new in posting)
+            for new, value in pairs:
+                tf = value if isinstance(value, int) else len(value)
+                self.scores[new] += idf * self.bm25_tf(tf, lengths[new], avg_length)
+
+        return sorted(result, key=lambda new: self.scores[new], reverse=True)
+
+    def rank_topk(self, result, query, k):
+        '''
+        Obtiene las "k" mejores noticias de "result" segun BM25 con el algoritmo WAND, sin puntuarlas todas.
+
+        Cada termino de la consulta tiene un cursor sobre su posting list y una cota de su puntuacion
+        (ver self.make_term_bounds()). Ordenando los cursores por newid, el pivote es el primer newid
+        en el que la suma de las cotas supera la peor puntuacion del top-k: las noticias anteriores
+        no pueden entrar en el top-k y los cursores saltan directamente al pivote.
+        El resultado es el mismo que ordenar todas las puntuaciones (a igual puntuacion, menor newid primero).
+
+        param:  "result": lista de resultados sin ordenar
+                "query": query sin procesar
+                "k": numero de resultados a devolver
+
+
+        return: lista con las "k" mejores noticias ordenadas
+        '''
+        terms = self.bm25_terms(query)
+        # Con pocos resultados o muchos terminos (comodines, stems) es mas rapido puntuarlos todos
+        if len(result) <= k or len(terms) > self.WAND_MAX_TERMS:
+            return self.rank_bm25(result, query, terms)[:k]
+
+        candidates = set(result)
+        cursors = [self.posting_cursor(posting) for posting, _, _, _, _ in terms]
+
+        # Monticulo de minimos con (puntuacion, -newid): la raiz es la peor noticia del top-k
+        heap = []
+        threshold = 0.0
+        while True:
+            order = sorted((cursor.new, t) for t, cursor in enumerate(cursors) if cursor.new is not None)
+            # Se busca el pivote
+            acc = 0.0
+            pivot = None
+            for j, (_, t) in enumerate(order):
+                acc += terms[t][4]
+                # Margen para los errores de redondeo de las cotas
+                if acc * (1 + 1e-9) > threshold:
+                    pivot = j
+                    break
+            if pivot is None:
+                break
+
+            pivot_new = order[pivot][0]
+            if order[0][0] == pivot_new:
+                # Todos los cursores anteriores estan en el pivote: se puntua (en el orden de la consulta)
+                if pivot_new in candidates:
+                    score = 0.0
+                    for t, cursor in enumerate(cursors):
+                        if cursor.new == pivot_new:
+                            posting, idf, lengths, avg_length, _ = terms[t]
+                            value = posting[pivot_new]
+                            tf = value if isinstance(value, int) else len(value)
+                            score += idf * self.bm25_tf(tf, lengths[pivot_new], avg_length)
+                    if len(heap) < k:
+                        heapq.heappush(heap, (score, -pivot_new))
+                    elif (score, -pivot_new) > heap[0]:
+                        heapq.heapreplace(heap, (score, -pivot_new))
+                    if len(heap) == k:
+                        threshold = heap[0][0]
+                for cursor in cursors:
+                    if cursor.new == pivot_new:
+                        cursor.advance()
+            else:
+                # Los cursores anteriores al pivote saltan a el (sin leer los newids intermedios)
+                for _, t in order[:pivot]:
+                    cursors[t].seek(pivot_new)
+
+        top = sorted(heap, reverse=True)
+        self.scores = {-new: score for score, new in top}
+        res = [-new for _, new in top]
+        # Si hay menos de k noticias con puntuacion se completan con las de puntuacion 0
         for new in result:
-            with open(self.docs[self.news[new][0]]) as fh:
-                jlist = json.load(fh)
-                aux = jlist[self.news[new][1]]
+            if len(res) >= k:
+                break
+            if new not in self.scores:
+                self.scores[new] = 0.0
+                res.append(new)
+        return res
+
+    def bm25_terms(self, query):
+        '''
+        Prepara los terminos de una consulta para BM25.
 
-            res.append([new, self.jaccard(query, aux)])
+        param:  "query": query sin procesar
 
-        # Se ordena la lista de noticias según la puntuación
-        res.sort(key=lambda tup: tup[1], reverse=True)
 
-        # Se devuelven solo las noticias
-        return [i[0] for i in res]
+        return: lista de tuplas (posting list, idf, longitudes del campo, longitud media del campo,
+                cota de la puntuacion del termino)
+        '''
+        n = len(self.news)
+        res = []
+        for field, term, exact in self.query_terms(query):
+            avg_length = self.total_length[field] / n if n > 0 else 0
+            for token, posting in self.term_postings(term, field, exact):
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                if token in self.term_bounds[field]:
+                    max_tf, min_length = self.term_bounds[field][token]
+                    bound = idf * self.bm25_tf(max_tf, min_length, avg_length)
+                else:
+                    bound = idf * (self.BM25_K1 + 1)
+                res.append((posting, idf, self.lengths[field], avg_length, bound))
+        return res
+
+    def bm25_tf(self, tf, length, avg_length):
+        '''
+        Parte de BM25 que depende de la frecuencia del termino y de la longitud del campo.
+        '''
+        norm = 1 - self.BM25_B + self.BM25_B * length / avg_length
+        return tf * (self.BM25_K1 + 1) / (tf + self.BM25_K1 * norm)
+
+    def query_terms(self, query):
+        '''
+        Obtiene los terminos de una consulta que se deben puntuar:
+        sin conectores, sin parentesis y sin los terminos (o subconsultas) negados con NOT.
+
+        param:  "query": query sin procesar
+
+
+        return: lista de tuplas (campo, termino, exacto), "exacto" es True si el termino se
+                recupera sin stemming (entre comillas o en una consulta posicional)
+        '''
+        res = []
+
+        def collect(node):
+            if isinstance(node, SAR_query.Term):
+                if node.field in self.index:
+                    res.append((node.field, node.term, node.exact))
+            elif isinstance(node, SAR_query.Phrase):
+                # Las consultas posicionales se resuelven sin stemming (ver self.get_positionals())
+                if node.field in self.index:
+                    res.extend((node.field, term, True) for term in node.terms if not self.NEAR.fullmatch(term))
+            # Se salta el operando negado: un termino, una subconsulta o una consulta posicional
+            elif not isinstance(node, SAR_query.Not):
+                for child in SAR_query.children(node):
+                    collect(child)
+
+        node = self.parse_query(query)
+        if node is not None:
+            collect(node)
+        return res
+
+    def term_postings(self, term, field='article', exact=False):
+        '''
+        Devuelve las posting lists (con frecuencias o posiciones) de los terminos del indice
+        que corresponden a un termino de la consulta: el propio termino, los terminos que
+        encajan con el comodin o, si esta activado el stemming, los terminos con el mismo stem.
+
+        param:  "term": termino de la consulta
+                "field": campo del termino
+                "exact": si es True no se aplica stemming, como al recuperar (ver self.evaluate())
+
+
+        return: lista de tuplas (termino del indice, posting list)
+        '''
+        if '*' in term or '?' in term:
+            tokens = self.get_permuterm_terms(term, field)
+        elif self.use_stemming and not exact:
+            tokens = self.sindex[field].get(self.stem(term), [])
+        else:
+            tokens = [term]
+        return [(token, self.index[field][token]) for token in tokens if token in self.index[field]]
 
     def jaccard(self, query, documento):
         '''
@@ -924,6 +2832,8 @@ class SAR_Project:
         Si la función de multifield está activada, realiza la combinación de la métrica de Jaccard para todos los campos.
         Se define la métrica de Jaccard como Jaccard(A, B) = A inter B / A union B.
         La métrica oscilara entre [1, 0] o [5, 0] si es multifield.
+        Al ordenar se usa el indice directo (ver self.jaccard_ids()), que da el mismo resultado
+        sin tokenizar la noticia.
 
         param:  "query": query procesada
                 "documento": la noticia, con todos sus campos
@@ -931,10 +2841,7 @@ class SAR_Project:
 
         return: la métrica de un par consulta - documento
         '''
-        query = query.replace('NOT ', 'NOT')
-        query = query.replace('AND', '')
-        query = query.replace('OR', '')
-        query = set(self.tokenize(query))
+        query = self.jaccard_query(query)
 
         metrica_total = 0
 
@@ -958,15 +2865,205 @@ class SAR_Project:
         # se toman 6 decimales para porder comparar bien
         return round(metrica_total, 6)
 
-    def snippet(self, new, query):
+    def jaccard_query(self, query):
+        '''
+        Obtiene los terminos de una consulta que se comparan con Jaccard: todos los tokens,
+        sin conectores ni operadores NEAR/k (los negados se unen a NOT y no coinciden con nada).
+
+        param:  "query": query sin procesar
+
+
+        return: conjunto de terminos
+        '''
+        query = query.replace('NOT ', 'NOT')
+        query = self.NEAR.sub('', query)
+        query = query.replace('AND', '')
+        query = query.replace('OR', '')
+        return set(self.tokenize(query))
+
+    def jaccard_fields(self):
+        '''
+        Devuelve los campos que se comparan con Jaccard, en el orden en que se suman.
+        '''
+        return ['title', 'article', 'date', 'keywords', 'summary'] if self.multifield else ['article']
+
+    def jaccard_terms(self, query, sketch=False):
+        '''
+        Prepara una consulta para "jaccard_ids" o "jaccard_minhash": por cada campo, los ids
+        (del indice directo) de los terminos de la consulta que estan en el campo.
+
+        param:  "query": query sin procesar
+                "sketch": si es True se calcula tambien el MinHash de la consulta en cada campo
+
+
+        return: lista de tuplas (campo, array ordenado de ids, numero de terminos de la consulta, MinHash o None)
+        '''
+        query = self.jaccard_query(query)
+        res = []
+        for field in self.jaccard_fields():
+            term_ids = self.term_ids[field]
+            ids = array('I', sorted(term_ids[term] for term in query if term in term_ids))
+            minhash = None
+            if sketch and query:
+                # Los terminos que no estan en el campo tienen ids nuevos, distintos de los de cualquier noticia
+                missing = range(len(term_ids), len(term_ids) + len(query) - len(ids))
+                minhash = self.sketch(list(ids) + list(missing))
+            res.append((field, ids, len(query), minhash))
+        return res
+
+    def jaccard_ids(self, terms, new):
+        '''
+        Obtiene la métrica de Jaccard de una noticia con el indice directo, igual que "jaccard":
+        la interseccion es el numero de ids de la consulta que estan en el array ordenado de la noticia.
+
+        param:  "terms": consulta preparada con "jaccard_terms"
+                "new": newid de la noticia
+
+
+        return: la métrica de un par consulta - documento
+        '''
+        metrica_total = 0
+        for field, ids, size, _ in terms:
+            document = self.forward[field].get(new, ())
+            inter = 0
+            for term_id in ids:
+                i = bisect.bisect_left(document, term_id)
+                if i < len(document) and document[i] == term_id:
+                    inter += 1
+            union = size + len(document) - inter
+            if union:
+                metrica_total += inter / union
+        return round(metrica_total, 6)
+
+    def jaccard_minhash(self, terms, new):
+        '''
+        Estima la métrica de Jaccard de una noticia con MinHash: en cada campo, la proporcion
+        de funciones hash en las que coinciden el minimo de la consulta y el de la noticia.
+
+        param:  "terms": consulta preparada con "jaccard_terms" (con "sketch")
+                "new": newid de la noticia
+
+
+        return: la métrica estimada de un par consulta - documento
+        '''
+        metrica_total = 0
+        for field, _, _, minhash in terms:
+            document = self.sketches[field].get(new)
+            if minhash is not None and document is not None:
+                metrica_total += sum(a == b for a, b in zip(minhash, document)) / self.MINHASH_SIZE
+        return round(metrica_total, 6)
+
+    def snippet_terms(self, query):
+        '''
+        Obtiene los terminos de una consulta que se buscan en cada noticia al construir su snippet
+        (ver self.snippet()). Se calcula una vez por consulta, asi los comodines y los stems no se
+        expanden otra vez para cada noticia.
+
+        param:  "query": query sin procesar
+
+
+        return: lista de tuplas (campo, terminos del indice, distancias): sin distancias (None) basta
+                con uno de los terminos (comodin o stem), con distancias es una consulta posicional
+                (ver self.split_near())
+        '''
+        res = []
+
+        def collect(node):
+            if isinstance(node, SAR_query.Term):
+                if node.field != 'date' and node.field in self.index:
+                    tokens = [token for token, _ in self.term_postings(node.term, node.field, node.exact)]
+                    res.append((node.field, tokens, None))
+            elif isinstance(node, SAR_query.Phrase):
+                if node.field != 'date' and node.field in self.index:
+                    words, gaps = self.split_near(node.terms)
+                    if words:
+                        res.append((node.field, words, gaps))
+            # Los terminos negados no estan en la noticia
+            elif not isinstance(node, SAR_query.Not):
+                for child in SAR_query.children(node):
+                    collect(child)
+
+        node = self.parse_query(query)
+        if node is not None:
+            collect(node)
+        return res
+
+    def snippet(self, new, query, newid=None, terms=None):
         '''
         Obtiene el snippet de una noticia.
 
+        Con el indice posicional se buscan en la noticia las posiciones de los terminos de la
+        consulta (los del comodin o con el mismo stem si esta activado, y las consultas
+        posicionales enteras) y cada fragmento se recorta del texto original con el inicio de
+        sus tokens guardado al indexar (self.offsets), sin volver a tokenizar la noticia.
+        Sin indice posicional se usa "snippet_tokens".
+
         param:  "new": la noticia, con todos sus campos
                 "query": query sin procesar
+                "newid": newid de la noticia, necesario para usar las posiciones
+                "terms": terminos de la consulta ya preparados con self.snippet_terms(), si no se
+                         indican se obtienen de la query
 
 
-        return: la métrica de un par consulta - documento
+        return: el snippet, entre comillas y con un fragmento por linea
+        '''
+        if newid is None or not self.positional or not any(self.offsets[field] for field in self.index):
+            return self.snippet_tokens(new, query)
+        if terms is None:
+            terms = self.snippet_terms(query)
+
+        # campo --> lista de (primera posicion, ultima posicion) de cada coincidencia
+        matches = {}
+        for field, words, gaps in terms:
+            if gaps is None:
+                first = min((positions[0] for positions in (self.term_positions(token, field, newid) for token in words)
+                             if positions), default=None)
+                if first is not None:
+                    matches.setdefault(field, []).append((first, first))
+                continue
+            positions = self.term_positions(words[0], field, newid)
+            for word, gap in zip(words[1:], gaps):
+                if not positions:
+                    break
+                positions = self.merge_positions(positions, self.term_positions(word, field, newid), gap)
+            if positions:
+                # Las posiciones son las del ultimo termino, la frase empieza como mucho "span" antes
+                span = sum(1 if gap is None else gap for gap in gaps)
+                matches.setdefault(field, []).append((max(positions[0] - span, 0), positions[0]))
+
+        fragments = []
+        for field, spans in matches.items():
+            text = new[field]
+            starts = self.offsets[field].get(newid)
+            if not starts:
+                continue
+            last = len(starts) - 1
+            # Se unen los fragmentos que se solapan
+            windows = []
+            for first, end in sorted(spans):
+                lo = max(first - self.SNIPPET_BEFORE, 0)
+                hi = min(end + self.SNIPPET_AFTER, last)
+                if windows and lo <= windows[-1][1] + 1:
+                    windows[-1][1] = max(windows[-1][1], hi)
+                else:
+                    windows.append([lo, hi])
+            for lo, hi in windows:
+                match = self.WORD.match(text, starts[hi])
+                fragment = ' '.join(text[starts[lo]:match.end() if match else len(text)].split())
+                fragments.append(('...' if lo > 0 else '') + fragment + ('...' if hi < last else ''))
+
+        # A diferencia del ejemplo, se ha optado por enmarcar el snippet en " "
+        return '"' + '\n'.join(fragments) + '"'
+
+    def snippet_tokens(self, new, query):
+        '''
+        Obtiene el snippet de una noticia volviendo a tokenizar sus campos (sin indice posicional).
+
+        param:  "new": la noticia, con todos sus campos
+                "query": query sin procesar
+
+
+        return: el snippet, entre comillas y con un fragmento por linea
         '''
         words = self.tokenize(new['article'])
         # Se preprocesa la consulta
@@ -976,6 +3073,7 @@ class SAR_Project:
         query = query.replace(')', '')
         query = query.replace('?', '')
         query = query.replace('NOT ', 'NOT')
+        query = self.NEAR.sub('', query)
         # Palabra rara para tener en cuenta campo multifield
         query = query.replace(':', 'HZMPOSICIONAL')
         query = self.tokenize(query)
@@ -1030,3 +3128,95 @@ class SAR_Project:
                 snippet += snippet_aux
 
         return snippet + '"'
+
+
+@functools.lru_cache(maxsize=None)
+def minhash_coefficients(size, seed, prime):
+    """
+    Devuelve los coeficientes (a, b) de las "size" funciones hash de MinHash, siempre los
+    mismos para una semilla (el indice y las consultas deben usar las mismas funciones).
+    """
+    rnd = random.Random(seed)
+    return [(rnd.randrange(1, prime), rnd.randrange(prime)) for _ in range(size)]
+
+
+def peak_memory(children=False):
+    """
+    Devuelve el pico de memoria residente (RSS) del proceso en bytes desde que empezo, None si no se puede medir.
+
+    param:  "children": si es True, el pico del mayor de los procesos hijos ya terminados
+            (por ejemplo los de index_dir con -j), no la suma de todos
+
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux da KB y macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def deep_getsizeof(obj, seen=None):
+    """
+    Calcula los bytes que ocupa un objeto en memoria incluyendo todo lo que contiene
+    (diccionarios, listas, arrays y atributos de objetos). Cada objeto se cuenta una sola vez.
+
+    param:  "obj": objeto a medir
+            "seen": ids de los objetos ya contados
+
+    return: numero de bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_getsizeof(k, seen) + deep_getsizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_getsizeof(x, seen) for x in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_getsizeof(vars(obj), seen)
+    return size
+
+
+# tupla (SAR_Project, funcion) de "SAR_Project.solve_parallel", los procesos la heredan con el fork
+_solver = None
+
+
+def _solve_captured(query):
+    """
+    Funcion auxiliar para "SAR_Project.solve_parallel" (debe estar a nivel de modulo para
+    poder enviarse a los procesos).
+
+    Resuelve una consulta con la funcion de _solver guardando lo que se escribe por la salida estandar.
+
+    param:  "query": consulta
+
+    return: tupla (salida, valor devuelto, aciertos y fallos de la cache de subconsultas)
+    """
+    searcher, fnc = _solver
+    hits, misses = searcher.cache_hits, searcher.cache_misses
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        result = fnc(query)
+    return output.getvalue(), result, searcher.cache_hits - hits, searcher.cache_misses - misses
+
+
+def _index_chunk(args):
+    """
+    Funcion auxiliar para "SAR_Project.index_parallel" (debe estar a nivel de modulo para
+    poder enviarse a los procesos).
+
+    Indexa un bloque de ficheros en un indice parcial y devuelve sus diccionarios.
+
+    param:  "args": tupla (lista de ficheros, multifield, positional)
+
+    return: tupla (docs, docs_stat, news, index, lengths, offsets) del indice parcial
+    """
+    filenames, multifield, positional = args
+    partial = SAR_Project()
+    partial.multifield = multifield
+    partial.positional = positional
+    for filename in filenames:
+        partial.index_file(filename)
+    return partial.docs, partial.docs_stat, partial.news, partial.index, partial.lengths, partial.offsets
@@ -0,0 +1,663 @@
+"""
+Representaciones alternativas de las posting lists del indice.
+
+Todas se comportan como el diccionario original (newid --> frecuencia o lista de posiciones),
+de modo que el resto de SAR_Project puede usarlas sin distinguir el tipo.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+from itertools import accumulate, compress
+
+
+###############################
+###                         ###
+###   COMPRESION (VBYTE)    ###
+###                         ###
+###############################
+
+# Numero de postings por bloque, cada bloque se puede decodificar por separado
+BLOCK_SIZE = 128
+
+
+def encode_varints(values, out=None):
+    """
+    Codifica una lista de enteros no negativos en variable-byte (7 bits por byte,
+    el bit alto indica que el numero continua en el siguiente byte).
+
+    param:  "values": enteros a codificar
+            "out": bytearray al que se añaden los bytes (se crea uno si no se indica)
+
+    return: el bytearray con los enteros codificados
+    """
+    if out is None:
+        out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+    return out
+
+
+def decode_varints(data):
+    """
+    Decodifica una secuencia de enteros codificada con "encode_varints".
+
+    param:  "data": bytes a decodificar
+
+    return: lista de enteros
+    """
+    # Si todos los numeros ocupan un byte la decodificacion la hace Python en C
+    if data.isascii():
+        return list(data)
+    res = []
+    value = 0
+    shift = 0
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        else:
+            res.append(value | (byte << shift))
+            value = 0
+            shift = 0
+    return res
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while data[pos] & 0x80:
+        value |= (data[pos] & 0x7f) << shift
+        shift += 7
+        pos += 1
+    return value | (data[pos] << shift), pos + 1
+
+
+def encode_posting(posting):
+    """
+    Comprime una posting list (diccionario newid --> frecuencia o posiciones ordenado por newid).
+
+    Formato: df, numero de bloques y, por bloque, (ultimo newid, bytes de newids y frecuencias,
+    bytes de posiciones); despues los bloques. Los newids se guardan como diferencias con el
+    anterior (el primero de cada bloque con el ultimo del bloque anterior) y las posiciones
+    como diferencias dentro de cada noticia.
+
+    param:  "posting": posting list a comprimir
+
+    return: bytes con la posting list comprimida
+    """
+    ids = list(posting)
+    header = encode_varints([len(ids), -(-len(ids) // BLOCK_SIZE)])
+    body = bytearray()
+    prev = 0
+    for start in range(0, len(ids), BLOCK_SIZE):
+        block = ids[start:start + BLOCK_SIZE]
+        values = [posting[new] for new in block]
+        gaps = [block[0] - prev] + [b - a for a, b in zip(block, block[1:])]
+        if values and isinstance(values[0], list):
+            tfs = [len(p) for p in values]
+            positions = bytearray()
+            for p in values:
+                encode_varints([p[0]] + [b - a for a, b in zip(p, p[1:])], positions)
+        else:
+            tfs = values
+            positions = b''
+        ids_tfs = encode_varints(tfs, encode_varints(gaps))
+        encode_varints([block[-1] - prev, len(ids_tfs), len(positions)], header)
+        body += ids_tfs
+        body += positions
+        prev = block[-1]
+    return bytes(header + body)
+
+
+class CompressedPosting(Mapping):
+    """
+    Posting list comprimida con "encode_posting".
+
+    Al crearla solo se lee la cabecera (un registro por bloque), los bloques se decodifican
+    cuando se necesitan, de modo que "intersect" y la busqueda de posiciones de una noticia
+    solo decodifican los bloques que pueden contener los newids buscados.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.df, pos = _read_varint(data, 0)
+        nblocks, pos = _read_varint(data, pos)
+        # Por bloque: ultimo newid, inicio de newids/frecuencias, inicio de posiciones, fin
+        self.last = []
+        self.bounds = []
+        last = 0
+        sizes = []
+        for _ in range(nblocks):
+            gap, pos = _read_varint(data, pos)
+            ids_len, pos = _read_varint(data, pos)
+            pos_len, pos = _read_varint(data, pos)
+            last += gap
+            self.last.append(last)
+            sizes.append((ids_len, pos_len))
+        for ids_len, pos_len in sizes:
+            self.bounds.append((pos, pos + ids_len, pos + ids_len + pos_len))
+            pos += ids_len + pos_len
+        # Bloques ya decodificados
+        self.blocks = {}
+        self.positions = {}
+
+    def block(self, b):
+        """
+        Decodifica los newids y frecuencias del bloque b.
+
+        return: tupla (lista de newids, lista de frecuencias)
+        """
+        if b not in self.blocks:
+            start, middle, _ = self.bounds[b]
+            values = decode_varints(self.data[start:middle])
+            n = len(values) // 2
+            ids = list(accumulate(values[:n], initial=self.last[b - 1] if b > 0 else 0))[1:]
+            self.blocks[b] = (ids, values[n:])
+        return self.blocks[b]
+
+    def block_positions(self, b):
+        """
+        Decodifica las posiciones del bloque b.
+
+        return: lista con la lista de posiciones de cada noticia del bloque
+        """
+        if b not in self.positions:
+            _, tfs = self.block(b)
+            _, middle, end = self.bounds[b]
+            gaps = decode_varints(self.data[middle:end])
+            res = []
+            start = 0
+            for tf in tfs:
+                res.append(list(accumulate(gaps[start:start + tf])))
+                start += tf
+            self.positions[b] = res
+        return self.positions[b]
+
+    def ids(self):
+        """
+        Devuelve todos los newids de la posting list.
+        """
+        res = []
+        for b in range(len(self.last)):
+            res += self.block(b)[0]
+        return res
+
+    def items(self):
+        """
+        Devuelve los pares (newid, frecuencia o posiciones) decodificando cada bloque una sola vez.
+        """
+        res = []
+        for b in range(len(self.last)):
+            ids, tfs = self.block(b)
+            _, middle, end = self.bounds[b]
+            res.extend(zip(ids, tfs if middle == end else self.block_positions(b)))
+        return res
+
+    def intersect(self, other):
+        """
+        Calcula la interseccion con una lista ordenada de newids, decodificando solo
+        los bloques cuyo rango de newids contiene algun elemento de "other".
+
+        param:  "other": lista ordenada de newids
+
+        return: lista ordenada de los newids comunes
+        """
+        res = []
+        j = 0
+        for b in range(len(self.last)):
+            # Se salta el bloque si no hay ningun newid de "other" hasta su ultimo newid
+            k = bisect_right(other, self.last[b], j)
+            if k > j:
+                ids, _ = self.block(b)
+                i = 0
+                while i < len(ids) and j < k:
+                    if ids[i] == other[j]:
+                        res.append(ids[i])
+                        i += 1
+                        j += 1
+                    elif ids[i] < other[j]:
+                        i += 1
+                    else:
+                        j += 1
+            j = k
+            if j == len(other):
+                break
+        return res
+
+    def _find(self, new):
+        b = bisect_left(self.last, new)
+        if b < len(self.last):
+            ids, _ = self.block(b)
+            i = bisect_left(ids, new)
+            if i < len(ids) and ids[i] == new:
+                return b, i
+        return None
+
+    def __getitem__(self, new):
+        found = self._find(new)
+        if found is None:
+            raise KeyError(new)
+        b, i = found
+        start, middle, end = self.bounds[b]
+        if middle == end:
+            return self.block(b)[1][i]
+        return self.block_positions(b)[i]
+
+    def __contains__(self, new):
+        return self._find(new) is not None
+
+    def __iter__(self):
+        return iter(self.ids())
+
+    def __len__(self):
+        return self.df
+
+
+class CompressedIndex(Mapping):
+    """
+    Indice de un campo con las posting lists comprimidas: termino --> CompressedPosting.
+
+    Solo guarda los bytes de cada posting list, el objeto CompressedPosting se crea al acceder.
+    """
+
+    def __init__(self, index):
+        self.raw = {term: encode_posting(posting) for term, posting in index.items()}
+
+    def __getitem__(self, term):
+        return CompressedPosting(self.raw[term])
+
+    def __contains__(self, term):
+        return term in self.raw
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def decompress(self):
+        """
+        Devuelve el indice como diccionario termino --> diccionario newid --> frecuencia o posiciones.
+        """
+        return {term: dict(self[term].items()) for term in self.raw}
+
+
+###############################
+###                         ###
+###     ARRAYS (COMPACT)    ###
+###                         ###
+###############################
+
+# Marca de noticia eliminada en una NewsTable (ver SAR_Project.update_dir)
+REMOVED = 0xFFFFFFFF
+
+
+def narrow(values):
+    """
+    Copia un array de enteros sin signo en el tipo mas pequeño ('B', 'H' o 'I') en el que caben sus valores.
+    """
+    top = max(values, default=0)
+    for typecode in ('B', 'H'):
+        if top < 1 << (8 * array(typecode).itemsize):
+            return array(typecode, values)
+    return values
+
+
+class ArrayIndex(Mapping):
+    """
+    Indice de un campo guardado en arrays de enteros sin signo: termino --> ArrayPosting.
+
+    Las posting lists de todos los terminos estan seguidas en "ids" (newids ordenados) y
+    "tfs" (frecuencias), "starts" indica donde empieza la de cada termino.
+    Si el indice es posicional, las posiciones de cada posting estan seguidas en "positions"
+    y "pos_starts" indica donde empiezan las de cada posting.
+    """
+
+    def __init__(self, index, positional):
+        self.terms = {}
+        self.starts = array('I', [0])
+        self.ids = array('I')
+        self.tfs = array('I')
+        self.positional = positional
+        self.pos_starts = array('I', [0])
+        self.positions = array('I')
+        for tid, (term, posting) in enumerate(index.items()):
+            self.terms[term] = tid
+            self.ids.extend(posting.keys())
+            if positional:
+                for p in posting.values():
+                    self.tfs.append(len(p))
+                    self.positions.extend(p)
+                    self.pos_starts.append(len(self.positions))
+            else:
+                self.tfs.extend(posting.values())
+            self.starts.append(len(self.ids))
+
+    def __getitem__(self, term):
+        return ArrayPosting(self, self.terms[term])
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def to_dict(self):
+        """
+        Devuelve el indice como diccionario termino --> diccionario newid --> frecuencia o posiciones.
+        """
+        return {term: dict(self[term].items()) for term in self.terms}
+
+    # arrays que se guardan con el tipo mas pequeño en el que caben sus valores
+    NARROW = ('starts', 'ids', 'tfs', 'pos_starts', 'positions')
+
+    def __getstate__(self):
+        # Con pickle cada entero de un diccionario ocupa 2 o 3 bytes, en un array de tipo 'I' 4:
+        # se guardan con 1 o 2 bytes si caben para que el indice compacto tambien ocupe menos en disco
+        state = self.__dict__.copy()
+        for name in self.NARROW:
+            state[name] = narrow(state[name])
+        return state
+
+    def __setstate__(self, state):
+        for name in self.NARROW:
+            if state[name].typecode != 'I':
+                state[name] = array('I', state[name])
+        self.__dict__.update(state)
+
+
+class ArrayPosting(Mapping):
+    """
+    Vista de la posting list de un termino de un ArrayIndex: newid --> frecuencia o posiciones.
+    """
+
+    __slots__ = ('index', 'lo', 'hi')
+
+    def __init__(self, index, tid):
+        self.index = index
+        self.lo = index.starts[tid]
+        self.hi = index.starts[tid + 1]
+
+    def ids(self):
+        """
+        Devuelve los newids de la posting list.
+        """
+        return self.index.ids[self.lo:self.hi].tolist()
+
+    def _value(self, k):
+        if not self.index.positional:
+            return self.index.tfs[k]
+        return self.index.positions[self.index.pos_starts[k]:self.index.pos_starts[k + 1]].tolist()
+
+    def values(self):
+        return [self._value(k) for k in range(self.lo, self.hi)]
+
+    def items(self):
+        return list(zip(self.ids(), self.values()))
+
+    def __getitem__(self, new):
+        k = bisect_left(self.index.ids, new, self.lo, self.hi)
+        if k == self.hi or self.index.ids[k] != new:
+            raise KeyError(new)
+        return self._value(k)
+
+    def __contains__(self, new):
+        k = bisect_left(self.index.ids, new, self.lo, self.hi)
+        return k < self.hi and self.index.ids[k] == new
+
+    def __iter__(self):
+        return iter(self.ids())
+
+    def __len__(self):
+        return self.hi - self.lo
+
+
+class NewsTable(Mapping):
+    """
+    Tabla de noticias en un array de enteros:
+    newid --> [docid, posicion de la noticia en el fichero, offset en bytes, longitud en bytes].
+
+    "data" guarda los WIDTH valores de cada newid seguidos, las noticias eliminadas tienen docid REMOVED.
+    """
+
+    WIDTH = 4
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data) // self.WIDTH
+        self.removed = data[::self.WIDTH].tolist().count(REMOVED)
+
+    @classmethod
+    def from_dict(cls, news, size):
+        """
+        Crea la tabla a partir del diccionario self.news.
+
+        param:  "news": diccionario newid --> [docid, posicion, offset, longitud]
+                "size": numero de newids asignados (self.new_cont)
+        """
+        data = array('I', [REMOVED]) * (cls.WIDTH * size)
+        for new, entry in news.items():
+            data[cls.WIDTH * new:cls.WIDTH * (new + 1)] = array('I', entry)
+        return cls(data)
+
+    def __getitem__(self, new):
+        if not 0 <= new < self.size or self.data[self.WIDTH * new] == REMOVED:
+            raise KeyError(new)
+        return self.data[self.WIDTH * new:self.WIDTH * (new + 1)].tolist()
+
+    def __iter__(self):
+        if self.removed == 0:
+            return iter(range(self.size))
+        docids = self.data[::self.WIDTH]
+        return (new for new in range(self.size) if docids[new] != REMOVED)
+
+    def __len__(self):
+        return self.size - self.removed
+
+
+###############################
+###                         ###
+###   BITMAPS (DENSOS)      ###
+###                         ###
+###############################
+
+# Traduce los digitos de bin() a bytes 0/1 para itertools.compress
+_BIN_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+class BitmapPosting:
+    """
+    Posting list de un termino denso como conjunto de bits: el bit i del entero "bits" esta
+    a 1 si el newid i contiene el termino. AND, OR y NOT entre bitmaps son operaciones de
+    enteros de Python, que se resuelven palabra a palabra sin recorrer los newids.
+    """
+    __slots__ = ('bits', '_bytes')
+
+    def __init__(self, bits):
+        self.bits = bits
+        self._bytes = None
+
+    @classmethod
+    def from_ids(cls, ids):
+        """
+        Crea el bitmap de una lista de newids.
+        """
+        if not ids:
+            return cls(0)
+        buf = bytearray((max(ids) >> 3) + 1)
+        for new in ids:
+            buf[new >> 3] |= 1 << (new & 7)
+        return cls(int.from_bytes(buf, 'little'))
+
+    def to_bytes(self):
+        if self._bytes is None:
+            self._bytes = self.bits.to_bytes((self.bits.bit_length() + 7) >> 3, 'little')
+        return self._bytes
+
+    def ids(self):
+        """
+        Devuelve la lista ordenada de newids del bitmap.
+        """
+        # bin() da los bits de mayor a menor, se invierte para que la posicion sea el newid
+        flags = bin(self.bits)[:1:-1].encode('ascii').translate(_BIN_FLAGS)
+        return list(compress(range(len(flags)), flags))
+
+    def select(self, ids, present=True):
+        """
+        Filtra una lista ordenada de newids segun esten (o no, si "present" es False) en el bitmap.
+        """
+        buf = self.to_bytes()
+        n = len(buf) << 3
+        if present:
+            return [new for new in ids if new < n and buf[new >> 3] >> (new & 7) & 1]
+        return [new for new in ids if new >= n or not buf[new >> 3] >> (new & 7) & 1]
+
+    def __contains__(self, new):
+        buf = self.to_bytes()
+        return new >> 3 < len(buf) and bool(buf[new >> 3] >> (new & 7) & 1)
+
+    def __iter__(self):
+        return iter(self.ids())
+
+    def __len__(self):
+        # int.bit_count() solo existe desde Python 3.10
+        return bin(self.bits).count('1')
+
+
+###############################
+###                         ###
+###   COMPLEMENTOS (NOT)    ###
+###                         ###
+###############################
+
+
+class NotPosting:
+    """
+    Complemento perezoso de una posting list: todas las noticias excepto las de "posting".
+    solve_query lo combina con los AND y OR sin construir la lista completa.
+    """
+    __slots__ = ('posting',)
+
+    def __init__(self, posting):
+        self.posting = posting
+
+    @classmethod
+    def negate(cls, posting):
+        """
+        Devuelve el complemento de "posting", deshaciendo el doble NOT.
+        """
+        if isinstance(posting, cls):
+            return posting.posting
+        return cls(posting)
+
+
+###############################
+###                         ###
+###   CURSORES (WAND)       ###
+###                         ###
+###############################
+
+
+def gallop(seq, new, lo, hi):
+    """
+    Busca con busqueda exponencial (galloping) desde "lo" el primer indice de seq[lo:hi] cuyo
+    newid es mayor o igual que "new", hi si no hay ninguno. Los saltos cortos cuestan poco.
+    """
+    if lo >= hi or seq[lo] >= new:
+        return lo
+    step = 1
+    while lo + step < hi and seq[lo + step] < new:
+        lo += step
+        step <<= 1
+    return bisect_left(seq, new, lo + 1, min(lo + step, hi))
+
+
+class PostingCursor:
+    """
+    Cursor sobre los newids ordenados seq[lo:hi] de una posting list (los arrays de un ArrayIndex,
+    los newids de una MappedPosting o una lista), sin copiarlos.
+    "new" es el newid actual, None cuando ya se ha recorrido entera.
+    """
+    __slots__ = ('seq', 'i', 'hi', 'new')
+
+    def __init__(self, seq, lo=0, hi=None):
+        self.seq = seq
+        self.i = lo
+        self.hi = len(seq) if hi is None else hi
+        self.new = seq[lo] if lo < self.hi else None
+
+    def advance(self):
+        """
+        Pasa al siguiente newid.
+        """
+        self.i += 1
+        self.new = self.seq[self.i] if self.i < self.hi else None
+
+    def seek(self, new):
+        """
+        Avanza hasta el primer newid mayor o igual que "new".
+        """
+        self.i = gallop(self.seq, new, self.i, self.hi)
+        self.new = self.seq[self.i] if self.i < self.hi else None
+
+
+class CompressedCursor(PostingCursor):
+    """
+    Cursor sobre una CompressedPosting: solo se decodifican los bloques en los que se para,
+    para saltar se busca el bloque con el ultimo newid de cada uno (la cabecera).
+    """
+    __slots__ = ('posting', 'b')
+
+    def __init__(self, posting):
+        self.posting = posting
+        self.enter(0)
+
+    def enter(self, b):
+        """
+        Se coloca al principio del bloque b.
+        """
+        self.b = b
+        self.seq = self.posting.block(b)[0] if b < len(self.posting.last) else ()
+        self.i = 0
+        self.hi = len(self.seq)
+        self.new = self.seq[0] if self.seq else None
+
+    def advance(self):
+        self.i += 1
+        if self.i < self.hi:
+            self.new = self.seq[self.i]
+        else:
+            self.enter(self.b + 1)
+
+    def seek(self, new):
+        if self.new is None or self.new >= new:
+            return
+        if new > self.posting.last[self.b]:
+            self.enter(bisect_left(self.posting.last, new, self.b + 1))
+        PostingCursor.seek(self, new)
+
+
+class IterCursor:
+    """
+    Cursor sobre una posting list que solo se puede recorrer en orden (el diccionario newid --> frecuencia
+    o posiciones del indice sin comprimir), con el mismo uso que PostingCursor.
+    """
+    __slots__ = ('it', 'new')
+
+    def __init__(self, posting):
+        self.it = iter(posting)
+        self.new = next(self.it, None)
+
+    def advance(self):
+        self.new = next(self.it, None)
+
+    def seek(self, new):
+        while self.new is not None and self.new < new:
+            self.new = next(self.it, None)
@@ -0,0 +1,258 @@
+"""
+Parser de las consultas: convierte la cadena de una consulta en un arbol (AST) que
+SAR_Project optimiza (ver SAR_Project.optimize_query) y evalua (ver SAR_Project.evaluate).
+
+Gramatica:
+
+    consulta := operando (("AND" | "OR") operando)*
+    operando := "NOT" operando | "(" consulta ")" | frase
+    frase    := palabra+
+
+AND y OR tienen la misma prioridad y se asocian de izquierda a derecha, como en la
+implementacion original ("a OR b AND c" es "(a OR b) AND c"), NOT es la de mas prioridad.
+Las palabras seguidas sin conector forman una consulta posicional, pueden ir entre
+comillas, llevar delante el campo ("title:valencia", 'title:"el pais"') y estar separadas
+por el operador de proximidad NEAR/k. Si lo que va antes de ":" no es un campo, los dos
+lados se buscan en el articulo como palabras seguidas ("ej:valencia" es "ej valencia").
+Una unica palabra entre comillas se busca tal cual, sin aplicar stemming.
+"""
+
+import re
+
+
+# Parentesis, palabras entre comillas (con campo opcional delante) o palabras sueltas
+TOKEN = re.compile(r'[()]|[^\s()"]*"[^"]*"?|[^\s()"]+')
+
+# Conectores
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# Campos que pueden ir delante de una palabra ("title:valencia")
+FIELDS = ('title', 'date', 'keywords', 'article', 'summary')
+
+# Operador de proximidad entre dos palabras: "a NEAR/k b"
+NEAR = re.compile(r'NEAR/(\d+)')
+
+
+###############################
+###                         ###
+###          NODOS          ###
+###                         ###
+###############################
+
+class Node:
+    """
+    Nodo del arbol. "key" identifica la subconsulta (dos nodos con la misma clave tienen el
+    mismo resultado), "size" guarda el numero estimado de resultados (ver SAR_Project.estimate)
+    y "tokens", en los terminos con comodin, los terminos del indice que encajan.
+    """
+    key = None
+    size = None
+    tokens = None
+
+
+class Term(Node):
+    """
+    Un termino de un campo, con comodines o no. Si "exact" es True no se aplica stemming.
+    """
+
+    def __init__(self, field, term, exact=False):
+        self.field = field
+        self.term = term
+        self.exact = exact
+        self.key = '%s:%s%s' % (field, term, '"' if exact else '')
+
+    def label(self):
+        return 'TERM %s:%s%s' % (self.field, self.term, ' (exact)' if self.exact else '')
+
+
+class Phrase(Node):
+    """
+    Consulta posicional: terminos seguidos de un campo, con operadores NEAR/k entre ellos.
+    """
+
+    def __init__(self, field, terms):
+        self.field = field
+        self.terms = terms
+        self.key = '%s:"%s"' % (field, ' '.join(terms))
+
+    def label(self):
+        return 'PHRASE %s:"%s"' % (self.field, ' '.join(self.terms))
+
+
+class Not(Node):
+    """
+    Complemento de una subconsulta.
+    """
+
+    def __init__(self, child):
+        self.child = child
+        self.key = 'NOT ' + child.key
+
+    def label(self):
+        return 'NOT'
+
+
+class And(Node):
+    """
+    Interseccion de varias subconsultas.
+    """
+
+    def __init__(self, children):
+        self.children = children
+        # AND y OR son conmutativos, la clave no depende del orden de los hijos
+        self.key = '(' + ' AND '.join(sorted(child.key for child in children)) + ')'
+
+    def label(self):
+        return 'AND'
+
+
+class Or(Node):
+    """
+    Union de varias subconsultas.
+    """
+
+    def __init__(self, children):
+        self.children = children
+        self.key = '(' + ' OR '.join(sorted(child.key for child in children)) + ')'
+
+    def label(self):
+        return 'OR'
+
+
+class AndNot(Node):
+    """
+    Diferencia: los resultados de "child" que no estan en ninguno de "excluded".
+    """
+
+    def __init__(self, child, excluded):
+        self.child = child
+        self.excluded = excluded
+        self.key = '(' + ' AND NOT '.join([child.key] + sorted(e.key for e in excluded)) + ')'
+
+    def label(self):
+        return 'AND NOT'
+
+
+def children(node):
+    """
+    Devuelve los hijos de un nodo en el orden en que se evaluan.
+    """
+    if isinstance(node, (And, Or)):
+        return node.children
+    if isinstance(node, AndNot):
+        return [node.child] + node.excluded
+    if isinstance(node, Not):
+        return [node.child]
+    return []
+
+
+###############################
+###                         ###
+###         PARSER          ###
+###                         ###
+###############################
+
+def parse(query):
+    """
+    Construye el arbol de una consulta.
+
+    Los errores de sintaxis se toleran: un parentesis sin cerrar se cierra al final, los
+    parentesis de cierre que sobran y los conectores sin operando se ignoran, y dos
+    operandos seguidos sin conector se unen con AND.
+
+    param:  "query": cadena con la consulta
+
+    return: nodo raiz, None si la consulta esta vacia
+    """
+    # Se quitan los parentesis de cierre que no cierran ninguno
+    tokens = []
+    depth = 0
+    for token in TOKEN.findall(query):
+        if token == ')':
+            if depth == 0:
+                continue
+            depth -= 1
+        elif token == '(':
+            depth += 1
+        tokens.append(token)
+
+    pos = 0
+
+    def parse_query():
+        nonlocal pos
+        node = parse_operand()
+        while pos < len(tokens) and tokens[pos] in ('AND', 'OR'):
+            op = tokens[pos]
+            pos += 1
+            right = parse_operand()
+            if right is None:
+                continue
+            if node is None:
+                node = right
+            else:
+                node = And([node, right]) if op == 'AND' else Or([node, right])
+        return node
+
+    def parse_operand():
+        nonlocal pos
+        if pos == len(tokens) or tokens[pos] in ('AND', 'OR', ')'):
+            return None
+        token = tokens[pos]
+        pos += 1
+        if token == 'NOT':
+            child = parse_operand()
+            return None if child is None else Not(child)
+        if token == '(':
+            node = parse_query()
+            if pos < len(tokens) and tokens[pos] == ')':
+                pos += 1
+            return node
+        words = [token]
+        while pos < len(tokens) and tokens[pos] not in OPERATORS and tokens[pos] not in ('(', ')'):
+            words.append(tokens[pos])
+            pos += 1
+        return phrase(words)
+
+    node = None
+    while pos < len(tokens):
+        start = pos
+        right = parse_query()
+        if right is not None:
+            node = right if node is None else And([node, right])
+        if pos == start:
+            pos += 1
+    return node
+
+
+def phrase(words):
+    """
+    Convierte un grupo de palabras seguidas en un termino o en una consulta posicional.
+
+    param:  "words": palabras tal y como aparecen en la consulta
+
+    return: nodo Term o Phrase, None si no hay ninguna palabra
+    """
+    field = 'article'
+    terms = []
+    quoted = False
+    for i, word in enumerate(words):
+        # El campo solo se tiene en cuenta en la primera palabra
+        prefix, sep, rest = word.partition(':')
+        if sep and prefix not in FIELDS:
+            # No es un campo, los ":" separan dos palabras como al tokenizar la noticia
+            word = prefix + ' ' + rest
+        elif sep:
+            if i == 0:
+                field = prefix
+            word = rest
+        if '"' in word:
+            quoted = True
+            word = word.replace('"', ' ')
+        for term in word.split():
+            terms.append(term if NEAR.fullmatch(term) else term.lower())
+
+    if not terms:
+        return None
+    if len(terms) == 1:
+        return Term(field, terms[0], exact=quoted)
+    return Phrase(field, terms)
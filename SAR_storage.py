@@ -0,0 +1,677 @@
+"""
+Formato binario del indice (alternativa a guardar el objeto SAR_Project con pickle).
+
+El indice se guarda en un directorio con:
+    - meta.json: version del formato, opciones de indexacion y tabla de ficheros (self.docs)
+    - news.bin: por cada newid, (docid, posicion de la noticia en el fichero, offset y longitud en bytes)
+    - <tabla>.dict: diccionario de terminos ordenado
+    - <tabla>.post: bloque de postings (newids seguidos de sus frecuencias, o los bytes
+      de SAR_postings.encode_posting si el indice esta comprimido)
+    - <tabla>.pos: bloque de posiciones (solo en el indice posicional)
+    - lengths.<campo>: longitud del campo en cada newid (para BM25)
+    - bounds.<campo>: cotas de cada termino para el ranking top-k, en el orden de index.<campo>.dict
+    - kterms.<campo>: terminos del indice de k-gramas separados por '\n', en el orden de sus ids
+    - offsets.<campo>: inicio de cada token en el texto (solo en el indice posicional),
+      new_cont + 1 limites de cada newid seguidos de los inicios de todas las noticias
+    - forward.<campo>: indice directo (ids de termino de cada noticia), como offsets.<campo>
+    - sketches.<campo>: MinHash de cada noticia (solo con --minhash), como offsets.<campo>
+
+donde <tabla> es "index.<campo>", "sindex.<campo>", "spindex.<campo>", "ptindex.<campo>", "kindex.<campo>"
+o "term_ids.<campo>" (id de cada termino del indice directo).
+
+Todos los ficheros se abren con mmap, asi cargar el indice no lee los postings,
+solo se leen las paginas de los terminos que usa una consulta y varios procesos
+comparten las mismas paginas fisicas.
+
+Con pickle (SAR_Project.save sin "binary") y la opcion --lazy del indexador, cada campo de cada
+estructura se guarda como un pickle aparte dentro del fichero (ver LazyFields) y tambien se
+carga solo al usarlo.
+"""
+
+import json
+import mmap
+import os
+import pickle
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, MutableMapping
+from itertools import accumulate
+
+from SAR_postings import CompressedIndex, CompressedPosting, NewsTable
+
+
+VERSION = 8
+
+# Cabecera de los ficheros binarios: magic, version, numero de entradas
+MAGIC = b'SARI'
+HEADER = 16
+
+# Tipos de valor de una tabla
+POSTINGS = 0
+TERMS = 1
+VBYTE = 2
+IDS = 3
+TERM_ID = 4
+
+
+def _header(n):
+    return MAGIC + array('I', [VERSION, n, 0]).tobytes()
+
+
+def _check_header(buf, filename):
+    if bytes(buf[:4]) != MAGIC:
+        raise ValueError('%s is not a SAR index file' % filename)
+    version, n, _ = array('I', bytes(buf[4:HEADER]))
+    if version != VERSION:
+        raise ValueError('%s: unsupported index version %d (expected %d)' % (filename, version, VERSION))
+    return n
+
+
+def _map(filename):
+    """
+    Abre un fichero con mmap de solo lectura (un fichero vacio devuelve b'').
+    """
+    with open(filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+###############################
+###                         ###
+###        ESCRITURA        ###
+###                         ###
+###############################
+
+def save_index(project, path):
+    """
+    Guarda un SAR_Project en el formato binario.
+
+    param:  "project": indice a guardar
+            "path": directorio destino (se crea si no existe)
+
+    """
+    os.makedirs(path, exist_ok=True)
+
+    meta = {'version': VERSION,
+            'byteorder': sys.byteorder,
+            'multifield': project.multifield,
+            'positional': project.positional,
+            'stemming': project.stemming,
+            'permuterm': project.permuterm,
+            'kgram': project.kgram,
+            'minhash': project.minhash,
+            'rank_data': project.rank_data,
+            'compressed': project.compressed,
+            'doc_cont': project.doc_cont,
+            'new_cont': project.new_cont,
+            'docs': dict(enumerate(project.docs)) if isinstance(project.docs, list) else project.docs,
+            'docs_stat': project.docs_stat,
+            'total_length': project.total_length}
+    with open(os.path.join(path, 'meta.json'), 'w') as fh:
+        json.dump(meta, fh)
+
+    news = project.news
+    if not isinstance(news, NewsTable):
+        news = NewsTable.from_dict(news, project.new_cont)
+    with open(os.path.join(path, 'news.bin'), 'wb') as fh:
+        fh.write(_header(project.new_cont))
+        news.data.tofile(fh)
+
+    for field in project.index:
+        lengths = project.lengths[field]
+        if isinstance(lengths, dict) and lengths:
+            lengths = array('I', bytes(4 * project.new_cont))
+            for new, length in project.lengths[field].items():
+                lengths[new] = length
+        with open(os.path.join(path, 'lengths.' + field), 'wb') as fh:
+            fh.write(_header(len(lengths)))
+            array('I', lengths).tofile(fh)
+
+        bounds = array('I')
+        # Sin cotas (indexado sin --rank-data) solo se escribe la cabecera
+        if project.term_bounds[field]:
+            for term in sorted(project.index[field]):
+                bounds.extend(project.term_bounds[field].get(term, (0, 0)))
+        with open(os.path.join(path, 'bounds.' + field), 'wb') as fh:
+            fh.write(_header(len(bounds) // 2))
+            bounds.tofile(fh)
+
+        for name in ('offsets', 'forward', 'sketches'):
+            _write_arrays(os.path.join(path, name + '.' + field), getattr(project, name)[field], project.new_cont)
+        _write_table(os.path.join(path, 'term_ids.' + field), project.term_ids[field], TERM_ID)
+
+        if isinstance(project.index[field], CompressedIndex):
+            _write_table(os.path.join(path, 'index.' + field), project.index[field].raw, VBYTE)
+        else:
+            _write_table(os.path.join(path, 'index.' + field), project.index[field], POSTINGS)
+        _write_table(os.path.join(path, 'sindex.' + field), project.sindex[field], TERMS)
+        if isinstance(project.spindex[field], CompressedIndex):
+            _write_table(os.path.join(path, 'spindex.' + field), project.spindex[field].raw, VBYTE)
+        else:
+            _write_table(os.path.join(path, 'spindex.' + field), project.spindex[field], POSTINGS)
+        _write_table(os.path.join(path, 'ptindex.' + field), project.ptindex[field], TERMS)
+        _write_table(os.path.join(path, 'kindex.' + field), project.kindex[field], IDS)
+        with open(os.path.join(path, 'kterms.' + field), 'wb') as fh:
+            fh.write('\n'.join(project.kterms[field]).encode('utf-8'))
+
+
+def _write_arrays(filename, arrays, new_cont):
+    """
+    Escribe un diccionario newid --> array de enteros: new_cont + 1 limites seguidos de todos los arrays.
+    Si el diccionario esta vacio solo se escribe la cabecera.
+    """
+    with open(filename, 'wb') as fh:
+        if not arrays:
+            fh.write(_header(0))
+            return
+        fh.write(_header(new_cont))
+        values = [arrays.get(new, ()) for new in range(new_cont)]
+        array('I', accumulate((len(value) for value in values), initial=0)).tofile(fh)
+        for value in values:
+            array('I', value).tofile(fh)
+
+
+def _write_table(base, table, kind):
+    """
+    Escribe una tabla termino --> valor ordenada por termino.
+
+    Por cada termino el diccionario guarda (offset en .post, longitud, offset en .pos),
+    los offsets de .post y .pos son en enteros de 4 bytes (bytes para las tablas TERMS, VBYTE e IDS).
+    Los terminos se guardan separados por '\n' para poder recorrerlos de una vez.
+
+    param:  "base": ruta sin extension
+            "table": diccionario a guardar
+            "kind": POSTINGS (valor: diccionario newid --> frecuencia o posiciones), TERMS (valor: lista de terminos),
+                    VBYTE (valor: posting list comprimida), IDS (valor: array de ids de termino)
+                    o TERM_ID (valor: un id, se guarda en la entrada del diccionario)
+
+    """
+    terms = sorted(table)
+    keys = [term.encode('utf-8') + b'\n' for term in terms]
+    key_offsets = array('I', accumulate((len(k) for k in keys), initial=0))
+    entries = array('I')
+
+    with open(base + '.post', 'wb') as post, open(base + '.pos', 'wb') as pos:
+        post_off = 0
+        pos_off = 0
+        for term in terms:
+            value = table[term]
+            if kind == TERM_ID:
+                entries.extend((value, 0, 0))
+            elif kind != POSTINGS:
+                if kind == VBYTE:
+                    data = value
+                elif kind == IDS:
+                    data = array('I', value).tobytes()
+                else:
+                    data = '\n'.join(value).encode('utf-8')
+                entries.extend((post_off, len(data), 0))
+                post.write(data)
+                post_off += len(data)
+            else:
+                ids = array('I', value.keys())
+                values = list(value.values())
+                entries.extend((post_off, len(ids), pos_off))
+                if values and isinstance(values[0], list):
+                    tfs = array('I', map(len, values))
+                    positions = array('I')
+                    for p in values:
+                        positions.extend(p)
+                    positions.tofile(pos)
+                    pos_off += len(positions)
+                else:
+                    tfs = array('I', values)
+                ids.tofile(post)
+                tfs.tofile(post)
+                post_off += 2 * len(ids)
+
+    with open(base + '.dict', 'wb') as fh:
+        fh.write(_header(len(terms)))
+        key_offsets.tofile(fh)
+        entries.tofile(fh)
+        fh.write(b''.join(keys))
+
+
+###############################
+###                         ###
+###         LECTURA         ###
+###                         ###
+###############################
+
+def load_index(project, path):
+    """
+    Abre un indice en formato binario sobre un SAR_Project vacio.
+
+    self.news, self.index, self.sindex y self.ptindex pasan a ser vistas de solo lectura
+    sobre los ficheros mapeados en memoria, el resto de atributos se leen de meta.json.
+
+    param:  "project": SAR_Project recien creado
+            "path": directorio del indice
+
+    return: "project"
+
+    """
+    with open(os.path.join(path, 'meta.json')) as fh:
+        meta = json.load(fh)
+    if meta['version'] != VERSION:
+        raise ValueError('%s: unsupported index version %d (expected %d)' % (path, meta['version'], VERSION))
+    if meta['byteorder'] != sys.byteorder:
+        raise ValueError('%s: index saved with %s byte order' % (path, meta['byteorder']))
+
+    for option in ('multifield', 'positional', 'stemming', 'permuterm', 'kgram', 'minhash', 'rank_data', 'compressed', 'doc_cont', 'new_cont'):
+        setattr(project, option, meta[option])
+    # JSON solo tiene claves de tipo cadena
+    project.docs = {int(docid): filename for docid, filename in meta['docs'].items()}
+    project.docs_stat = {int(docid): tuple(stat) for docid, stat in meta['docs_stat'].items()}
+    project.total_length = meta['total_length']
+
+    project.news = MappedNews(os.path.join(path, 'news.bin'))
+    for field in project.index:
+        project.lengths[field] = _map_lengths(os.path.join(path, 'lengths.' + field))
+        project.index[field] = MappedTable(os.path.join(path, 'index.' + field),
+                                           VBYTE if project.compressed else POSTINGS)
+        project.term_bounds[field] = _map_bounds(os.path.join(path, 'bounds.' + field), project.index[field])
+        for name in ('offsets', 'forward', 'sketches'):
+            getattr(project, name)[field] = _map_arrays(os.path.join(path, name + '.' + field))
+        project.term_ids[field] = MappedTable(os.path.join(path, 'term_ids.' + field), TERM_ID)
+        project.sindex[field] = MappedTable(os.path.join(path, 'sindex.' + field), TERMS)
+        project.spindex[field] = MappedTable(os.path.join(path, 'spindex.' + field),
+                                             VBYTE if project.compressed else POSTINGS)
+        project.ptindex[field] = MappedTable(os.path.join(path, 'ptindex.' + field), TERMS)
+        project.kindex[field] = MappedTable(os.path.join(path, 'kindex.' + field), IDS)
+        with open(os.path.join(path, 'kterms.' + field), 'rb') as fh:
+            data = fh.read()
+        project.kterms[field] = data.decode('utf-8').split('\n') if data else []
+    return project
+
+
+def _map_lengths(filename):
+    """
+    Abre un fichero lengths.<campo>, devuelve un diccionario vacio si el campo no se ha indexado.
+    """
+    buf = _map(filename)
+    if _check_header(buf, filename) == 0:
+        return {}
+    return memoryview(buf)[HEADER:].cast('I')
+
+
+def _map_bounds(filename, table):
+    """
+    Abre un fichero bounds.<campo>, devuelve un diccionario vacio si no hay cotas.
+    """
+    with open(filename, 'rb') as fh:
+        if _check_header(fh.read(HEADER), filename) == 0:
+            return {}
+    return MappedBounds(filename, table)
+
+
+def _map_arrays(filename):
+    """
+    Abre un fichero escrito con "_write_arrays", devuelve un diccionario vacio si no tiene arrays.
+    """
+    buf = _map(filename)
+    if _check_header(buf, filename) == 0:
+        return {}
+    return MappedArrays(buf)
+
+
+def materialize(project):
+    """
+    Convierte las vistas mapeadas de un indice cargado con "load_index" en diccionarios,
+    necesario para poder modificarlo (por ejemplo con SAR_Project.update_dir).
+
+    param:  "project": SAR_Project cargado con "load_index"
+
+    """
+    if isinstance(project.news, MappedNews):
+        project.news = {new: project.news[new] for new in project.news}
+    for field in project.index:
+        if isinstance(project.lengths[field], memoryview):
+            project.lengths[field] = {new: project.lengths[field][new] for new in project.news}
+        if isinstance(project.index[field], MappedTable):
+            project.index[field] = {term: dict(posting.items()) for term, posting in project.index[field].items()}
+        if isinstance(project.term_bounds[field], MappedBounds):
+            project.term_bounds[field] = dict(project.term_bounds[field].items())
+        if isinstance(project.sindex[field], MappedTable):
+            project.sindex[field] = dict(project.sindex[field].items())
+        if isinstance(project.spindex[field], MappedTable):
+            project.spindex[field] = {stem: dict(posting.items()) for stem, posting in project.spindex[field].items()}
+        if isinstance(project.ptindex[field], MappedTable):
+            project.ptindex[field] = dict(project.ptindex[field].items())
+        if isinstance(project.kindex[field], MappedTable):
+            project.kindex[field] = dict(project.kindex[field].items())
+        for name in ('offsets', 'forward', 'sketches'):
+            arrays = getattr(project, name)[field]
+            if isinstance(arrays, MappedArrays):
+                getattr(project, name)[field] = {new: array('I', value) for new, value in arrays.items()}
+        if isinstance(project.term_ids[field], MappedTable):
+            project.term_ids[field] = dict(project.term_ids[field].items())
+
+
+class MappedNews(NewsTable):
+    """
+    NewsTable sobre news.bin: newid --> [docid, posicion de la noticia en el fichero, offset, longitud].
+    """
+
+    def __init__(self, filename):
+        self.buf = _map(filename)
+        _check_header(self.buf, filename)
+        super().__init__(memoryview(self.buf)[HEADER:].cast('I'))
+
+
+class MappedTable(Mapping):
+    """
+    Vista de una tabla guardada con "_write_table": termino --> valor.
+
+    Los terminos se buscan con busqueda binaria sobre el diccionario ordenado,
+    los valores solo se leen al pedirlos.
+    """
+
+    def __init__(self, base, kind):
+        self.kind = kind
+        self.dict = _map(base + '.dict')
+        self.post = _map(base + '.post')
+        self.pos = _map(base + '.pos')
+        self.size = _check_header(self.dict, base + '.dict')
+
+        view = memoryview(self.dict)
+        start = HEADER
+        self.key_offsets = view[start:start + 4 * (self.size + 1)].cast('I')
+        start += 4 * (self.size + 1)
+        self.entries = view[start:start + 12 * self.size].cast('I')
+        self.keys_start = start + 12 * self.size
+        if kind == POSTINGS:
+            self.post_view = memoryview(self.post).cast('I') if len(self.post) else []
+            self.pos_view = memoryview(self.pos).cast('I') if len(self.pos) else []
+
+    def key(self, i):
+        """
+        Devuelve el termino i-esimo (en orden) como bytes.
+        """
+        return self.dict[self.keys_start + self.key_offsets[i]:self.keys_start + self.key_offsets[i + 1] - 1]
+
+    def find(self, term):
+        """
+        Busqueda binaria de un termino.
+
+        return: la posicion del primer termino >= "term" en el diccionario
+        """
+        target = term.encode('utf-8')
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_range(self, prefix):
+        """
+        Busca los terminos que empiezan por "prefix".
+
+        return: tupla (primera posicion, ultima posicion + 1) de esos terminos en el diccionario
+        """
+        target = prefix.encode('utf-8')
+        lo = self.find(prefix)
+        start, hi = lo, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid)[:len(target)] == target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def value(self, i):
+        """
+        Decodifica el valor del termino i-esimo.
+        """
+        post_off, length, pos_off = self.entries[3 * i:3 * i + 3]
+        if self.kind == TERMS:
+            return self.post[post_off:post_off + length].decode('utf-8').split('\n')
+        if self.kind == VBYTE:
+            return CompressedPosting(self.post[post_off:post_off + length])
+        if self.kind == IDS:
+            return array('I', self.post[post_off:post_off + length])
+        if self.kind == TERM_ID:
+            return post_off
+        return MappedPosting(self, post_off, length, pos_off)
+
+    def __getitem__(self, term):
+        i = self.find(term)
+        if i < self.size and self.key(i) == term.encode('utf-8'):
+            return self.value(i)
+        raise KeyError(term)
+
+    def __contains__(self, term):
+        i = self.find(term)
+        return i < self.size and self.key(i) == term.encode('utf-8')
+
+    def __iter__(self):
+        if self.size == 0:
+            return iter([])
+        return iter(self.dict[self.keys_start:-1].decode('utf-8').split('\n'))
+
+    def __len__(self):
+        return self.size
+
+
+class MappedPosting(Mapping):
+    """
+    Posting list de una MappedTable: newid --> frecuencia (o lista de posiciones si el indice es posicional).
+
+    Los newids se leen al crearla, las frecuencias y posiciones solo al pedirlas.
+    """
+
+    def __init__(self, table, post_off, length, pos_off):
+        self.table = table
+        self.ids = table.post_view[post_off:post_off + length].tolist()
+        self.tf_off = post_off + length
+        self.pos_off = pos_off
+        self.positional = len(table.pos_view) > 0
+        self.starts = None
+
+    def __getitem__(self, new):
+        i = bisect_left(self.ids, new)
+        if i == len(self.ids) or self.ids[i] != new:
+            raise KeyError(new)
+        tf = self.table.post_view[self.tf_off + i]
+        if not self.positional:
+            return tf
+        if self.starts is None:
+            # Offset de las posiciones de cada noticia dentro del bloque del termino
+            tfs = self.table.post_view[self.tf_off:self.tf_off + len(self.ids)]
+            self.starts = list(accumulate(tfs, initial=self.pos_off))
+        start = self.starts[i]
+        return self.table.pos_view[start:start + tf].tolist()
+
+    def __contains__(self, new):
+        i = bisect_left(self.ids, new)
+        return i < len(self.ids) and self.ids[i] == new
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class MappedBounds(Mapping):
+    """
+    Vista de bounds.<campo>: termino --> (frecuencia maxima, longitud minima).
+    Las cotas estan en el mismo orden que los terminos de la tabla del indice del campo.
+    """
+
+    def __init__(self, filename, table):
+        self.table = table
+        buf = _map(filename)
+        _check_header(buf, filename)
+        self.data = memoryview(buf)[HEADER:].cast('I') if len(buf) > HEADER else []
+
+    def __getitem__(self, term):
+        i = self.table.find(term)
+        if i == len(self.table) or self.table.key(i) != term.encode('utf-8'):
+            raise KeyError(term)
+        return self.data[2 * i], self.data[2 * i + 1]
+
+    def __contains__(self, term):
+        return term in self.table
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+
+class MappedArrays(Mapping):
+    """
+    Vista de un fichero escrito con "_write_arrays" (offsets.<campo>, forward.<campo> o sketches.<campo>):
+    newid --> array de enteros. Las noticias con el array vacio (o borradas) no estan.
+    """
+
+    def __init__(self, buf):
+        n = _check_header(buf, 'arrays')
+        data = memoryview(buf)[HEADER:].cast('I')
+        self.bounds = data[:n + 1]
+        self.values = data[n + 1:]
+
+    def __getitem__(self, new):
+        if new not in self:
+            raise KeyError(new)
+        return self.values[self.bounds[new]:self.bounds[new + 1]]
+
+    def __contains__(self, new):
+        return isinstance(new, int) and 0 <= new < len(self.bounds) - 1 and self.bounds[new] < self.bounds[new + 1]
+
+    def __iter__(self):
+        return (new for new in range(len(self.bounds) - 1) if self.bounds[new] < self.bounds[new + 1])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __bool__(self):
+        # Sin recorrer las noticias: hay alguna si hay algun valor
+        return self.bounds[-1] > 0
+
+
+###############################
+###                         ###
+###  COMPONENTES (PICKLE)   ###
+###                         ###
+###############################
+
+class LazyFields(MutableMapping):
+    """
+    Estructura por campos (campo --> componente) de un indice guardado con pickle.
+
+    Cada campo se guarda como un pickle independiente y solo se deserializa la primera vez
+    que se usa, asi una consulta sobre 'article' no lee 'title' ni el resto de estructuras.
+    En el indice posicional las posiciones son otro componente: el campo se carga con las
+    frecuencias (termino --> {newid: frecuencia}) y las posiciones solo se leen al pedirlas
+    con "positions".
+
+    Los componentes cargados son de solo lectura, para modificar el indice hay que convertirlo
+    antes en diccionarios (ver SAR_Project.load_components).
+    """
+
+    def __init__(self, fields, positional=False):
+        self.positional = positional
+        self.order = list(fields)
+        self.blobs = {}
+        self.pos_blobs = {}
+        self.loaded = dict(fields)
+        self.loaded_pos = {}
+        # campos asignados despues de cargar, se vuelven a serializar al guardar
+        self.dirty = set(fields)
+
+    def pack(self, field):
+        """
+        Serializa un campo cargado, separando las posiciones si es un indice posicional.
+        """
+        value = self.loaded[field]
+        self.pos_blobs.pop(field, None)
+        # Solo se separan las posiciones de las posting lists en diccionarios (no comprimidas ni en arrays)
+        first = next(iter(value.values()), None) if isinstance(value, dict) else None
+        if self.positional and isinstance(first, dict) and isinstance(next(iter(first.values()), None), list):
+            tfs = {term: {new: len(p) for new, p in posting.items()} for term, posting in value.items()}
+            positions = {term: list(posting.values()) for term, posting in value.items()}
+            self.blobs[field] = pickle.dumps(tfs, pickle.HIGHEST_PROTOCOL)
+            self.pos_blobs[field] = pickle.dumps(positions, pickle.HIGHEST_PROTOCOL)
+        else:
+            self.blobs[field] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def positions(self, field, term):
+        """
+        Devuelve la posting list posicional de un termino: newid --> lista de posiciones.
+
+        param:  "field": campo
+                "term": termino del campo
+
+        return: diccionario newid --> posiciones
+        """
+        posting = self[field][term]
+        if field not in self.pos_blobs:
+            return posting
+        if field not in self.loaded_pos:
+            self.loaded_pos[field] = pickle.loads(self.pos_blobs[field])
+        return dict(zip(posting, self.loaded_pos[field][term]))
+
+    def to_dict(self):
+        """
+        Carga todos los campos, con sus posiciones.
+
+        return: diccionario campo --> componente
+        """
+        res = {}
+        for field in self.order:
+            if field in self.pos_blobs:
+                positions = self.loaded_pos.get(field) or pickle.loads(self.pos_blobs[field])
+                res[field] = {term: dict(zip(posting, positions[term])) for term, posting in self[field].items()}
+            else:
+                res[field] = self[field]
+        return res
+
+    def __getitem__(self, field):
+        if field not in self.loaded:
+            self.loaded[field] = pickle.loads(self.blobs[field])
+        return self.loaded[field]
+
+    def __setitem__(self, field, value):
+        if field not in self.order:
+            self.order.append(field)
+        self.loaded[field] = value
+        self.loaded_pos.pop(field, None)
+        self.dirty.add(field)
+
+    def __delitem__(self, field):
+        self.order.remove(field)
+        for table in (self.blobs, self.pos_blobs, self.loaded, self.loaded_pos):
+            table.pop(field, None)
+        self.dirty.discard(field)
+
+    def __contains__(self, field):
+        return field in self.order
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getstate__(self):
+        # Solo se guardan los pickles de cada campo, los ya cargados sin cambios no se vuelven a serializar
+        for field in self.dirty:
+            self.pack(field)
+        self.dirty = set()
+        return {'positional': self.positional, 'order': self.order,
+                'blobs': self.blobs, 'pos_blobs': self.pos_blobs}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.loaded = {}
+        self.loaded_pos = {}
+        self.dirty = set()
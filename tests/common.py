@@ -0,0 +1,80 @@
+"""
+Utilidades comunes de las pruebas: rutas del proyecto y los indices de prueba, que se
+construyen una sola vez por proceso.
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from SAR_lib import SAR_Project
+
+# Todo 2015 (para comparar con los resultados de referencia) y un solo mes (pruebas rapidas)
+NEWS_2015 = os.path.join(ROOT, 'corpora', '2015')
+MONTH = os.path.join(NEWS_2015, '03')
+
+# Opciones de SAR_Indexer.py por defecto, con los nombres de sus argumentos
+OPTIONS = {'multifield': False, 'positional': False, 'stem': False, 'permuterm': False}
+
+# Opciones con las que se pueden resolver todas las consultas de referencia
+FULL = {'multifield': True, 'positional': True, 'stem': True, 'permuterm': True}
+
+_built = {}
+
+
+def build(newsdir=MONTH, **options):
+    """
+    Indexa "newsdir" con las opciones de SAR_Indexer.py indicadas. El indice se guarda y las
+    siguientes llamadas con los mismos argumentos lo reutilizan, no se debe modificar.
+    """
+    args = dict(OPTIONS, **options)
+    key = (newsdir, tuple(sorted(args.items())))
+    if key not in _built:
+        project = SAR_Project()
+        project.index_dir(newsdir, **args)
+        _built[key] = project
+    return _built[key]
+
+
+def references(year, name='full'):
+    """
+    Lee un fichero de resultados de referencia (results/<year>/result_<year>_<name>.txt).
+
+    return: lista de tuplas (consulta, numero de resultados)
+    """
+    filename = os.path.join(ROOT, 'results', str(year), 'result_%s_%s.txt' % (year, name))
+    res = []
+    with open(filename) as fh:
+        for line in fh.read().split('\n'):
+            if line and not line.startswith('#'):
+                query, count = line.split('\t')
+                res.append((query, int(count)))
+    return res
+
+
+def mismatches(project, year=2015):
+    """
+    Resuelve las consultas de referencia de un año, sin y con stemming.
+
+    return: lista de tuplas (consulta, resultados obtenidos, resultados esperados) que no coinciden
+    """
+    res = []
+    for name, stemming in (('minimo', False), ('full', False), ('minimo_stemming', True), ('full_stemming', True)):
+        project.set_stemming(stemming)
+        for query, count in references(year, name):
+            got = len(project.solve_query(query))
+            if got != count:
+                res.append((query, got, count))
+    project.set_stemming(False)
+    return res
+
+
+def run_script(name, *args):
+    """
+    Ejecuta uno de los scripts del proyecto con el interprete actual.
+    """
+    return subprocess.run([sys.executable, os.path.join(ROOT, name)] + list(args),
+                          cwd=ROOT, capture_output=True, text=True)
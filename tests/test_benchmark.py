@@ -0,0 +1,66 @@
+"""
+Pruebas del banco de pruebas (SAR_Benchmark.py).
+"""
+
+import json
+import os
+import unittest
+
+from common import MONTH, ROOT, run_script
+
+import SAR_Benchmark
+
+
+class QueryClasses(unittest.TestCase):
+
+    def test_classes(self):
+        self.assertEqual(SAR_Benchmark.query_classes('valencia AND casa'), {'term'})
+        self.assertEqual(SAR_Benchmark.query_classes('val*'), {'wildcard'})
+        self.assertEqual(SAR_Benchmark.query_classes('"de la"'), {'phrase'})
+        self.assertEqual(SAR_Benchmark.query_classes('title:gobierno OR madrid'), {'multifield'})
+        self.assertEqual(SAR_Benchmark.query_classes('NOT (title:"el pais" OR c?sa)'),
+                         {'not', 'phrase', 'multifield', 'wildcard'})
+
+    def test_supported(self):
+        self.assertTrue(SAR_Benchmark.supported('plain', {'term', 'not'}))
+        self.assertFalse(SAR_Benchmark.supported('plain', {'stem'}))
+        self.assertFalse(SAR_Benchmark.supported('SPM', {'phrase'}))
+        self.assertTrue(SAR_Benchmark.supported('SPMO', {'phrase', 'wildcard', 'multifield', 'stem'}))
+
+    def test_read_queries(self):
+        queries = SAR_Benchmark.read_queries(os.path.join(ROOT, 'results', '2015', 'result_2015_minimo.txt'))
+        self.assertTrue(queries)
+        self.assertFalse(any('\t' in query or query.startswith('#') for query in queries))
+
+
+class Percentiles(unittest.TestCase):
+
+    def test_percentiles(self):
+        self.assertEqual(SAR_Benchmark.percentiles([]), {'n': 0})
+        self.assertEqual(SAR_Benchmark.percentiles([0.002]), {'n': 1, 'p50_ms': 2.0, 'p95_ms': 2.0, 'p99_ms': 2.0})
+        res = SAR_Benchmark.percentiles([i / 1000 for i in range(1, 102)])
+        self.assertEqual((res['n'], res['p50_ms'], res['p95_ms'], res['p99_ms']), (101, 51.0, 96.0, 100.0))
+
+
+class Run(unittest.TestCase):
+
+    def test_smoke(self):
+        res = run_script('SAR_Benchmark.py', '-c', MONTH, '--configs', 'plain', 'SPMO', '-r', '1',
+                         '-q', os.path.join('results', 'queries_minimo.txt'))
+        self.assertEqual(res.returncode, 0, res.stderr)
+        results = json.loads(res.stdout)
+        self.assertEqual(results['meta']['repeat'], 1)
+        measures = results['results']['03']
+        self.assertEqual(set(measures), {'plain', 'SPMO'})
+        self.assertEqual(measures['plain']['build']['news'], measures['SPMO']['build']['news'])
+        queries = measures['SPMO']['queries']['files']['queries_minimo.txt']
+        self.assertGreater(queries['all']['n'], 0)
+        # Sin stemming ni permuterm las consultas de esas clases no se repiten
+        plain = measures['plain']['queries']['files']['queries_minimo.txt']
+        self.assertEqual(plain['classes']['stem']['n'], 0)
+        self.assertGreater(plain['classes']['stem']['skipped'], 0)
+        self.assertEqual(queries['classes']['stem']['skipped'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+Pruebas de las operaciones booleanas entre posting lists (AND, OR, NOT) de SAR_Project.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from functools import reduce
+
+from common import MONTH, NEWS_2015, SAR_Project, build
+
+from SAR_postings import BitmapPosting, CompressedPosting, NotPosting, encode_posting
+
+
+def sample(rng, size, top=20000):
+    return sorted(rng.sample(range(top), size))
+
+
+class And(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH)
+
+    def test_and_posting(self):
+        rng = random.Random(10)
+        ratio = self.project.GALLOP_RATIO
+        # Listas de tamaño parecido (merge) y muy distinto (galloping)
+        for n1, n2 in ((0, 0), (0, 10), (1, 1), (10, 10), (100, 150), (1, 1000), (5, 5000), (50, 50 * ratio + 1)):
+            p1 = sample(rng, n1)
+            p2 = sample(rng, n2)
+            # Con muchos elementos comunes
+            p3 = sorted(set(p2[::3]) | set(sample(rng, n1)))
+            for a, b in ((p1, p2), (p2, p1), (p3, p2), (p2, p3)):
+                self.assertEqual(self.project.and_posting(a, b), sorted(set(a) & set(b)), (n1, n2))
+
+    def test_gallop_edges(self):
+        p2 = list(range(0, 2000, 2))
+        for p1 in ([0], [1998], [1999], [-1], [0, 1998], [3, 5, 7], [2000, 3000]):
+            self.assertEqual(self.project.and_posting(p1, p2), sorted(set(p1) & set(p2)), p1)
+
+    def test_and_postings(self):
+        rng = random.Random(11)
+        for sizes in ((10, 1000), (3000, 50, 800), (5, 5, 5, 5), (2000, 2000, 1500, 10, 300)):
+            postings = [sample(rng, size, top=4000) for size in sizes]
+            copies = [list(p) for p in postings]
+            expected = sorted(reduce(set.intersection, map(set, postings)))
+            self.assertEqual(self.project.and_postings(postings), expected, sizes)
+            self.assertEqual(self.project.and_postings(postings[::-1]), expected, sizes)
+            self.assertEqual(postings, copies)
+
+    def test_compressed(self):
+        rng = random.Random(12)
+        for n1, n2 in ((10, 3000), (3000, 10), (500, 700)):
+            p1 = sample(rng, n1, top=5000)
+            p2 = sample(rng, n2, top=5000)
+            c1 = CompressedPosting(encode_posting(dict.fromkeys(p1, 1)))
+            c2 = CompressedPosting(encode_posting(dict.fromkeys(p2, 1)))
+            expected = sorted(set(p1) & set(p2))
+            for a, b in ((c1, p2), (p1, c2), (c1, c2)):
+                self.assertEqual(self.project.and_posting(a, b), expected)
+
+    def test_queries(self):
+        project = self.project
+        ids = {term: set(project.index['article'][term]) for term in ('de', 'la', 'valencia', 'gobierno', 'el')}
+        for terms in (('de', 'la'), ('valencia', 'de'), ('gobierno', 'el', 'la', 'de')):
+            expected = sorted(reduce(set.intersection, (ids[term] for term in terms)))
+            self.assertEqual(project.solve_query(' AND '.join(terms)), expected, terms)
+
+
+class Not(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH)
+        cls.all = set(cls.project.news)
+        cls.ids = {term: set(cls.project.index['article'][term]) for term in ('de', 'valencia', 'gobierno', 'madrid')}
+
+    def list(self, term):
+        return sorted(self.ids[term])
+
+    def test_negate(self):
+        a = self.list('valencia')
+        self.assertIs(NotPosting.negate(NotPosting.negate(a)), a)
+        self.assertEqual(self.project.reverse_posting(a), sorted(self.all - set(a)))
+        self.assertEqual(self.project.reverse_posting(NotPosting(a)), a)
+        self.assertEqual(self.project.reverse_posting([]), sorted(self.all))
+
+    def test_minus(self):
+        for t1, t2 in (('de', 'valencia'), ('valencia', 'de'), ('gobierno', 'madrid')):
+            self.assertEqual(self.project.minus_posting(self.list(t1), self.list(t2)),
+                             sorted(self.ids[t1] - self.ids[t2]), (t1, t2))
+        # p2 mucho mas larga que p1: se busca con busqueda binaria
+        rng = random.Random(13)
+        p1 = sample(rng, 20)
+        p2 = sorted(set(sample(rng, 5000)) | set(p1[::2]))
+        self.assertEqual(self.project.minus_posting(p1, p2), sorted(set(p1) - set(p2)))
+
+    def test_and_or(self):
+        project = self.project
+        a, b = self.list('valencia'), self.list('gobierno')
+        sa, sb = self.ids['valencia'], self.ids['gobierno']
+        self.assertEqual(project.and_postings([NotPosting(a), b]), sorted(sb - sa))
+        self.assertEqual(project.and_postings([b, NotPosting(a)]), sorted(sb - sa))
+        res = project.and_postings([NotPosting(a), NotPosting(b)])
+        self.assertIsInstance(res, NotPosting)
+        self.assertEqual(project.materialize(res), sorted(self.all - sa - sb))
+        self.assertEqual(project.materialize(project.or_posting(NotPosting(a), b)), sorted((self.all - sa) | sb))
+        self.assertEqual(project.materialize(project.or_posting(a, NotPosting(b))), sorted(sa | (self.all - sb)))
+        self.assertEqual(project.materialize(project.or_posting(NotPosting(a), NotPosting(b))),
+                         sorted(self.all - (sa & sb)))
+
+    def test_queries(self):
+        project = self.project
+        v, g, m, d = (self.ids[term] for term in ('valencia', 'gobierno', 'madrid', 'de'))
+        cases = {'NOT valencia': self.all - v,
+                 'NOT NOT valencia': v,
+                 'gobierno AND NOT valencia': g - v,
+                 'NOT valencia AND gobierno': g - v,
+                 'NOT valencia OR gobierno': (self.all - v) | g,
+                 'NOT (valencia OR gobierno)': self.all - v - g,
+                 'NOT valencia AND NOT gobierno AND NOT madrid': self.all - v - g - m,
+                 'de AND NOT (valencia AND NOT madrid)': d - (v - m),
+                 'valencia OR NOT valencia': self.all}
+        for query, expected in cases.items():
+            self.assertEqual(project.solve_query(query), sorted(expected), query)
+
+
+class Bitmaps(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(NEWS_2015, multifield=True)
+        cls.all = set(cls.project.news)
+
+    def ids(self, term):
+        return set(self.project.index['article'][term])
+
+    def test_dense_terms(self):
+        project = self.project
+        bitmap = project.get_bitmap('de')
+        self.assertIsInstance(bitmap, BitmapPosting)
+        self.assertEqual(bitmap.ids(), sorted(self.ids('de')))
+        self.assertIsInstance(project.get_posting('de'), BitmapPosting)
+        # Los terminos poco frecuentes y los que no estan no tienen bitmap
+        self.assertIsNone(project.get_bitmap('videojuegos'))
+        self.assertIsNone(project.get_bitmap('zzzz'))
+        self.assertEqual(project.get_posting('zzzz'), [])
+        self.assertIn('de', project.bitmaps['article'])
+
+    def test_queries(self):
+        de, la, el, valencia = (self.ids(term) for term in ('de', 'la', 'el', 'valencia'))
+        cases = {'de AND la': de & la,
+                 'de OR valencia': de | valencia,
+                 'de AND NOT el': de - el,
+                 'NOT de OR la': (self.all - de) | la,
+                 'valencia AND NOT (de AND la)': valencia - (de & la)}
+        for query, expected in cases.items():
+            self.assertEqual(self.project.materialize(self.project.solve_query(query)), sorted(expected), query)
+
+    def test_not_saved(self):
+        self.project.get_bitmap('de')
+        tmp = tempfile.mkdtemp(prefix='sar_test_')
+        try:
+            filename = os.path.join(tmp, 'index.bin')
+            self.project.save(filename)
+            loaded = SAR_Project.load(filename)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.assertEqual(loaded.bitmaps, {field: {} for field in self.project.bitmaps})
+        self.assertEqual(loaded.solve_query('de AND la'), self.project.solve_query('de AND la'))
+
+
+if __name__ == '__main__':
+    unittest.main()
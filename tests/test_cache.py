@@ -0,0 +1,89 @@
+"""
+Pruebas de la cache LRU de subconsultas (SAR_Project.query_cache).
+"""
+
+import unittest
+
+from common import FULL, MONTH, SAR_Project
+
+
+class QueryCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = SAR_Project()
+        cls.project.index_dir(MONTH, **FULL)
+
+    def setUp(self):
+        self.project.set_stemming(False)
+        self.project.set_query_cache(self.project.QUERY_CACHE_SIZE)
+        self.project.query_cache.clear()
+        self.project.cache_hits = 0
+        self.project.cache_misses = 0
+
+    def test_hits(self):
+        project = self.project
+        first = project.solve_query('valencia AND de')
+        self.assertEqual((project.cache_hits, project.cache_misses), (0, 1))
+        self.assertEqual(project.solve_query('de AND valencia'), first)
+        self.assertEqual((project.cache_hits, project.cache_misses), (1, 1))
+        # Los terminos sin comodines no se guardan, los comodines y las frases si
+        project.solve_query('valencia')
+        project.solve_query('val*')
+        project.solve_query('"de la"')
+        self.assertEqual(len(project.query_cache), 3)
+        self.assertIn('1 hits, 3 misses', project.cache_stats())
+
+    def test_lru(self):
+        project = self.project
+        project.set_query_cache(2)
+        project.solve_query('c*sa')
+        project.solve_query('val*')
+        # Se usa c*sa, la menos usada pasa a ser val*
+        project.solve_query('c*sa')
+        project.solve_query('gob*')
+        self.assertEqual([key for _, key in project.query_cache], ['article:c*sa', 'article:gob*'])
+        project.set_query_cache(1)
+        self.assertEqual([key for _, key in project.query_cache], ['article:gob*'])
+
+    def test_disabled(self):
+        project = self.project
+        project.set_query_cache(0)
+        project.solve_query('val* AND de')
+        project.solve_query('val* AND de')
+        self.assertEqual(len(project.query_cache), 0)
+        self.assertEqual(project.cache_hits, 0)
+
+    def test_stemming_key(self):
+        project = self.project
+        plain = project.solve_query('gob*')
+        project.set_stemming(True)
+        self.assertEqual(project.solve_query('gob*'), plain)
+        self.assertEqual(project.cache_hits, 0)
+        self.assertNotEqual(project.solve_query('"de la" AND gobierno'), [])
+        project.set_stemming(False)
+        self.assertEqual(project.solve_query('gob*'), plain)
+        self.assertEqual(project.cache_hits, 1)
+
+    def test_no_expansion_when_cached(self):
+        project = self.project
+        calls = []
+        expand = project.get_permuterm_terms
+        project.get_permuterm_terms = lambda term, field='article': calls.append(term) or expand(term, field)
+        try:
+            first = project.solve_query('val* AND de')
+            self.assertEqual(project.solve_query('val*'), project.solve_query('val*'))
+            self.assertEqual(project.solve_query('val* AND de'), first)
+        finally:
+            del project.get_permuterm_terms
+        self.assertEqual(calls, ['val*'])
+
+    def test_cleared_on_update(self):
+        project = self.project
+        project.solve_query('val*')
+        project.update_dir(MONTH)
+        self.assertEqual(len(project.query_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Pruebas de la medicion de la memoria del indice (opcion --memory de SAR_Indexer.py).
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import FULL, MONTH, SAR_Project, build
+
+from SAR_lib import deep_getsizeof, peak_memory
+
+
+class DeepSize(unittest.TestCase):
+
+    def test_shared_once(self):
+        shared = list(range(1000))
+        alone = deep_getsizeof(shared)
+        self.assertGreater(deep_getsizeof([shared]), alone)
+        # Un objeto que aparece dos veces solo se cuenta una
+        self.assertLess(deep_getsizeof([shared, shared]), 2 * alone)
+        seen = set()
+        deep_getsizeof(shared, seen)
+        self.assertLess(deep_getsizeof({'a': shared}, seen), alone)
+
+    def test_peak_memory(self):
+        peak = peak_memory()
+        self.assertIsNotNone(peak)
+        self.assertGreater(peak, 2 ** 20)
+
+
+class MemoryReport(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+
+    def test_structures(self):
+        project = self.project
+        report = project.memory_report()
+        for name in ('index', 'sindex', 'spindex', 'ptindex', 'lengths', 'offsets'):
+            self.assertEqual(set(report[name]), set(project.index), name)
+        for field, index in report['index'].items():
+            self.assertEqual(index['n_postings'], sum(len(p) for p in project.index[field].values()), field)
+            self.assertEqual(index['n_positions'],
+                             sum(len(positions) for p in project.index[field].values() for positions in p.values()))
+            self.assertGreater(index['postings'], 0)
+        self.assertGreater(report['index']['article']['positions'], 0)
+        self.assertGreater(report['news'], 0)
+
+    def test_representations(self):
+        # Cada representacion cuenta sus posiciones, comprimidas estan dentro de las posting lists
+        plain = self.project.memory_report()['index']['article']
+        compact = build(MONTH, compact=True, **FULL).memory_report()['index']['article']
+        compressed = build(MONTH, compress=True, **FULL).memory_report()['index']['article']
+        self.assertEqual(compact['n_postings'], plain['n_postings'])
+        self.assertEqual(compact['n_positions'], plain['n_positions'])
+        self.assertGreater(compact['positions'], 0)
+        self.assertEqual(compressed['n_positions'], 0)
+        for report in (compact, compressed):
+            self.assertLess(report['postings'] + report['positions'], plain['postings'] + plain['positions'])
+
+    def test_show_memory(self):
+        project = SAR_Project()
+        project.index_dir(MONTH, **FULL)
+        before, peak, workers = project.index_memory
+        self.assertLessEqual(before, peak)
+        self.assertIsNone(workers)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            project.show_stats(memory=True)
+        self.assertIn('MEMORY:', output.getvalue())
+        self.assertIn("postings in 'article'", output.getvalue())
+        self.assertIn('process peak RSS', output.getvalue())
+
+    def test_update(self):
+        tmp = tempfile.mkdtemp(prefix='sar_test_')
+        self.addCleanup(shutil.rmtree, tmp, True)
+        files = sorted(os.listdir(MONTH))[:2]
+        shutil.copy(os.path.join(MONTH, files[0]), tmp)
+        project = SAR_Project()
+        project.index_dir(tmp, **FULL)
+        project.index_memory = None
+        shutil.copy(os.path.join(MONTH, files[1]), tmp)
+        project.update_dir(tmp)
+        self.assertIsNotNone(project.index_memory)
+        self.assertLessEqual(project.index_memory[0], project.index_memory[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Pruebas de la lectura de noticias por offset (SAR_Project.read_news y SAR_Project.get_new).
+"""
+
+import json
+import unittest
+
+from common import MONTH, SAR_Project, build
+
+
+class ReadNews(unittest.TestCase):
+
+    def test_offsets(self):
+        # Con caracteres de varios bytes y separadores distintos los offsets son de bytes
+        data = '[ {"title": "año", "n": 1} ,\n\t{"title": "ñu €", "n": 2},{"n": 3}\n]'.encode('utf-8')
+        news = SAR_Project().read_news(data)
+        self.assertEqual([noticia for noticia, _, _ in news], json.loads(data))
+        for noticia, offset, length in news:
+            self.assertEqual(json.loads(data[offset:offset + length]), noticia)
+
+    def test_empty(self):
+        self.assertEqual(SAR_Project().read_news(b'[]'), [])
+        self.assertEqual(SAR_Project().read_news(b'[ \n]'), [])
+
+
+class GetNew(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH)
+
+    def test_same_as_file(self):
+        project = self.project
+        files = {}
+        for new in project.news:
+            docid, position, _, _ = project.news[new]
+            if docid not in files:
+                with open(project.docs[docid]) as fh:
+                    files[docid] = json.load(fh)
+            self.assertEqual(project.get_new(new), files[docid][position], new)
+
+    def test_cache(self):
+        project = self.project
+        project.new_cache.clear()
+        first = project.get_new(0)
+        self.assertIs(project.get_new(0), first)
+        # Solo se guardan las ultimas NEW_CACHE_SIZE noticias leidas
+        project.NEW_CACHE_SIZE = 10
+        try:
+            for new in range(20):
+                project.get_new(new)
+            self.assertEqual(list(project.new_cache), list(range(10, 20)))
+        finally:
+            del project.NEW_CACHE_SIZE
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Pruebas de la indexacion y la resolucion de consultas en paralelo (opcion -j de SAR_Indexer.py
+y SAR_Searcher.py).
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import FULL, MONTH, SAR_Project, build, run_script
+
+QUERIES = ('valencia', 'title:gobierno OR madrid', '"el pais" AND NOT valencia', 'valen*',
+           'NOT madrid AND presidente', 'gob* AND "de la"', 'casa', 'madrid AND valencia')
+
+
+class ParallelIndexing(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.serial = build(MONTH, multifield=True, positional=True, stem=True, permuterm=True)
+        cls.parallel = SAR_Project()
+        cls.parallel.index_dir(MONTH, multifield=True, positional=True, stem=True, permuterm=True, jobs=3)
+
+    def test_same_ids(self):
+        # Los ids de ficheros y noticias no dependen del numero de procesos
+        self.assertEqual(self.parallel.docs, self.serial.docs)
+        self.assertEqual(dict(self.parallel.news), dict(self.serial.news))
+        self.assertEqual(self.parallel.new_cont, self.serial.new_cont)
+
+    def test_same_index(self):
+        for field in self.serial.index:
+            self.assertEqual(self.parallel.index[field], self.serial.index[field], field)
+            self.assertEqual(list(self.parallel.index[field]), list(self.serial.index[field]), field)
+            self.assertEqual(self.parallel.sindex[field], self.serial.sindex[field], field)
+            self.assertEqual(self.parallel.lengths[field], self.serial.lengths[field], field)
+        self.assertEqual(self.parallel.total_length, self.serial.total_length)
+
+    def test_same_results(self):
+        for query in ('valencia', 'title:gobierno OR madrid', '"el pais" AND NOT valencia', 'valen*'):
+            self.assertEqual(self.parallel.solve_query(query), self.serial.solve_query(query), query)
+
+
+class ParallelQueries(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+        cls.tmp = tempfile.mkdtemp(prefix='sar_test_')
+        cls.index = os.path.join(cls.tmp, 'index')
+        cls.project.save(cls.index)
+        cls.queries = os.path.join(cls.tmp, 'queries.txt')
+        with open(cls.queries, 'w') as fh:
+            fh.write('# consultas\n' + '\n'.join(QUERIES) + '\n')
+        cls.tests = os.path.join(cls.tmp, 'tests.txt')
+        with open(cls.tests, 'w') as fh:
+            for query in QUERIES:
+                fh.write('%s\t%d\n' % (query, len(cls.project.solve_query(query))))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def search(self, *args):
+        res = run_script('SAR_Searcher.py', self.index, *args)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        return res.stdout
+
+    def test_same_order(self):
+        # Los resultados llegan en el orden de las consultas, con la salida de cada una
+        project = self.project
+        serial = list(project.solve_parallel(project.solve_and_count, QUERIES * 4, 1))
+        parallel = list(project.solve_parallel(project.solve_and_count, QUERIES * 4, 3))
+        self.assertEqual(parallel, serial)
+        self.assertEqual([result for _, result in serial], [len(project.solve_query(query)) for query in QUERIES * 4])
+
+    def test_list(self):
+        for options in (('-C',), ('-R', 'bm25'), ('-N',)):
+            self.assertEqual(self.search('-L', self.queries, '-j', '3', *options),
+                             self.search('-L', self.queries, *options), options)
+
+    def test_test_file(self):
+        output = self.search('-T', self.tests, '-j', '3')
+        self.assertIn('Parece que todo ha ido bien', output)
+        self.assertEqual(output, self.search('-T', self.tests))
+
+    def test_explain_test_file(self):
+        # Con -E el plan de cada consulta se muestra tambien con -T
+        output = self.search('-T', self.tests, '-E')
+        self.assertIn('Parece que todo ha ido bien', output)
+        for query in QUERIES:
+            # La estimacion de cada nodo depende de lo que haya en la cache, se comparan las etiquetas
+            plan = [line.split('  [~')[0] for line in self.project.explain(query).split('\n')]
+            for line in plan:
+                self.assertIn(line, output, query)
+            self.assertIn('\n%s\t' % query, '\n' + output)
+        self.assertEqual(self.search('-T', self.tests, '-E', '-j', '2'), output)
+
+
+if __name__ == '__main__':
+    unittest.main()
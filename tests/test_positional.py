@@ -0,0 +1,66 @@
+"""
+Pruebas de las consultas posicionales y del operador de proximidad NEAR/k.
+"""
+
+import unittest
+
+from common import FULL, NEWS_2015, build
+
+
+def brute_force(project, words, gaps, field='article'):
+    """
+    Noticias que cumplen la consulta posicional, buscandola en los tokens de cada noticia.
+    """
+    res = []
+    for new in project.news:
+        tokens = project.tokenize(project.get_new(new)[field])
+        valid = [i for i, token in enumerate(tokens) if token == words[0]]
+        for word, gap in zip(words[1:], gaps):
+            positions = [i for i, token in enumerate(tokens) if token == word]
+            if gap is None:
+                valid = [pos for pos in positions if pos - 1 in valid]
+            else:
+                valid = [pos for pos in positions if any(0 < abs(pos - p) <= gap for p in valid)]
+        if valid:
+            res.append(new)
+    return res
+
+
+class Phrases(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(NEWS_2015, **FULL)
+
+    def test_reference(self):
+        # La interseccion de posiciones original perdia coincidencias (24 en lugar de 29)
+        self.assertEqual(len(self.project.solve_query('"fin de semana"')), 29)
+        self.assertEqual(len(self.project.solve_query('"medalla de oro"')), 4)
+
+    def test_brute_force(self):
+        cases = (['fin', 'de', 'semana'], ['de', 'la'], ['el', 'país'], ['la', 'ciudad', 'de'], ['de', 'de'])
+        for words in cases:
+            expected = brute_force(self.project, words, [None] * (len(words) - 1))
+            self.assertEqual(self.project.solve_query('"%s"' % ' '.join(words)), expected, words)
+
+    def test_near(self):
+        cases = ((['gobierno', 'españa'], [3]), (['fin', 'semana'], [1]), (['madrid', 'barcelona'], [10]),
+                 (['de', 'de'], [1]), (['presidente', 'gobierno', 'españa'], [2, 4]), (['fin', 'de', 'semana'], [None, 2]))
+        for words, gaps in cases:
+            query = words[0] + ''.join(' %s%s' % ('' if gap is None else 'NEAR/%d ' % gap, word)
+                                       for word, gap in zip(words[1:], gaps))
+            expected = brute_force(self.project, words, gaps)
+            self.assertEqual(self.project.solve_query(query), expected, query)
+
+    def test_merge_positions(self):
+        project = self.project
+        self.assertEqual(project.merge_positions([1, 5, 9], [2, 6, 7, 10]), [2, 6, 10])
+        self.assertEqual(project.merge_positions([5], [3, 4, 5, 6, 8]), [6])
+        self.assertEqual(project.merge_positions([5], [2, 3, 5, 7, 8], 2), [3, 7])
+        self.assertEqual(project.merge_positions([5], [5], 0), [])
+        self.assertEqual(project.merge_positions([4, 5], [5], 1), [5])
+        self.assertEqual(project.split_near(['a', 'NEAR/3', 'b', 'c']), (['a', 'b', 'c'], [3, None]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+"""
+Pruebas de las representaciones de las posting lists (SAR_postings).
+"""
+
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+from array import array
+
+from common import FULL, MONTH, SAR_Project, build
+
+from SAR_postings import BLOCK_SIZE, REMOVED, ArrayIndex, BitmapPosting, CompressedCursor, CompressedIndex, \
+    CompressedPosting, IterCursor, NewsTable, PostingCursor, decode_varints, encode_posting, encode_varints, gallop, \
+    narrow
+
+
+def random_posting(rng, size, positional=False, top=100000):
+    ids = sorted(rng.sample(range(top), size))
+    if positional:
+        return {new: sorted(rng.sample(range(500), rng.randint(1, 5))) for new in ids}
+    return {new: rng.randint(1, 300) for new in ids}
+
+
+class Varints(unittest.TestCase):
+
+    def test_round_trip(self):
+        values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 32 - 1, 2 ** 40]
+        self.assertEqual(decode_varints(bytes(encode_varints(values))), values)
+        rng = random.Random(1)
+        values = [rng.randrange(2 ** rng.randint(1, 35)) for _ in range(5000)]
+        self.assertEqual(decode_varints(bytes(encode_varints(values))), values)
+
+    def test_one_byte(self):
+        self.assertEqual(bytes(encode_varints([0, 5, 127])), bytes([0, 5, 127]))
+        self.assertEqual(bytes(encode_varints([128])), bytes([0x80, 0x01]))
+
+
+class Compressed(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = random.Random(2)
+        for size in (1, 5, BLOCK_SIZE, BLOCK_SIZE + 1, 3 * BLOCK_SIZE + 7):
+            for positional in (False, True):
+                posting = random_posting(rng, size, positional)
+                compressed = CompressedPosting(encode_posting(posting))
+                self.assertEqual(len(compressed), size)
+                self.assertEqual(compressed.ids(), list(posting))
+                self.assertEqual(dict(compressed.items()), posting)
+                for new in list(posting)[::7]:
+                    self.assertIn(new, compressed)
+                    self.assertEqual(compressed[new], posting[new])
+                self.assertNotIn(100001, compressed)
+
+    def test_intersect(self):
+        rng = random.Random(3)
+        posting = random_posting(rng, 1000, top=5000)
+        compressed = CompressedPosting(encode_posting(posting))
+        for size in (0, 1, 10, 2000):
+            other = sorted(rng.sample(range(5000), size))
+            self.assertEqual(compressed.intersect(other), sorted(set(posting) & set(other)))
+
+    def test_index(self):
+        index = build(MONTH, **FULL).index['article']
+        compressed = CompressedIndex(index)
+        self.assertEqual(list(compressed), list(index))
+        self.assertEqual(compressed.decompress(), index)
+
+    def test_same_results(self):
+        plain = build(MONTH, **FULL)
+        compressed = build(MONTH, compress=True, **FULL)
+        for query in ('valencia', '"de la"', 'c*sa OR gob*', 'NOT madrid AND presidente', 'el AND de AND la'):
+            self.assertEqual(compressed.solve_query(query), plain.solve_query(query), query)
+
+
+class Arrays(unittest.TestCase):
+
+    def test_narrow(self):
+        self.assertEqual(narrow(array('I', [0, 255])).typecode, 'B')
+        self.assertEqual(narrow(array('I', [256, 65535])).typecode, 'H')
+        self.assertEqual(narrow(array('I', [])).typecode, 'B')
+        values = array('I', [65536])
+        self.assertIs(narrow(values), values)
+        self.assertEqual(narrow(array('I', [3, 200])).tolist(), [3, 200])
+
+    def test_index(self):
+        for positional in (False, True):
+            rng = random.Random(4)
+            index = {'t%d' % i: random_posting(rng, rng.randint(1, 300), positional) for i in range(50)}
+            compact = ArrayIndex(index, positional)
+            self.assertEqual(list(compact), list(index))
+            self.assertEqual(compact.to_dict(), index)
+            posting = compact['t7']
+            self.assertEqual(posting.ids(), list(index['t7']))
+            self.assertEqual(len(posting), len(index['t7']))
+            for new in index['t7']:
+                self.assertIn(new, posting)
+                self.assertEqual(posting[new], index['t7'][new])
+            self.assertNotIn(100001, posting)
+            with self.assertRaises(KeyError):
+                posting[100001]
+
+    def test_pickle(self):
+        rng = random.Random(5)
+        index = {'t%d' % i: random_posting(rng, 20, True, top=200) for i in range(30)}
+        compact = ArrayIndex(index, True)
+        data = pickle.dumps(compact)
+        # Las posiciones y los newids caben en un byte, se guardan con 'B'
+        self.assertLess(len(data), len(pickle.dumps(compact.__dict__)))
+        loaded = pickle.loads(data)
+        for name in ArrayIndex.NARROW:
+            self.assertEqual(getattr(loaded, name).typecode, 'I', name)
+        self.assertEqual(loaded.to_dict(), index)
+        # El indice original no cambia al guardarlo
+        self.assertEqual(compact.ids.typecode, 'I')
+
+    def test_news_table(self):
+        news = {0: [0, 0, 10, 20], 2: [1, 0, 0, 30], 3: [1, 1, 30, 5]}
+        table = NewsTable.from_dict(news, 4)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table), [0, 2, 3])
+        self.assertEqual({new: table[new] for new in table}, news)
+        self.assertEqual(table.data[4], REMOVED)
+        with self.assertRaises(KeyError):
+            table[1]
+
+    def test_project(self):
+        plain = build(MONTH, **FULL)
+        compact = build(MONTH, compact=True, **FULL)
+        self.assertIsInstance(compact.index['article'], ArrayIndex)
+        self.assertIsInstance(compact.news, NewsTable)
+        tmp = tempfile.mkdtemp(prefix='sar_test_')
+        try:
+            filename = os.path.join(tmp, 'index.bin')
+            compact.save(filename)
+            loaded = SAR_Project.load(filename)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        for query in ('valencia', '"de la"', 'c*sa OR gob*', 'NOT madrid AND presidente'):
+            self.assertEqual(loaded.solve_query(query), plain.solve_query(query), query)
+        self.assertEqual(loaded.get_new(5), plain.get_new(5))
+
+
+class Bitmaps(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = random.Random(8)
+        for ids in ([], [0], [7, 8], [1000], sorted(rng.sample(range(5000), 700))):
+            bitmap = BitmapPosting.from_ids(ids)
+            self.assertEqual(bitmap.ids(), ids)
+            self.assertEqual(list(bitmap), ids)
+            self.assertEqual(len(bitmap), len(ids))
+            for new in ids:
+                self.assertIn(new, bitmap)
+            self.assertNotIn(6000, bitmap)
+
+    def test_select(self):
+        bitmap = BitmapPosting.from_ids([1, 3, 9, 64])
+        ids = [0, 1, 2, 3, 9, 63, 64, 65, 1000]
+        self.assertEqual(bitmap.select(ids), [1, 3, 9, 64])
+        self.assertEqual(bitmap.select(ids, present=False), [0, 2, 63, 65, 1000])
+
+
+class Cursors(unittest.TestCase):
+
+    def test_gallop(self):
+        seq = [2, 4, 4, 8, 16, 32, 64, 128]
+        for lo in range(len(seq) + 1):
+            for new in range(0, 130):
+                expected = next((i for i in range(lo, len(seq)) if seq[i] >= new), len(seq))
+                self.assertEqual(gallop(seq, new, lo, len(seq)), expected, (lo, new))
+        self.assertEqual(gallop(seq, 100, 0, 4), 4)
+
+    def walk(self, cursor, targets):
+        """
+        Recorre un cursor alternando "seek" (a los newids de "targets") y "advance".
+        """
+        res = []
+        for target in targets:
+            cursor.seek(target)
+            if cursor.new is None:
+                break
+            res.append(cursor.new)
+            cursor.advance()
+            if cursor.new is None:
+                break
+            res.append(cursor.new)
+        return res
+
+    def expected(self, ids, targets):
+        res = []
+        i = 0
+        for target in targets:
+            while i < len(ids) and ids[i] < target:
+                i += 1
+            if i == len(ids):
+                break
+            res.append(ids[i])
+            i += 1
+            if i == len(ids):
+                break
+            res.append(ids[i])
+        return res
+
+    def test_same_walk(self):
+        rng = random.Random(6)
+        for size in (1, 10, BLOCK_SIZE + 3, 1000):
+            posting = random_posting(rng, size, top=20000)
+            ids = list(posting)
+            targets = sorted(rng.sample(range(21000), 40))
+            expected = self.expected(ids, targets)
+            compact = ArrayIndex({'a': {0: 1}, 'b': posting}, False)
+            cursors = [PostingCursor(ids), IterCursor(posting),
+                       CompressedCursor(CompressedPosting(encode_posting(posting))),
+                       PostingCursor(compact.ids, compact.starts[1], compact.starts[2])]
+            for cursor in cursors:
+                self.assertEqual(self.walk(cursor, targets), expected, (size, type(cursor).__name__))
+
+    def test_full_walk(self):
+        posting = random_posting(random.Random(7), 3 * BLOCK_SIZE, positional=True)
+        cursor = CompressedCursor(CompressedPosting(encode_posting(posting)))
+        res = []
+        while cursor.new is not None:
+            res.append(cursor.new)
+            cursor.advance()
+        self.assertEqual(res, list(posting))
+        # Buscar hacia atras no mueve el cursor
+        cursor = PostingCursor(list(posting))
+        cursor.seek(list(posting)[10])
+        cursor.seek(0)
+        self.assertEqual(cursor.new, list(posting)[10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Pruebas de la medicion de las etapas de las consultas (opcion --profile de SAR_Searcher.py).
+"""
+
+import unittest
+
+from common import FULL, MONTH, SAR_Project, build
+
+
+class Profile(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+
+    def setUp(self):
+        # Sin cache cada consulta se resuelve entera
+        self.project.set_query_cache(0)
+        self.project.set_profile(True)
+
+    def tearDown(self):
+        self.project.set_profile(False)
+        self.project.set_query_cache(SAR_Project.QUERY_CACHE_SIZE)
+
+    def test_report(self):
+        project = self.project
+        project.solve_query('valencia AND NOT (c*sa OR "de la")')
+        report = project.profile_report('q')
+        self.assertEqual(report['query'], 'q')
+        self.assertEqual(set(report), {'query', 'total_ms', 'stages_ms', 'calls', 'postings', 'posting_length',
+                                       'wildcard_terms', 'news_read', 'news_loaded'})
+        self.assertLessEqual(set(report['stages_ms']), set(SAR_Project.PROFILE_STAGES.values()) | {'other'})
+        for stage in ('parse', 'optimize', 'fetch', 'merge', 'other'):
+            self.assertIn(stage, report['stages_ms'])
+        # Los tiempos son exclusivos, las etapas no suman mas que el total
+        self.assertAlmostEqual(sum(report['stages_ms'].values()), report['total_ms'], delta=0.01)
+        self.assertGreaterEqual(report['stages_ms']['other'], -0.01)
+        self.assertEqual(report['calls']['parse_query'], 1)
+        # Se empieza a medir la siguiente consulta
+        self.assertEqual(project.profile_report('r')['calls'], {})
+
+    def test_counters(self):
+        project = self.project
+        project.solve_query('valencia AND madrid')
+        report = project.profile_report('valencia AND madrid')
+        self.assertEqual(report['postings'], 2)
+        self.assertEqual(report['posting_length'],
+                         len(project.get_posting('valencia')) + len(project.get_posting('madrid')))
+        project.reset_profile()
+        project.solve_query('c*sa')
+        self.assertEqual(project.profile_report('c*sa')['wildcard_terms'], len(project.get_permuterm_terms('c*sa')))
+
+    def test_news(self):
+        project = self.project
+        project.new_cache.clear()
+        project.solve_and_list('valencia')
+        first = project.profile_report('valencia')
+        self.assertGreater(first['news_read'], 0)
+        self.assertEqual(first['news_loaded'], first['news_read'])
+        # La segunda vez las noticias estan en la cache
+        project.solve_and_list('valencia')
+        second = project.profile_report('valencia')
+        self.assertEqual(second['news_read'], first['news_read'])
+        self.assertEqual(second['news_loaded'], 0)
+
+    def test_disabled(self):
+        project = self.project
+        profiled = project.solve_query('valencia OR c*sa')
+        project.set_profile(False)
+        self.assertIsNone(project.profile)
+        for name in SAR_Project.PROFILE_STAGES:
+            self.assertNotIn(name, project.__dict__)
+        self.assertEqual(project.solve_query('valencia OR c*sa'), profiled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Pruebas del parser de consultas (SAR_query) y del optimizador de SAR_Project.
+"""
+
+import unittest
+
+from common import FULL, MONTH, build
+
+import SAR_query
+
+
+def key(query):
+    node = SAR_query.parse(query)
+    return None if node is None else node.key
+
+
+class Parser(unittest.TestCase):
+
+    def test_precedence(self):
+        # AND y OR tienen la misma prioridad y se asocian de izquierda a derecha
+        self.assertEqual(key('a OR b AND c'), key('(a OR b) AND c'))
+        self.assertEqual(key('a AND b OR c'), key('(a AND b) OR c'))
+        self.assertNotEqual(key('a OR b AND c'), key('a OR (b AND c)'))
+        # NOT es la de mas prioridad
+        self.assertEqual(key('NOT a AND b'), key('(NOT a) AND b'))
+        self.assertEqual(key('NOT a OR NOT b'), key('(NOT a) OR (NOT b)'))
+        self.assertEqual(key('NOT (a OR b)'), 'NOT (article:a OR article:b)')
+
+    def test_tree(self):
+        node = SAR_query.parse('a AND NOT (b OR c)')
+        self.assertIsInstance(node, SAR_query.And)
+        left, right = node.children
+        self.assertEqual((left.field, left.term), ('article', 'a'))
+        self.assertIsInstance(right, SAR_query.Not)
+        self.assertIsInstance(right.child, SAR_query.Or)
+        self.assertEqual(SAR_query.children(right), [right.child])
+
+    def test_terms(self):
+        node = SAR_query.parse('title:Valencia')
+        self.assertEqual((node.field, node.term, node.exact), ('title', 'valencia', False))
+        node = SAR_query.parse('"Casa"')
+        self.assertEqual((node.field, node.term, node.exact), ('article', 'casa', True))
+        node = SAR_query.parse('keywords:"precio"')
+        self.assertEqual((node.field, node.term, node.exact), ('keywords', 'precio', True))
+
+    def test_phrases(self):
+        node = SAR_query.parse('"fin de semana"')
+        self.assertIsInstance(node, SAR_query.Phrase)
+        self.assertEqual(node.terms, ['fin', 'de', 'semana'])
+        self.assertEqual(key('fin de semana'), key('"fin de semana"'))
+        self.assertEqual(key('title:"el país"'), 'title:"el país"')
+        node = SAR_query.parse('gobierno NEAR/3 España')
+        self.assertEqual((node.field, node.terms), ('article', ['gobierno', 'NEAR/3', 'españa']))
+
+    def test_fields(self):
+        for field in SAR_query.FIELDS:
+            self.assertEqual(key(field + ':x'), field + ':x')
+        # Un prefijo que no es un campo no es un campo
+        self.assertEqual(key('foo:bar'), 'article:"foo bar"')
+        self.assertEqual(key('Title:x'), 'article:"title x"')
+
+    def test_tolerant(self):
+        self.assertIsNone(SAR_query.parse(''))
+        self.assertIsNone(SAR_query.parse('AND OR'))
+        self.assertIsNone(SAR_query.parse('NOT'))
+        self.assertEqual(key('(a OR b'), key('a OR b'))
+        self.assertEqual(key('a OR b)'), key('a OR b'))
+        self.assertEqual(key('a AND'), key('a'))
+        self.assertEqual(key('OR a'), key('a'))
+        self.assertEqual(key('(a) (b)'), key('a AND b'))
+
+    def test_commutative_keys(self):
+        self.assertEqual(key('a AND b'), key('b AND a'))
+        self.assertEqual(key('a OR b'), key('b OR a'))
+        self.assertNotEqual(key('a AND b'), key('a OR b'))
+
+
+class Optimizer(unittest.TestCase):
+
+    QUERIES = ('valencia AND de AND la', 'NOT NOT valencia', 'de AND NOT valencia AND NOT gobierno',
+               '(de AND la) AND (el AND de)', 'valencia OR valencia OR madrid', 'NOT (de AND NOT la) AND el',
+               '(valencia OR madrid) AND (madrid OR valencia) AND NOT gobierno', 'NOT valencia AND NOT madrid',
+               'c*sa AND (de OR NOT la)', '"de la" AND NOT (title:el OR de)', 'de AND NOT (la AND NOT el)')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+
+    def test_same_results(self):
+        project = self.project
+        project.set_query_cache(0)
+        try:
+            for query in self.QUERIES:
+                raw = project.materialize(project.evaluate(SAR_query.parse(query)))
+                self.assertEqual(project.solve_query(query), raw, query)
+        finally:
+            project.set_query_cache(project.QUERY_CACHE_SIZE)
+
+    def test_shape(self):
+        project = self.project
+        node = project.optimize_query(SAR_query.parse('(de AND la) AND (el AND de)'))
+        self.assertIsInstance(node, SAR_query.And)
+        self.assertEqual(sorted(child.term for child in node.children), ['de', 'el', 'la'])
+        # Los hijos se ordenan por tamaño estimado
+        sizes = [project.estimate(child) for child in node.children]
+        self.assertEqual(sizes, sorted(sizes))
+        node = project.optimize_query(SAR_query.parse('de AND NOT valencia AND NOT gobierno'))
+        self.assertIsInstance(node, SAR_query.AndNot)
+        self.assertEqual(node.child.term, 'de')
+        self.assertEqual(sorted(child.term for child in node.excluded), ['gobierno', 'valencia'])
+        node = project.optimize_query(SAR_query.parse('NOT NOT valencia'))
+        self.assertIsInstance(node, SAR_query.Term)
+
+    def test_shared_subqueries(self):
+        # Las subconsultas repetidas (con los hijos en otro orden) son el mismo nodo
+        node = self.project.optimize_query(SAR_query.parse('(valencia OR madrid) AND (de OR NOT (madrid OR valencia))'))
+        first, second = sorted(node.children, key=lambda child: len(child.key))
+        negated = next(child for child in second.children if isinstance(child, SAR_query.Not))
+        self.assertIs(negated.child, first)
+        # Un OR de dos subconsultas iguales es la subconsulta
+        node = self.project.optimize_query(SAR_query.parse('((valencia OR madrid) AND de) OR (de AND (madrid OR valencia))'))
+        self.assertIsInstance(node, SAR_query.And)
+
+    def test_unknown_field(self):
+        self.assertEqual(self.project.solve_query('foo:valencia'), [])
+        self.assertEqual(self.project.solve_query('foo:valencia OR valencia'), self.project.solve_query('valencia'))
+
+
+if __name__ == '__main__':
+    unittest.main()
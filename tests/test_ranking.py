@@ -0,0 +1,172 @@
+"""
+Pruebas del ranking de resultados: BM25, top-k con WAND y Jaccard con el indice directo y MinHash.
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import FULL, MONTH, NEWS_2015, build, run_script
+
+QUERIES = ('valencia', 'gobierno AND españa', 'madrid OR barcelona OR valencia', 'title:gobierno OR presidente',
+           '"fin de semana" AND ciudad', 'el OR la OR de', 'gob* OR pol*', 'presidente AND NOT gobierno',
+           'NOT valencia', 'keywords:precio OR economía')
+
+
+def bm25(project, terms, new):
+    """
+    BM25 de una noticia calculado directamente con la formula, termino a termino.
+    """
+    n = len(project.news)
+    score = 0.0
+    for field, term in terms:
+        posting = project.index[field].get(term, {})
+        if new not in posting:
+            continue
+        value = posting[new]
+        tf = value if isinstance(value, int) else len(value)
+        idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+        norm = 1 - project.BM25_B + project.BM25_B * project.lengths[field][new] / (project.total_length[field] / n)
+        score += idf * tf * (project.BM25_K1 + 1) / (tf + project.BM25_K1 * norm)
+    return score
+
+
+class BM25(unittest.TestCase):
+
+    def check(self, project, query, terms):
+        result = project.solve_query(query)
+        ranked = project.rank_bm25(result, query)
+        self.assertEqual(sorted(ranked), sorted(result))
+        for new in result:
+            self.assertAlmostEqual(project.scores[new], bm25(project, terms, new), places=9)
+        scores = [project.scores[new] for new in ranked]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_formula(self):
+        for project in (build(MONTH, multifield=True), build(MONTH, **FULL)):
+            self.check(project, 'valencia', [('article', 'valencia')])
+            self.check(project, 'gobierno OR title:españa', [('article', 'gobierno'), ('title', 'españa')])
+            # Los terminos negados no puntuan
+            self.check(project, 'presidente AND NOT gobierno', [('article', 'presidente')])
+
+    def test_ties_keep_newid_order(self):
+        project = build(MONTH, **FULL)
+        result = project.solve_query('valencia OR NOT valencia')
+        ranked = project.rank_bm25(result, 'zzzz')
+        self.assertEqual(ranked, result)
+
+    def test_rank_result(self):
+        project = build(MONTH, **FULL)
+        project.set_rank_mode('bm25')
+        project.set_showall(True)
+        result = project.solve_query('gobierno')
+        ranked = project.rank_result(result, 'gobierno')
+        self.assertEqual(len(ranked), len(result))
+        self.assertEqual(ranked, project.rank_bm25(result, 'gobierno'))
+
+
+class TopK(unittest.TestCase):
+
+    def check(self, project):
+        for stemming in (False, True):
+            project.set_stemming(stemming)
+            for query in QUERIES:
+                result = project.solve_query(query)
+                full = project.rank_bm25(result, query)
+                scores = project.scores
+                for k in (1, 10, 50):
+                    top = project.rank_topk(result, query, k)
+                    self.assertEqual(top, full[:k], (query, k, stemming))
+                    for new in top:
+                        self.assertEqual(project.scores[new], scores[new], (query, new))
+        project.set_stemming(False)
+
+    def test_without_bounds(self):
+        self.check(build(NEWS_2015, **FULL))
+
+    def test_with_bounds(self):
+        self.check(build(NEWS_2015, rank_data=True, **FULL))
+
+    def test_compressed(self):
+        self.check(build(NEWS_2015, rank_data=True, compress=True, **FULL))
+
+    def test_compact(self):
+        self.check(build(NEWS_2015, rank_data=True, compact=True, **FULL))
+
+    def test_rank_result(self):
+        project = build(NEWS_2015, rank_data=True, **FULL)
+        project.set_rank_mode('bm25')
+        project.set_showall(False)
+        result = project.solve_query('gobierno OR madrid')
+        self.assertEqual(project.rank_result(result, 'gobierno OR madrid'),
+                         project.rank_bm25(result, 'gobierno OR madrid')[:project.SHOW_MAX])
+
+
+class Jaccard(unittest.TestCase):
+
+    def test_forward_index(self):
+        # Con el indice directo la metrica es la misma que tokenizando cada noticia
+        for options in ({}, FULL):
+            project = build(MONTH, rank_data=True, **options)
+            for query in QUERIES[:6]:
+                terms = project.jaccard_terms(query)
+                for new in project.solve_query(query):
+                    self.assertEqual(project.jaccard_ids(terms, new), project.jaccard(query, project.get_new(new)),
+                                     (query, new))
+
+    def test_rank_data_optional(self):
+        plain = build(MONTH, **FULL)
+        ranked = build(MONTH, rank_data=True, **FULL)
+        self.assertFalse(any(plain.forward[field] for field in plain.index))
+        for project in (plain, ranked):
+            project.set_rank_mode('jaccard')
+            project.set_showall(True)
+            self.addCleanup(project.set_showall, False)
+        for query in QUERIES:
+            result = plain.solve_query(query)
+            self.assertEqual(plain.rank_result(result, query), ranked.rank_result(result, query), query)
+            self.assertEqual(plain.scores, ranked.scores, query)
+
+    def test_minhash(self):
+        project = build(MONTH, rank_data=True, minhash=True, **FULL)
+        # El MinHash de los terminos de una noticia coincide entero con el suyo
+        for new in range(0, len(project.news), 50):
+            terms = [(field, None, None, project.sketch(project.forward[field][new]))
+                     for field in project.jaccard_fields() if project.forward[field].get(new)]
+            self.assertEqual(project.jaccard_minhash(terms, new), len(terms))
+        # Y la estimacion se acerca a la metrica exacta
+        result = project.solve_query('el OR la OR de')
+        exact = project.jaccard_terms('el la de')
+        approximate = project.jaccard_terms('el la de', sketch=True)
+        error = sum(abs(project.jaccard_minhash(approximate, new) - project.jaccard_ids(exact, new)) for new in result)
+        self.assertLess(error / len(result), 0.05)
+
+    def test_minhash_threshold(self):
+        project = build(MONTH, rank_data=True, minhash=True, **FULL)
+        project.set_rank_mode('jaccard')
+        project.set_showall(True)
+        self.addCleanup(project.set_showall, False)
+        result = project.solve_query('valencia OR madrid')
+        project.MINHASH_MIN_RESULTS = 0
+        try:
+            ranked = project.rank_result(result, 'valencia OR madrid')
+        finally:
+            del project.MINHASH_MIN_RESULTS
+        terms = project.jaccard_terms('valencia OR madrid', sketch=True)
+        self.assertEqual(sorted(ranked), sorted(result))
+        self.assertEqual(project.scores, {new: project.jaccard_minhash(terms, new) for new in result})
+
+    def test_minhash_needs_rank_data(self):
+        tmp = tempfile.mkdtemp(prefix='sar_test_')
+        self.addCleanup(shutil.rmtree, tmp, True)
+        res = run_script('SAR_Indexer.py', MONTH, os.path.join(tmp, 'index'), '--minhash')
+        self.assertNotEqual(res.returncode, 0)
+        self.assertIn('--rank-data', res.stderr)
+        res = run_script('SAR_Indexer.py', MONTH, os.path.join(tmp, 'index'), '--minhash', '--rank-data')
+        self.assertEqual(res.returncode, 0, res.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
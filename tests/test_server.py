@@ -0,0 +1,115 @@
+"""
+Pruebas del servidor de consultas (SAR_Server.py) y su cliente (SAR_Client.py).
+"""
+
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from common import FULL, MONTH, ROOT, build, run_script
+
+import SAR_Client
+import SAR_Server
+
+QUERIES = ('valencia', 'title:gobierno OR madrid', '"el pais" AND NOT valencia', 'valen*', 'gob* AND "de la"')
+
+
+class Answer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+        SAR_Server.searcher = cls.project
+
+    def test_errors(self):
+        self.assertIn('error', SAR_Server.answer([]))
+        self.assertEqual(SAR_Server.answer({'op': 'list', 'query': 'casa', 'id': 3})['id'], 3)
+        self.assertIn('unknown op', SAR_Server.answer({'op': 'list', 'query': 'casa'})['error'])
+        self.assertIn('"query"', SAR_Server.answer({'op': 'count'})['error'])
+        self.assertIn('unknown mode', SAR_Server.answer({'op': 'rank', 'query': 'casa', 'mode': 'tfidf'})['error'])
+
+    def test_operations(self):
+        for query in QUERIES:
+            response = SAR_Server.answer({'op': 'count', 'query': query, 'id': query})
+            self.assertEqual(response['count'], len(self.project.solve_query(query)))
+            self.assertEqual(response['id'], query)
+            self.assertNotIn('results', response)
+            response = SAR_Server.answer({'op': 'rank', 'query': query, 'mode': 'bm25'})
+            self.project.set_ranking(True)
+            self.project.set_rank_mode('bm25')
+            try:
+                self.assertEqual([response['count'], response['results']], list(self.project.solve_and_list(query)))
+            finally:
+                self.project.set_ranking(False)
+                self.project.set_rank_mode('jaccard')
+
+
+class ServerRoundTrip(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+        cls.tmp = tempfile.mkdtemp(prefix='sar_test_')
+        cls.index = os.path.join(cls.tmp, 'index')
+        cls.project.save(cls.index)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def start(self, jobs):
+        socket = os.path.join(self.tmp, 'server%d.sock' % jobs)
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'SAR_Server.py'), self.index,
+                                   '--unix', socket, '-j', str(jobs)],
+                                  cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        self.addCleanup(server.wait)
+        self.addCleanup(server.kill)
+        # El servidor avisa cuando ya escucha
+        self.assertIn('Listening', server.stdout.readline())
+        return socket
+
+    def expected(self, query, stem=False):
+        self.project.set_stemming(stem)
+        self.project.set_snippet(True)
+        try:
+            return list(self.project.solve_and_list(query))
+        finally:
+            self.project.set_stemming(False)
+            self.project.set_snippet(False)
+
+    def test_round_trip(self):
+        for jobs in (1, 2):
+            socket = self.start(jobs)
+            requests = [{'op': 'show', 'query': query, 'snippet': True, 'stem': stem, 'id': i}
+                        for i, (query, stem) in enumerate((query, stem) for query in QUERIES for stem in (False, True))]
+            requests.append({'op': 'show'})
+            responses = asyncio.run(SAR_Client.send_requests(requests, unix=socket))
+            self.assertIn('error', responses.pop())
+            for request, response in zip(requests, responses):
+                # Las respuestas llegan en el orden de las peticiones
+                self.assertEqual(response['id'], request['id'])
+                self.assertEqual([response['count'], response['results']], self.expected(request['query'], request['stem']))
+
+    def test_concurrent_clients(self):
+        socket = self.start(2)
+
+        async def clients():
+            return await asyncio.gather(*[SAR_Client.send_requests([{'op': 'count', 'query': query}] * 3, unix=socket)
+                                          for query in QUERIES])
+
+        for query, responses in zip(QUERIES, asyncio.run(clients())):
+            self.assertEqual([response['count'] for response in responses], [len(self.project.solve_query(query))] * 3)
+
+    def test_client_script(self):
+        socket = self.start(2)
+        res = run_script('SAR_Client.py', '--unix', socket, '-C', '-Q', 'valencia')
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertIn('"count": %d' % len(self.project.solve_query('valencia')), res.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Pruebas de los snippets de las noticias recuperadas (opcion -N de SAR_Searcher.py).
+"""
+
+import unittest
+
+from common import FULL, MONTH, build
+
+QUERIES = ('valencia', 'c*sa AND NOT madrid', '"de la"', 'title:gobierno OR madrid', '"el pais" OR gob?erno')
+
+
+class Snippet(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+
+    def tearDown(self):
+        self.project.set_stemming(False)
+
+    def test_precomputed_terms(self):
+        project = self.project
+        for stemming in (False, True):
+            project.set_stemming(stemming)
+            for query in QUERIES:
+                terms = project.snippet_terms(query)
+                for new in project.solve_query(query)[:20]:
+                    noticia = project.get_new(new)
+                    self.assertEqual(project.snippet(noticia, query, new, terms), project.snippet(noticia, query, new),
+                                     (query, new))
+
+    def test_contains_terms(self):
+        project = self.project
+        for query, text in (('valencia', 'valencia'), ('"de la"', 'de la'), ('title:gobierno', 'gobierno')):
+            for new in project.solve_query(query):
+                snippet = project.snippet(project.get_new(new), query, new)
+                self.assertIn(text, snippet.lower(), (query, new))
+                self.assertTrue(snippet.startswith('"') and snippet.endswith('"'))
+
+    def test_terms(self):
+        project = self.project
+        self.assertEqual(project.snippet_terms('valencia AND NOT madrid'), [('article', ['valencia'], None)])
+        self.assertEqual(project.snippet_terms('date:2015-03-01 OR "de la"'), [('article', ['de', 'la'], [None])])
+        field, tokens, gaps = project.snippet_terms('c*sa')[0]
+        self.assertEqual((field, gaps), ('article', None))
+        self.assertEqual(sorted(tokens), sorted(project.get_permuterm_terms('c*sa')))
+        self.assertEqual(project.snippet_terms('NOT valencia'), [])
+
+    def test_terms_once_per_query(self):
+        project = self.project
+        calls = []
+        snippet_terms = project.snippet_terms
+        project.snippet_terms = lambda query: calls.append(query) or snippet_terms(query)
+        project.set_snippet(True)
+        project.set_showall(True)
+        try:
+            total, res = project.solve_and_list('c*sa')
+        finally:
+            del project.snippet_terms
+            project.set_snippet(False)
+            project.set_showall(False)
+        self.assertGreater(total, 1)
+        self.assertEqual(len(res), total)
+        self.assertEqual(calls, ['c*sa'])
+
+    def test_without_positions(self):
+        # Sin indice posicional se vuelve a tokenizar la noticia
+        project = build(MONTH)
+        for new in project.solve_query('valencia'):
+            noticia = project.get_new(new)
+            self.assertEqual(project.snippet(noticia, 'valencia', new), project.snippet_tokens(noticia, 'valencia'))
+            self.assertIn('valencia', project.snippet(noticia, 'valencia', new).lower())
+
+
+if __name__ == '__main__':
+    unittest.main()
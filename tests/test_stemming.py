@@ -0,0 +1,62 @@
+"""
+Pruebas del indice de stems y de las posting lists precalculadas de cada stem.
+"""
+
+import unittest
+from collections import Counter
+
+from common import FULL, MONTH, build
+
+
+class StemPostings(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+
+    def test_union_of_terms(self):
+        project = self.project
+        for field in ('article', 'title', 'keywords'):
+            for stem, tokens in project.sindex[field].items():
+                merged = Counter()
+                for token in tokens:
+                    for new, value in project.index[field][token].items():
+                        merged[new] += value if isinstance(value, int) else len(value)
+                posting = project.spindex[field][stem]
+                self.assertEqual(list(posting), sorted(merged), (field, stem))
+                self.assertEqual(dict(posting), dict(merged), (field, stem))
+
+    def test_every_term_has_its_stem(self):
+        project = self.project
+        for field in project.index:
+            for token in project.index[field]:
+                self.assertIn(token, project.sindex[field][project.stem(token)], (field, token))
+
+    def test_query(self):
+        project = self.project
+        project.set_stemming(True)
+        try:
+            for term in ('gobierno', 'ciudades', 'presidente', 'jugar'):
+                expected = set()
+                for token in project.sindex['article'].get(project.stem(term), []):
+                    expected.update(project.index['article'][token])
+                self.assertEqual(project.solve_query(term), sorted(expected), term)
+                # Entre comillas no se aplica stemming
+                self.assertEqual(project.solve_query('"%s"' % term), sorted(project.index['article'].get(term, {})), term)
+        finally:
+            project.set_stemming(False)
+
+    def test_compressed(self):
+        compressed = build(MONTH, compress=True, **FULL)
+        compressed.set_stemming(True)
+        self.project.set_stemming(True)
+        try:
+            for query in ('gobierno', 'ciudades AND presidente', 'title:gobierno OR jugar'):
+                self.assertEqual(compressed.solve_query(query), self.project.solve_query(query), query)
+        finally:
+            compressed.set_stemming(False)
+            self.project.set_stemming(False)
+
+
+if __name__ == '__main__':
+    unittest.main()
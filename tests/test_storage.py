@@ -0,0 +1,124 @@
+"""
+Pruebas del formato binario del indice (SAR_storage, opcion -F binary de SAR_Indexer.py) y de
+los componentes por campo del pickle (opcion --lazy).
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from common import FULL, MONTH, NEWS_2015, SAR_Project, build, mismatches
+
+from SAR_storage import LazyFields
+
+QUERIES = ('valencia', 'title:gobierno OR madrid', '"de la" AND NOT valencia', 'c*sa OR gob*', 'NOT madrid')
+
+
+class BinaryIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix='sar_test_')
+        cls.project = build(NEWS_2015, **FULL)
+        path = os.path.join(cls.tmp, 'index')
+        cls.project.save(path, binary=True)
+        cls.loaded = SAR_Project.load(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def test_references(self):
+        self.assertEqual(mismatches(self.loaded), [])
+
+    def test_same_postings(self):
+        for field in self.project.index:
+            index = self.project.index[field]
+            self.assertEqual(len(self.loaded.index[field]), len(index), field)
+            for term in list(index)[::500]:
+                self.assertEqual(dict(self.loaded.index[field][term].items()), index[term], (field, term))
+            self.assertNotIn('zzzz', self.loaded.index[field])
+
+    def test_same_news(self):
+        self.assertEqual(len(self.loaded.news), len(self.project.news))
+        for new in range(0, len(self.project.news), 97):
+            self.assertEqual(self.loaded.get_new(new), self.project.get_new(new), new)
+
+    def test_compressed(self):
+        project = build(MONTH, compress=True, **FULL)
+        path = os.path.join(self.tmp, 'compressed')
+        project.save(path, binary=True)
+        loaded = SAR_Project.load(path)
+        for query in ('valencia', '"de la"', 'c*sa OR gob*', 'NOT madrid'):
+            self.assertEqual(loaded.solve_query(query), project.solve_query(query), query)
+
+
+class LazyPickle(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix='sar_test_')
+        cls.project = build(MONTH, **FULL)
+        cls.lazy = build(MONTH, lazy=True, **FULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def reload(self, project, name):
+        path = os.path.join(self.tmp, name)
+        project.save(path)
+        return SAR_Project.load(path)
+
+    def test_plain_by_default(self):
+        loaded = self.reload(self.project, 'plain')
+        for name in SAR_Project.COMPONENTS:
+            self.assertNotIsInstance(getattr(loaded, name), LazyFields, name)
+        self.assertEqual(loaded.index, self.project.index)
+
+    def test_loaded_on_first_use(self):
+        loaded = self.reload(self.lazy, 'lazy')
+        self.assertIsInstance(loaded.index, LazyFields)
+        self.assertEqual(loaded.index.loaded, {})
+        loaded.solve_query('valencia')
+        self.assertEqual(list(loaded.index.loaded), ['article'])
+        # Las posiciones solo se leen con las consultas posicionales
+        self.assertEqual(loaded.index.loaded_pos, {})
+        loaded.solve_query('"de la"')
+        self.assertEqual(list(loaded.index.loaded_pos), ['article'])
+
+    def test_same_results(self):
+        loaded = self.reload(self.lazy, 'lazy')
+        for stemming in (False, True):
+            loaded.set_stemming(stemming)
+            self.project.set_stemming(stemming)
+            for query in QUERIES:
+                self.assertEqual(loaded.solve_query(query), self.project.solve_query(query), (query, stemming))
+        self.project.set_stemming(False)
+        loaded.set_stemming(False)
+        # Se puede volver a guardar sin haber cargado todos los campos
+        again = self.reload(loaded, 'again')
+        for query in QUERIES:
+            self.assertEqual(again.solve_query(query), self.project.solve_query(query), query)
+
+    def test_load_components(self):
+        loaded = self.reload(self.lazy, 'lazy')
+        loaded.load_components()
+        for name in SAR_Project.COMPONENTS:
+            self.assertNotIsInstance(getattr(loaded, name), LazyFields, name)
+        self.assertEqual(loaded.index, self.project.index)
+        self.assertEqual(loaded.sindex, self.project.sindex)
+
+    def test_fields_pickled_apart(self):
+        fields = LazyFields({'title': {'a': {1: [0, 3]}}, 'article': {'b': {2: [5]}}}, positional=True)
+        copy = pickle.loads(pickle.dumps(fields))
+        self.assertEqual(copy.positions('title', 'a'), {1: [0, 3]})
+        self.assertEqual(copy['title'], {'a': {1: 2}})
+        self.assertNotIn('article', copy.loaded)
+        self.assertEqual(copy.to_dict(), {'title': {'a': {1: [0, 3]}}, 'article': {'b': {2: [5]}}})
+
+
+if __name__ == '__main__':
+    unittest.main()
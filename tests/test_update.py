@@ -0,0 +1,127 @@
+"""
+Pruebas de la actualizacion de un indice (opcion -u de SAR_Indexer.py).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import MONTH, SAR_Project, run_script
+
+QUERIES = ('valencia', 'title:gobierno OR españa', '"de la"', 'gob*', 'NOT madrid AND presidente')
+
+OPTIONS = {'multifield': True, 'positional': True, 'stem': True, 'permuterm': True}
+
+
+def run_indexer(*args):
+    return run_script('SAR_Indexer.py', *args)
+
+
+class UpdateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='sar_test_')
+        self.news = os.path.join(self.tmp, 'news')
+        # Un par de dias de 2015 para indexar y otro par para añadir al actualizar
+        self.files = sorted(os.listdir(MONTH))[:4]
+        os.makedirs(self.news)
+        for filename in self.files[:2]:
+            shutil.copy(os.path.join(MONTH, filename), self.news)
+        self.month = MONTH
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def fresh(self, **options):
+        project = SAR_Project()
+        project.index_dir(self.news, **dict(OPTIONS, **options))
+        return project
+
+    def assertSameResults(self, updated, fresh):
+        self.assertEqual(len(updated.news), len(fresh.news))
+        for stemming in (False, True):
+            updated.set_stemming(stemming)
+            fresh.set_stemming(stemming)
+            for query in QUERIES:
+                self.assertEqual(len(updated.solve_query(query)), len(fresh.solve_query(query)), query)
+
+
+class UpdateIndex(UpdateTestCase):
+
+    def test_new_files(self):
+        project = self.fresh()
+        before = len(project.news)
+        for filename in self.files[2:]:
+            shutil.copy(os.path.join(self.month, filename), self.news)
+        self.assertEqual(project.update_dir(self.news), (2, 0))
+        self.assertGreater(len(project.news), before)
+        self.assertSameResults(project, self.fresh())
+        # Las noticias nuevas tienen newids mayores, las posting lists siguen ordenadas
+        for posting in project.index['article'].values():
+            self.assertEqual(list(posting), sorted(posting))
+
+    def test_nothing_changed(self):
+        project = self.fresh()
+        self.assertEqual(project.update_dir(self.news), (0, 0))
+
+    def test_modified_file(self):
+        project = self.fresh()
+        filename = os.path.join(self.news, self.files[0])
+        with open(filename) as fh:
+            news = json.load(fh)
+        with open(filename, 'w') as fh:
+            json.dump(news[:1], fh)
+        self.assertEqual(project.update_dir(self.news), (0, 1))
+        self.assertSameResults(project, self.fresh())
+
+    def test_compressed_and_compact(self):
+        for option in ('compress', 'compact'):
+            project = self.fresh(**{option: True})
+            for filename in self.files[2:]:
+                shutil.copy(os.path.join(self.month, filename), self.news)
+            project.update_dir(self.news)
+            self.assertSameResults(project, self.fresh())
+            for filename in self.files[2:]:
+                os.remove(os.path.join(self.news, filename))
+
+
+class UpdateBinaryIndex(UpdateTestCase):
+
+    def test_update_keeps_binary_format(self):
+        index = os.path.join(self.tmp, 'binu')
+        res = run_indexer(self.news, index, '-M', '-O', '-F', 'binary')
+        self.assertEqual(res.returncode, 0, res.stderr)
+        before = len(SAR_Project.load(index).news)
+
+        for filename in self.files[2:]:
+            shutil.copy(os.path.join(self.month, filename), self.news)
+        # Sin repetir -F el indice se guarda otra vez en el formato binario
+        res = run_indexer(self.news, index, '-u')
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertIn('Updated files: 2 new, 0 modified.', res.stdout)
+        self.assertTrue(os.path.isdir(index))
+
+        updated = SAR_Project.load(index)
+        fresh = os.path.join(self.tmp, 'fresh')
+        res = run_indexer(self.news, fresh, '-M', '-O', '-F', 'binary')
+        self.assertEqual(res.returncode, 0, res.stderr)
+        fresh = SAR_Project.load(fresh)
+        self.assertGreater(len(updated.news), before)
+        self.assertEqual(len(updated.news), len(fresh.news))
+        for query in QUERIES:
+            self.assertEqual(len(updated.solve_query(query)), len(fresh.solve_query(query)), query)
+
+    def test_update_rejects_other_format(self):
+        index = os.path.join(self.tmp, 'binu')
+        res = run_indexer(self.news, index, '-F', 'binary')
+        self.assertEqual(res.returncode, 0, res.stderr)
+        res = run_indexer(self.news, index, '-u', '-F', 'pickle')
+        self.assertNotEqual(res.returncode, 0)
+        self.assertIn('binary index', res.stderr)
+        self.assertTrue(os.path.isdir(index))
+
+
+if __name__ == '__main__':
+    unittest.main()
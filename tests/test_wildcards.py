@@ -0,0 +1,97 @@
+"""
+Pruebas de las consultas con comodines: indice permuterm e indice de k-gramas.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from fnmatch import fnmatchcase
+
+from common import FULL, MONTH, SAR_Project, build
+
+# Un solo comodin (permuterm)
+PATTERNS = ('c*sa', 'c?sa', 'val*', '*cia', 'ma?a', 'bar*na', 'gob*', '*', '?', 'zz*', 'valencia*', '*valencia')
+
+
+def matching(project, pattern, field='article'):
+    """
+    Terminos del indice que encajan con el patron, recorriendo todo el vocabulario.
+    """
+    return sorted(term for term in project.index[field] if fnmatchcase(term, pattern))
+
+
+class Permuterm(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, **FULL)
+
+    def test_terms(self):
+        for field in ('article', 'title', 'date'):
+            for pattern in PATTERNS + ('201*10', '2015-03-?1'):
+                self.assertEqual(sorted(self.project.get_permuterm_terms(pattern, field)),
+                                 matching(self.project, pattern, field), (field, pattern))
+
+    def test_sorted_keys(self):
+        for field in self.project.ptindex:
+            self.assertEqual(self.project.ptkeys[field], sorted(self.project.ptindex[field]), field)
+
+    def test_binary(self):
+        tmp = tempfile.mkdtemp(prefix='sar_test_')
+        try:
+            path = os.path.join(tmp, 'index')
+            self.project.save(path, binary=True)
+            loaded = SAR_Project.load(path)
+            for pattern in PATTERNS:
+                self.assertEqual(sorted(loaded.get_permuterm_terms(pattern)), matching(self.project, pattern), pattern)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def test_query(self):
+        project = self.project
+        for pattern in ('c*sa', 'val*', 'ma?a', 'zz*'):
+            expected = set()
+            for term in matching(project, pattern):
+                expected.update(project.index['article'][term])
+            self.assertEqual(project.solve_query(pattern), sorted(expected), pattern)
+
+class KGrams(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.project = build(MONTH, multifield=True, kgram=True)
+
+    def test_terms(self):
+        # Con k-gramas se admiten varios comodines en el mismo termino
+        patterns = PATTERNS + ('c*s*', '?a?a', '*ci*n', 'v*l*c*a', '??', 'de', 'a*b*c*d*e*')
+        for field in ('article', 'title'):
+            for pattern in patterns:
+                self.assertEqual(sorted(self.project.get_kgram_terms(pattern, field)),
+                                 matching(self.project, pattern, field), (field, pattern))
+
+    def test_same_as_permuterm(self):
+        permuterm = build(MONTH, **FULL)
+        for pattern in PATTERNS:
+            self.assertEqual(self.project.solve_query(pattern), permuterm.solve_query(pattern), pattern)
+
+    def test_update(self):
+        tmp = tempfile.mkdtemp(prefix='sar_test_')
+        try:
+            files = sorted(os.listdir(MONTH))
+            news = os.path.join(tmp, 'news')
+            os.makedirs(news)
+            shutil.copy(os.path.join(MONTH, files[0]), news)
+            project = SAR_Project()
+            project.index_dir(news, multifield=False, positional=False, stem=False, permuterm=False, kgram=True)
+            for filename in files[1:4]:
+                shutil.copy(os.path.join(MONTH, filename), news)
+            project.update_dir(news)
+            for pattern in ('c*s*', 'val*', '?a?a'):
+                self.assertEqual(sorted(project.get_kgram_terms(pattern)), matching(project, pattern), pattern)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()